@@ -0,0 +1,142 @@
+"""
+Throughput of the recording export done by each wrapper in _setup_recording().
+
+Only the export is timed: no sorter backend is needed because is_installed()
+is bypassed (see common.make_installed_sorter).
+"""
+import importlib
+import multiprocessing
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import spikeextractors as se
+
+from spikesorters import (KilosortSorter, Kilosort2Sorter, Kilosort2_5Sorter, KlustaSorter, SpykingcircusSorter,
+                          IronClustSorter, WaveClusSorter, CombinatoSorter, HDSortSorter, TridesclousSorter)
+
+from .common import (get_max_mb, get_recording_mb, make_memmap_recording, make_installed_sorter,
+                     get_peak_rss_mb, get_bench_folder)
+
+
+# sorter_name: (SorterClass, modules needed by the writer)
+export_cases = {
+    'kilosort': (KilosortSorter, []),  # int16 dat
+    'kilosort2': (Kilosort2Sorter, []),  # int16 dat
+    'kilosort2_5': (Kilosort2_5Sorter, []),  # int16 dat
+    'klusta': (KlustaSorter, []),  # int16 dat
+    'spykingcircus': (SpykingcircusSorter, []),  # float32 npy
+    'ironclust': (IronClustSorter, []),  # mda
+    'waveclus': (WaveClusSorter, ['scipy']),  # one .mat per channel
+    'combinato': (CombinatoSorter, ['h5py']),  # h5
+    'hdsort': (HDSortSorter, ['h5py']),  # Mea1k h5
+    'tridesclous': (TridesclousSorter, ['tridesclous']),  # float32 raw
+}
+
+channel_counts = [4, 32, 128, 384, 1024]
+durations_min = [1, 10, 60]
+
+
+def _check_case(sorter_name, num_channels, duration_min):
+    if get_recording_mb(num_channels, duration_min) > get_max_mb():
+        raise NotImplementedError('recording above SPIKESORTERS_BENCH_MAX_MB')
+    SorterClass, modules = export_cases[sorter_name]
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            raise NotImplementedError(f'{module} is not installed')
+    if sorter_name == 'hdsort' and not hasattr(se, 'Mea1kRecordingExtractor'):
+        raise NotImplementedError('this spikeextractors has no Mea1kRecordingExtractor')
+
+
+def _setup_case(sorter_name, num_channels, duration_min):
+    _check_case(sorter_name, num_channels, duration_min)
+    bench_folder = get_bench_folder()
+    recording = make_memmap_recording(bench_folder / 'recordings', num_channels, duration_min)
+    # wrap the binary file so that sorters able to read it directly (klusta, tridesclous)
+    # still go through their writer
+    recording = se.SubRecordingExtractor(recording)
+    SorterClass, _ = export_cases[sorter_name]
+    sorter = make_installed_sorter(SorterClass, bench_folder / 'fake_install')
+    output_folder = Path(tempfile.mkdtemp(prefix=f'export_{sorter_name}_', dir=bench_folder))
+    return recording, sorter, output_folder
+
+
+class ExportSuite:
+    params = (list(export_cases.keys()), channel_counts, durations_min)
+    param_names = ['sorter_name', 'num_channels', 'duration_min']
+    number = 1
+    repeat = 3
+    timeout = 3600
+
+    def setup(self, sorter_name, num_channels, duration_min):
+        self.recording, self.sorter, self.output_folder = _setup_case(sorter_name, num_channels, duration_min)
+
+    def teardown(self, sorter_name, num_channels, duration_min):
+        shutil.rmtree(self.output_folder, ignore_errors=True)
+
+    def time_setup_recording(self, sorter_name, num_channels, duration_min):
+        self.sorter._setup_recording(self.recording, self.output_folder)
+
+    def peakmem_setup_recording(self, sorter_name, num_channels, duration_min):
+        self.sorter._setup_recording(self.recording, self.output_folder)
+
+    def track_throughput(self, sorter_name, num_channels, duration_min):
+        t0 = time.perf_counter()
+        self.sorter._setup_recording(self.recording, self.output_folder)
+        t1 = time.perf_counter()
+        return get_recording_mb(num_channels, duration_min) / (t1 - t0)
+
+    track_throughput.unit = 'MB/s'
+
+
+def _run_one_case(sorter_name, num_channels, duration_min):
+    recording, sorter, output_folder = _setup_case(sorter_name, num_channels, duration_min)
+    try:
+        t0 = time.perf_counter()
+        sorter._setup_recording(recording, output_folder)
+        t1 = time.perf_counter()
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+    mb_per_s = get_recording_mb(num_channels, duration_min) / (t1 - t0)
+    return t1 - t0, mb_per_s, get_peak_rss_mb()
+
+
+def run_export_benchmark(sorter_names=None, channel_counts=channel_counts, durations_min=durations_min):
+    """
+    Run all export cases, each one in a fresh process, and print
+    run time, throughput and peak RSS.
+
+    Returns
+    -------
+    results: list of dict
+    """
+    if sorter_names is None:
+        sorter_names = list(export_cases.keys())
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    print('{:>14} {:>6} {:>6} {:>10} {:>10} {:>14}'.format('sorter', 'chans', 'min', 'time (s)', 'MB/s',
+                                                          'peak RSS (MB)'))
+    for sorter_name in sorter_names:
+        for num_channels in channel_counts:
+            for duration_min in durations_min:
+                try:
+                    _check_case(sorter_name, num_channels, duration_min)
+                except NotImplementedError:
+                    continue
+                with ctx.Pool(1) as pool:
+                    run_time, mb_per_s, peak_rss = pool.apply(_run_one_case,
+                                                                 (sorter_name, num_channels, duration_min))
+                print('{:>14} {:>6} {:>6} {:>10.2f} {:>10.1f} {:>14.1f}'.format(sorter_name, num_channels,
+                                                                                duration_min, run_time, mb_per_s,
+                                                                                peak_rss))
+                results.append(dict(sorter_name=sorter_name, num_channels=num_channels, duration_min=duration_min,
+                                    run_time=run_time, mb_per_s=mb_per_s, peak_rss_mb=peak_rss))
+    return results
+
+
+if __name__ == '__main__':
+    run_export_benchmark()
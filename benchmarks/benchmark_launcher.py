@@ -0,0 +1,169 @@
+"""
+Overhead of the run_sorters() engines measured with the mocksorter backend.
+
+The mocksorter does (almost) nothing, so what is measured here is the cost
+of the framework itself: serialization of the recordings, process spawning,
+folder creation, log dumping and result collection.
+"""
+import datetime
+import json
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+from spikesorters import run_sorters
+from spikesorters.launcher import _prepare_tasks
+from spikesorters.manifest import Manifest
+
+from .common import make_memmap_recording, get_bench_folder
+
+
+def _has_dask():
+    try:
+        import dask.distributed
+        return True
+    except ImportError:
+        return False
+
+
+def _make_recordings(num_tasks, num_channels=4, duration_min=1 / 6.):
+    recording = make_memmap_recording(get_bench_folder() / 'recordings', num_channels, duration_min)
+    # the same dumpable recording under different names: each name is a task
+    return {'rec_{}'.format(i): recording for i in range(num_tasks)}
+
+
+def _get_engine_kwargs(engine, n_workers):
+    if engine == 'multiprocessing':
+        return {'processes': n_workers}
+    elif engine == 'dask':
+        from dask.distributed import Client, LocalCluster
+        cluster = LocalCluster(n_workers=n_workers, threads_per_worker=1, processes=True)
+        return {'client': Client(cluster)}
+    return {}
+
+
+def _read_run_times(working_folder):
+    run_times = []
+    for log_file in Path(working_folder).glob('*/*/spikeinterface_log.json'):
+        with log_file.open('r', encoding='utf8') as f:
+            run_time = json.load(f).get('run_time', None)
+        if run_time is not None:
+            run_times.append(run_time)
+    return np.array(run_times)
+
+
+def _read_latencies(working_folder, submitted):
+    # time from the submission of the tasks to the manifest entry written when each task finished
+    latencies = []
+    for entry in Manifest(working_folder).iter_entries():
+        if entry['status'] == 'done':
+            # isoformat(): no fraction when the microseconds are 0
+            fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in entry['datetime'] else '%Y-%m-%dT%H:%M:%S'
+            done = datetime.datetime.strptime(entry['datetime'], fmt)
+            latencies.append((done - submitted).total_seconds())
+    return np.array(latencies)
+
+
+def measure_serialization(recording_dict, params):
+    """
+    Cost of building and pickling the tasks as the engines other than 'loop' send them
+    (launcher._prepare_tasks() with the recordings serialized).
+    """
+    working_folder = get_bench_folder() / 'launcher_serialization'
+    if working_folder.is_dir():
+        shutil.rmtree(working_folder)
+    t0 = time.perf_counter()
+    task_list, _, _, _, _ = _prepare_tasks(['mocksorter'], recording_dict, working_folder,
+                                           sorter_params={'mocksorter': params}, need_serialize=True,
+                                           task_order='lpt')
+    size = sum(len(pickle.dumps(task)) for task in task_list)
+    t1 = time.perf_counter()
+    return (t1 - t0) / len(task_list), size / len(task_list)
+
+
+def run_launcher_benchmark(engine, num_tasks=200, n_workers=4, sorter_params=None):
+    """
+    Run num_tasks mocksorter tasks through run_sorters(engine=...).
+
+    Returns
+    -------
+    metrics: dict
+        tasks_per_s, serialization_s and serialization_bytes per task, median in-sorter run time,
+        median and 95th percentile of the task latencies (from the submission to the end of each task).
+    """
+    if sorter_params is None:
+        sorter_params = {'sleep_s': 0., 'num_spikes': 100, 'seed': 0}
+    recording_dict = _make_recordings(num_tasks)
+    working_folder = get_bench_folder() / f'launcher_{engine}'
+    if working_folder.is_dir():
+        shutil.rmtree(working_folder)
+
+    engine_kwargs = _get_engine_kwargs(engine, n_workers)
+    submitted = datetime.datetime.now()
+    t0 = time.perf_counter()
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params={'mocksorter': sorter_params},
+                engine=engine, engine_kwargs=engine_kwargs, with_output=False)
+    t1 = time.perf_counter()
+    if engine == 'dask':
+        engine_kwargs['client'].close()
+
+    wall_time = t1 - t0
+    run_times = _read_run_times(working_folder)
+    latencies = _read_latencies(working_folder, submitted)
+    serialization_s, serialization_bytes = measure_serialization(recording_dict, sorter_params)
+    metrics = {
+        'engine': engine,
+        'num_tasks': num_tasks,
+        'wall_time': wall_time,
+        'tasks_per_s': num_tasks / wall_time,
+        'serialization_s': serialization_s,
+        'serialization_bytes': serialization_bytes,
+        'sorter_run_time': float(np.median(run_times)),
+        'latency_s': float(np.median(latencies)),
+        'latency_p95_s': float(np.percentile(latencies, 95)),
+    }
+    shutil.rmtree(working_folder)
+    return metrics
+
+
+class LauncherSuite:
+    params = (['loop', 'multiprocessing', 'dask'], [100, 500])
+    param_names = ['engine', 'num_tasks']
+    number = 1
+    repeat = 1
+    timeout = 3600
+
+    def setup(self, engine, num_tasks):
+        if engine == 'dask' and not _has_dask():
+            raise NotImplementedError('dask is not installed')
+
+    def track_tasks_per_s(self, engine, num_tasks):
+        return run_launcher_benchmark(engine, num_tasks=num_tasks)['tasks_per_s']
+
+    track_tasks_per_s.unit = 'tasks/s'
+
+    def track_latency(self, engine, num_tasks):
+        return run_launcher_benchmark(engine, num_tasks=num_tasks)['latency_s']
+
+    track_latency.unit = 's'
+
+    def track_latency_p95(self, engine, num_tasks):
+        return run_launcher_benchmark(engine, num_tasks=num_tasks)['latency_p95_s']
+
+    track_latency_p95.unit = 's'
+
+
+if __name__ == '__main__':
+    engines = ['loop', 'multiprocessing']
+    if _has_dask():
+        engines.append('dask')
+    print('{:>16} {:>6} {:>8} {:>12} {:>16} {:>12} {:>12}'.format('engine', 'tasks', 'tasks/s', 'serial. (ms)',
+                                                                   'serial. (bytes)', 'latency (ms)', 'p95 (ms)'))
+    for engine in engines:
+        m = run_launcher_benchmark(engine)
+        print('{:>16} {:>6} {:>8.1f} {:>12.2f} {:>16.0f} {:>12.1f} {:>12.1f}'.format(
+            engine, m['num_tasks'], m['tasks_per_s'], m['serialization_s'] * 1000, m['serialization_bytes'],
+            m['latency_s'] * 1000, m['latency_p95_s'] * 1000))
@@ -0,0 +1,117 @@
+"""
+Helpers shared by the benchmark suites.
+
+Benchmarks can be run with asv:
+
+    asv run --quick --bench export
+
+Or directly without asv (each case runs in a fresh process so that peak RSS is meaningful):
+
+    python -m benchmarks.benchmark_export
+
+The size of the generated recordings is bounded by the SPIKESORTERS_BENCH_MAX_MB environment
+variable (default 2048). Cases above the budget are skipped.
+"""
+import os
+import resource
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+import spikeextractors as se
+
+sampling_frequency = 30000.
+
+# bytes of one int16 sample of one channel
+_sample_bytes = 2
+
+
+def get_max_mb():
+    return float(os.getenv('SPIKESORTERS_BENCH_MAX_MB', 2048))
+
+
+def get_recording_mb(num_channels, duration_min):
+    num_frames = int(duration_min * 60 * sampling_frequency)
+    return num_channels * num_frames * _sample_bytes / 1024 ** 2
+
+
+def make_memmap_recording(folder, num_channels, duration_min, seed=0):
+    """
+    Generate a BinDatRecordingExtractor backed by an int16 file of noise.
+
+    The file is written chunk by chunk with a small repeated block of noise
+    so that generating hours of data stays cheap.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    num_frames = int(duration_min * 60 * sampling_frequency)
+    file_path = folder / f'noise_{num_channels}ch_{duration_min}min.raw'
+
+    if not file_path.is_file() or file_path.stat().st_size != num_frames * num_channels * _sample_bytes:
+        rng = np.random.RandomState(seed)
+        block_frames = int(sampling_frequency)
+        block = (rng.randn(block_frames, num_channels) * 20).astype('int16')
+        with open(file_path, mode='wb') as f:
+            n = 0
+            while n < num_frames:
+                n1 = min(n + block_frames, num_frames)
+                f.write(block[:n1 - n].tobytes())
+                n = n1
+
+    geom = np.zeros((num_channels, 2))
+    geom[:, 1] = np.arange(num_channels) * 20.
+    recording = se.BinDatRecordingExtractor(file_path, sampling_frequency, num_channels, 'int16',
+                                            time_axis=0, geom=geom)
+    return recording
+
+
+def make_installed_sorter(SorterClass, fake_path):
+    """
+    Instantiate a sorter without going through BaseSorter.__init__ and with
+    is_installed() bypassed, so that _setup_recording() can be timed alone.
+
+    External sorters read their installation path from a class attribute
+    (e.g. Kilosort2Sorter.kilosort2_path) to fill the matlab templates, so
+    missing paths are pointed to a dummy folder in the subclass (SorterClass
+    is not modified).
+    """
+    attrs = {'is_installed': classmethod(lambda cls: True)}
+    for name in dir(SorterClass):
+        if name.endswith('_path') and not callable(getattr(SorterClass, name)) \
+                and getattr(SorterClass, name) is None:
+            attrs[name] = str(fake_path)
+
+    InstalledClass = type(SorterClass.__name__, (SorterClass,), attrs)
+    sorter = InstalledClass.__new__(InstalledClass)
+    sorter.verbose = False
+    sorter.grouping_property = None
+    sorter.export_folder = None
+    sorter.params = SorterClass.default_params()
+    return sorter
+
+
+def get_peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on mac, kilobytes on linux
+        return rss / 1024 ** 2
+    return rss / 1024
+
+
+def get_folder_mb(folder):
+    total = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total / 1024 ** 2
+
+
+def get_bench_folder():
+    folder = os.getenv('SPIKESORTERS_BENCH_FOLDER', None)
+    if folder is None:
+        folder = Path(tempfile.gettempdir()) / 'spikesorters_bench'
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
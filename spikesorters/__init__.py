@@ -1,5 +1,13 @@
 from .sorterlist import *
 from .version import version as __version__
 from .basesorter import BaseSorter
-from .launcher import run_sorters, collect_sorting_outputs, iter_output_folders, iter_sorting_output
-
+from .launcher import (run_sorters, submit_sorters, SortingJobs, collect_sorting_outputs, iter_output_folders,
+                       iter_sorting_output, LazySortingOutputs)
+from .resultcache import ResultCache
+from .sweep import run_sorter_sweep
+from .concatenation import read_session_sortings
+from .manifest import rebuild_manifest
+from .trash import flush_folder_removals
+from .resources import InsufficientResourcesError
+from .sorter_tools import SorterTimeoutError, SorterMemoryError
+from .compactsorting import CompactSortingExtractor
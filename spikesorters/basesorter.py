@@ -25,13 +25,94 @@ import datetime
 import json
 import traceback
 import shutil
+import gzip
+import fnmatch
+import uuid
+import hashlib
+import asyncio
 from joblib import Parallel, delayed
 
 import numpy as np
 
 import spikeextractors as se
 from spikeextractors.baseextractor import _check_json
-from .sorter_tools import SpikeSortingError
+from .sorter_tools import (SpikeSortingError, SorterTimeoutError, SorterMemoryError, read_log_tail,
+                           recover_recording)
+from .trash import remove_folder
+from .compactsorting import (CompactSortingExtractor, write_compact_sorting, read_compact_sorting_info,
+                             compact_folder_name)
+from .timesplit import get_time_segments, stitch_time_segments
+from .spacesplit import get_spatial_partition, remove_halo_units
+from .resultcache import get_recording_fingerprint
+from .concatenation import copy_raw_files
+
+# stage markers of a group folder: written when the stage is finished, with the hash of what it depends on
+setup_done_filename = 'spikeinterface_setup_done.json'
+run_done_filename = 'spikeinterface_run_done.json'
+
+
+def _write_traces(recording, file_path, **kwargs):
+    # raw files (a session or concatenated sessions) of the exported dtype are copied without decoding
+    file_path = Path(file_path)
+    if file_path.suffix == '':
+        file_path = file_path.parent / (file_path.name + '.dat')
+    if not copy_raw_files(recording, file_path, **kwargs):
+        recording.write_to_binary_dat_format(file_path, **kwargs)
+
+
+def _link_file(src_file, dst_file):
+    # hard link, or symbolic link across filesystems, or copy
+    try:
+        os.link(str(src_file), str(dst_file))
+    except OSError:
+        try:
+            os.symlink(str(src_file), str(dst_file))
+        except OSError:
+            shutil.copy2(str(src_file), str(dst_file))
+
+
+def _copy_folder_content(src_folder, dst_folder, exclude=[]):
+    # copy all files of src_folder in dst_folder except the ones matching the exclude glob patterns
+    src_folder = Path(src_folder)
+    dst_folder = Path(dst_folder)
+    for root, dirs, files in os.walk(str(src_folder)):
+        root = Path(root)
+        rel_root = root.relative_to(src_folder)
+        os.makedirs(str(dst_folder / rel_root), exist_ok=True)
+        for name in files:
+            rel = str((rel_root / name).as_posix())
+            if any(fnmatch.fnmatch(rel, pattern) for pattern in exclude):
+                continue
+            shutil.copy2(str(root / name), str(dst_folder / rel_root / name))
+
+
+# text files in which the sorters write absolute paths (tridesclous info.json, phy params.py, configs...)
+_relocated_suffixes = ('.json', '.py', '.prm', '.prb', '.m', '.txt', '.params')
+
+
+def _relocate_paths(folder, old_folder, new_folder, max_bytes=10 * 1024 ** 2):
+    # replace the absolute paths of old_folder by the ones of new_folder in the small text files of folder
+    replacements = {}
+    for old in (Path(old_folder).absolute(), Path(old_folder).resolve()):
+        new = Path(new_folder).absolute()
+        for transform in (str, lambda path: path.as_posix(), lambda path: json.dumps(str(path))[1:-1]):
+            replacements[transform(old)] = transform(new)
+    # longest first: a path is not replaced by a shorter form of it
+    replacements = sorted(replacements.items(), key=lambda item: len(item[0]), reverse=True)
+    for root, dirs, files in os.walk(str(folder)):
+        for name in files:
+            file_path = Path(root) / name
+            if file_path.suffix not in _relocated_suffixes or file_path.stat().st_size > max_bytes:
+                continue
+            try:
+                txt = file_path.read_text(encoding='utf8')
+            except (UnicodeDecodeError, OSError):
+                continue
+            new_txt = txt
+            for old, new in replacements:
+                new_txt = new_txt.replace(old, new)
+            if new_txt != txt:
+                file_path.write_text(new_txt, encoding='utf8')
 
 
 class BaseSorter:
@@ -43,9 +124,19 @@ class BaseSorter:
     _params_description = {}
     sorter_description = ""
     installation_mesg = ""  # error message when not installed
+    runtime_trace_tail_lines = 50  # number of lines of the sorter log kept in spikeinterface_log.json
+    params_json_indent = None  # indent of spikeinterface_params.json, None is compact
+    intermediate_files = []  # glob patterns (relative to the output folder) of files not needed to read the result
+    cost_coefficient = 0.5  # rough run time in seconds per 1e6 channels x frames (prior of the run_sorters scheduler)
+    uses_matlab = False  # runs in matlab: one license per running task (see resources.get_task_resources())
+    # params that change the traces exported by _setup_recording() (None: unknown, all params), see sweep.py
+    setup_params = None
 
     def __init__(self, recording=None, output_folder=None, verbose=False,
-                 grouping_property=None, delete_output_folder=False):
+                 grouping_property=None, delete_output_folder=False, keep_intermediates=None,
+                 intermediates_folder=None, scratch_folder=None, split_by_time=None,
+                 split_by_space=None, resume=False, timeout_s=None, max_memory_mb=None, max_retries=0,
+                 retry_backoff_s=10., export_folder=None):
 
         assert self.is_installed(), """The sorter {} is not installed.
         Please install it with:  \n{} """.format(self.sorter_name, self.installation_mesg)
@@ -55,18 +146,64 @@ class BaseSorter:
                                    "Locations can be added to the RecordingExtractor by loading a probe file "
                                    "(.prb or .csv) or by setting them manually.")
 
+        if keep_intermediates is None:
+            # intermediate files are left on the scratch disk by default
+            keep_intermediates = 'keep' if scratch_folder is None else 'delete'
+        assert keep_intermediates in ('keep', 'delete', 'compress', 'move'), \
+            "keep_intermediates must be 'keep', 'delete', 'compress' or 'move'"
+        if keep_intermediates == 'move':
+            assert intermediates_folder is not None, "keep_intermediates='move' needs an intermediates_folder"
+            intermediates_folder = Path(intermediates_folder).absolute()
+        self.keep_intermediates = keep_intermediates
+        self.intermediates_folder = intermediates_folder
+
         self.verbose = verbose
         self.grouping_property = grouping_property
         self.params = self.default_params()
 
+        # limits of the program of each group (see _run()) and retries of the failed runs
+        if (timeout_s is not None or max_memory_mb is not None) and not self.is_external():
+            print('WARNING! timeout_s and max_memory_mb are only applied to the sorters running an external program, '
+                  'not to {}'.format(self.sorter_name))
+        assert max_retries >= 0, 'max_retries must be >= 0'
+        self.timeout_s = timeout_s
+        self.max_memory_mb = max_memory_mb
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+        # outcome of the last run: 'done', 'failed', 'timeout' or 'memory' and number of attempts
+        self.outcome = None
+        self.num_attempts = None
+
         if output_folder is None:
             output_folder = self.sorter_name + '_output'
         output_folder = Path(output_folder).absolute()
-
-        if output_folder.is_dir():
-            shutil.rmtree(str(output_folder))
-
-        if grouping_property is None:
+        root_output_folder = output_folder
+        self.root_output_folder = root_output_folder
+        self.root_recording = recording
+
+        # with resume the finished stages of the groups are kept (see _setup_folders() and _run_in_folders())
+        self.resume = resume
+        if resume:
+            assert scratch_folder is None, 'resume=True can not be used with a scratch_folder'
+        elif output_folder.is_dir():
+            remove_folder(output_folder)
+
+        self.split_by_space = split_by_space
+        self._spatial_cores = None
+        if split_by_space is not None:
+            # spatially compact groups with halo channels, halo units are removed in get_result() (see spacesplit.py)
+            assert grouping_property is None, 'split_by_space and grouping_property can not be used together'
+            if 'location' not in recording.get_shared_channel_property_names():
+                raise RuntimeError("split_by_space needs channel locations")
+            channels_per_group, halo_um = split_by_space
+            channel_ids = np.array(recording.get_channel_ids())
+            partition = get_spatial_partition(recording.get_channel_locations(), channels_per_group, halo_um)
+            self.recording_list = [se.SubRecordingExtractor(recording, channel_ids=channel_ids[channels].tolist())
+                                   for _, channels in partition]
+            self.output_folders = [output_folder / str(i) for i in range(len(partition))]
+            self._spatial_cores = [channel_ids[core].tolist() for core, _ in partition]
+            self._spatial_recording = recording
+        elif grouping_property is None:
             # only one groups
             self.recording_list = [recording]
             self.output_folders = [output_folder]
@@ -91,12 +228,47 @@ class BaseSorter:
                 locations = np.array([[0, i] for i in range(len(channel_ids))])
                 recording.set_channel_locations(locations)
 
+        # each group is sorted as overlapping time segments, stitched back in get_result() (see timesplit.py)
+        self.split_by_time = split_by_time
+        self.group_recordings = self.recording_list
+        self._time_segments = None
+        if split_by_time is not None:
+            segment_s, overlap_s = split_by_time
+            recording_list, output_folders, self._time_segments = [], [], []
+            for g, (recording, folder) in enumerate(zip(self.recording_list, self.output_folders)):
+                segments = get_time_segments(recording.get_num_frames(), recording.get_sampling_frequency(),
+                                             segment_s, overlap_s)
+                for j, (start_frame, end_frame) in enumerate(segments):
+                    recording_list.append(se.SubRecordingExtractor(recording, start_frame=start_frame,
+                                                                   end_frame=end_frame))
+                    output_folders.append(folder / 'segment{}'.format(j))
+                    self._time_segments.append((g, start_frame, end_frame))
+            self.recording_list = recording_list
+            self.output_folders = output_folders
+
         # make folders
         for output_folder in self.output_folders:
             if not output_folder.is_dir():
                 os.makedirs(str(output_folder))
         self.delete_folders = delete_output_folder
 
+        # with a scratch folder, run() works in a unique subfolder of it and copies back to output folders
+        if scratch_folder is not None:
+            scratch_folder = Path(scratch_folder).absolute() / '{}_{}'.format(self.sorter_name, uuid.uuid4().hex[:12])
+            # same tree as the output folder (groups, time segments)
+            self.scratch_folders = [scratch_folder / f.relative_to(root_output_folder) for f in self.output_folders]
+        else:
+            self.scratch_folders = None
+        self.scratch_folder = scratch_folder
+        self._final_output_folders = None
+
+        # traces exported by _write_binary() are written once in export_folder and linked in the output folders
+        self.export_folder = Path(export_folder).absolute() if export_folder is not None else None
+
+        # serialized recordings (make_serialized_dict()) and params of the last written params file, per group
+        self._recording_dicts = [None] * len(self.recording_list)
+        self._dumped_params = [None] * len(self.recording_list)
+
     @classmethod
     def default_params(cls):
         return copy.deepcopy(cls._default_params)
@@ -117,29 +289,143 @@ class BaseSorter:
         # dump parameters inside the folder with json
         self._dump_params()
 
+    def _get_recording_dict(self, i):
+        # the recording is serialized once: it can be slow for large property tables or long chains
+        # _check_json() works in place on objects shared with the extractor (key_properties...): the cached
+        # dict is a detached copy, otherwise it gets ndarrays back when the recording is used
+        if self._recording_dicts[i] is None:
+            d = _check_json(copy.deepcopy(self.recording_list[i].make_serialized_dict()))
+            self._recording_dicts[i] = json.loads(json.dumps(d))
+        return self._recording_dicts[i]
+
     def _dump_params(self):
-        for output_folder, recording in zip(self.output_folders, self.recording_list):
-            with open(str(output_folder / 'spikeinterface_params.json'), 'w', encoding='utf8') as f:
-                params = dict()
-                params['sorter_params'] = self.params
-                params['recording'] = recording.make_serialized_dict()
-                json.dump(_check_json(params), f, indent=4)
+        # the file is written only if the params changed or if the file was removed (folder reset)
+        sorter_params = _check_json(copy.deepcopy(self.params))
+        for i, output_folder in enumerate(self.output_folders):
+            params_file = output_folder / 'spikeinterface_params.json'
+            if self._dumped_params[i] == sorter_params and params_file.is_file():
+                continue
+            params = {'sorter_params': sorter_params, 'recording': self._get_recording_dict(i)}
+            with open(str(params_file), 'w', encoding='utf8') as f:
+                json.dump(params, f, indent=self.params_json_indent)
+            self._dumped_params[i] = sorter_params
 
     def run(self, raise_error=True, parallel=False, n_jobs=-1, joblib_backend='loky'):
-        for i, recording in enumerate(self.recording_list):
-            self._setup_recording(recording, self.output_folders[i])
+        self._enter_scratch_folders()
+        run_time = None
+        try:
+            run_time = self._run_in_folders(raise_error, parallel, n_jobs, joblib_backend)
+        finally:
+            self._leave_scratch_folders(run_time)
 
-        # dump again params because some sorter do a folder reset (tdc)
-        self._dump_params()
+        if run_time is not None and self.is_split():
+            self._write_split_result(run_time)
+        return run_time
 
-        now = datetime.datetime.now()
+    async def run_async(self, raise_error=True, executor=None):
+        """
+        Coroutine version of run() for the sorters running an external program (see runs_external_program()).
+
+        The program is a subprocess awaited by the event loop, its output is streamed to the log:
+        many sorters can wait for their program concurrently without one thread or process each.
+        The setup and the steps before and after the program (file IO) run in the executor
+        (None for the default executor of the loop).
+        The groups (or time segments) of the recording are run one after the other.
+        """
+        assert self.runs_external_program(), f"{self.sorter_name} does not run an external program"
+        # the running loop (get_running_loop() needs python 3.7)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(executor, self._enter_scratch_folders)
+        run_time = None
+        error = None
+        try:
+            log = await loop.run_in_executor(executor, self._setup_folders)
+            t0 = time.perf_counter()
+            todo = self._get_groups_to_run(log)
+            waited = 0.
+            for attempt in range(self.max_retries + 1):
+                try:
+                    for i in todo:
+                        recording, output_folder = self.recording_list[i], self.output_folders[i]
+                        shell_script = await loop.run_in_executor(executor, self._prepare_script, recording,
+                                                                  output_folder)
+                        retcode = await shell_script.run_async(timeout_s=self.timeout_s,
+                                                               max_memory_mb=self.max_memory_mb)
+                        self._check_stop_reason(shell_script)
+                        await loop.run_in_executor(executor, self._finalize_run, recording, output_folder, retcode)
+                        self._mark_stage_done(output_folder, run_done_filename, self._get_stage_hash(i))
+                    run_time = float(time.perf_counter() - t0 - waited)
+                    break
+                except Exception as err:
+                    delay = self._get_retry_delay(err, attempt, log)
+                    if delay is None:
+                        error = self._handle_run_error(err, log, raise_error)
+                        break
+                await asyncio.sleep(delay)
+                waited += delay
+                todo = [i for i in todo if not self._is_stage_done(i, run_done_filename)]
+            log['num_attempts'] = attempt + 1
+            await loop.run_in_executor(executor, self._write_run_logs, log, run_time)
+        finally:
+            await loop.run_in_executor(executor, self._leave_scratch_folders, run_time)
+        if error is not None:
+            raise error
+
+        if run_time is not None and self.is_split():
+            await loop.run_in_executor(executor, self._write_split_result, run_time)
+        return run_time
 
+    def _enter_scratch_folders(self):
+        # with a scratch folder all the steps are done in the scratch folders,
+        # then everything is copied back (on success and failure)
+        if self.scratch_folder is None:
+            return
+        for scratch_folder in self.scratch_folders:
+            os.makedirs(str(scratch_folder), exist_ok=True)
+        self._final_output_folders = self.output_folders
+        self.output_folders = self.scratch_folders
+
+    def _leave_scratch_folders(self, run_time):
+        if self.scratch_folder is None:
+            return
+        self.output_folders = self._final_output_folders
+        self._final_output_folders = None
+        # after a failure the intermediate files are not copied back
+        exclude = [] if run_time is not None else self.intermediate_files
+        for scratch_folder, output_folder in zip(self.scratch_folders, self.output_folders):
+            _copy_folder_content(scratch_folder, output_folder, exclude=exclude)
+            # the paths written by the sorter point to the scratch folder, which is removed
+            _relocate_paths(output_folder, scratch_folder, output_folder)
+        remove_folder(self.scratch_folder)
+
+    def is_split(self):
+        # True when the output folder only contains subfolders of time segments or spatial groups
+        return self._time_segments is not None or self._spatial_cores is not None
+
+    def _write_split_result(self, run_time):
+        # the assembled result and a log at the root of the output folder, so that the output folder
+        # can be read like any other one (get_result_from_folder(), run_sorters(), collect_sorting_outputs())
+        now = datetime.datetime.now()
+        sorting = self._assemble_result()
+        metadata = {'sorter_name': self.sorter_name, 'log_datetime': now.isoformat()}
+        write_compact_sorting(sorting, self.root_output_folder / compact_folder_name, metadata=metadata)
         log = {
             'sorter_name': str(self.sorter_name),
             'sorter_version': str(self.get_sorter_version()),
             'datetime': now,
-            'runtime_trace': []
+            'status': 'done',
+            'run_time': run_time,
+            'split_by_time': self.split_by_time,
+            'split_by_space': self.split_by_space,
+            'num_channels': int(self.root_recording.get_num_channels()),
+            'num_frames': int(self.root_recording.get_num_frames()),
+            'subfolders': [str(f.relative_to(self.root_output_folder)) for f in self.output_folders],
         }
+        with open(str(self.root_output_folder / 'spikeinterface_log.json'), 'w', encoding='utf8') as f:
+            json.dump(_check_json(log), f, indent=4)
+
+    def _run_in_folders(self, raise_error, parallel, n_jobs, joblib_backend):
+        log = self._setup_folders()
 
         t0 = time.perf_counter()
 
@@ -152,41 +438,190 @@ class BaseSorter:
                 raise RuntimeError("RecordingExtractor objects are not dumpable and can't be processed in parallel. "
                                    "Use parallel=False")
 
+        todo = self._get_groups_to_run(log)
+        run_time = None
+        error = None
+        waited = 0.
+        for attempt in range(self.max_retries + 1):
+            try:
+                if not parallel:
+                    for i in todo:
+                        self._run_and_mark(self.recording_list[i], self.output_folders[i], self._get_stage_hash(i))
+                else:
+                    Parallel(n_jobs=n_jobs, backend=joblib_backend)(
+                        delayed(self._run_and_mark)(self.recording_list[i].dump_to_dict(), self.output_folders[i],
+                                                    self._get_stage_hash(i))
+                        for i in todo)
+
+                t1 = time.perf_counter()
+                # the backoff delays of the retries are not part of the run time
+                run_time = float(t1 - t0 - waited)
+                break
+
+            except Exception as err:
+                delay = self._get_retry_delay(err, attempt, log)
+                if delay is None:
+                    error = self._handle_run_error(err, log, raise_error)
+                    break
+            time.sleep(delay)
+            waited += delay
+            # the groups finished before the failure are not run again (the setup is kept)
+            todo = [i for i in todo if not self._is_stage_done(i, run_done_filename)]
+        log['num_attempts'] = attempt + 1
+
+        self._write_run_logs(log, run_time)
+        # the log of a failed run is written before raising
+        if error is not None:
+            raise error
+        return run_time
+
+    def _get_stage_hash(self, i):
+        # what the stages of a group depend on: the sorter, its version, the params and the recording
+        txt = '\n'.join([self.sorter_name, str(self.get_sorter_version()),
+                         json.dumps(_check_json(copy.deepcopy(self.params)), separators=(',', ':')),
+                         json.dumps(self._get_recording_dict(i), separators=(',', ':'))])
+        return hashlib.sha1(txt.encode('utf8')).hexdigest()
+
+    def _is_stage_done(self, i, marker_filename):
+        marker_file = self.output_folders[i] / marker_filename
+        if not marker_file.is_file():
+            return False
         try:
-            if not parallel:
-                for i, recording in enumerate(self.recording_list):
-                    self._run(recording, self.output_folders[i])
-            else:
-                Parallel(n_jobs=n_jobs, backend=joblib_backend)(
-                    delayed(self._run)(rec.dump_to_dict(), output_folder)
-                    for (rec, output_folder) in zip(self.recording_list, self.output_folders))
+            with open(str(marker_file), 'r', encoding='utf8') as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return marker.get('hash', None) == self._get_stage_hash(i)
 
-            t1 = time.perf_counter()
-            run_time = float(t1 - t0)
+    @staticmethod
+    def _mark_stage_done(output_folder, marker_filename, stage_hash):
+        marker = {'hash': stage_hash, 'datetime': datetime.datetime.now()}
+        with open(str(Path(output_folder) / marker_filename), 'w', encoding='utf8') as f:
+            json.dump(_check_json(marker), f)
+
+    def _run_and_mark(self, recording, output_folder, stage_hash):
+        self._run(recording, output_folder)
+        self._mark_stage_done(output_folder, run_done_filename, stage_hash)
+
+    def _get_groups_to_run(self, log):
+        # with resume, the groups whose run is done with the same hash are not run again
+        if not self.resume:
+            return list(range(len(self.recording_list)))
+        done = [i for i in range(len(self.recording_list)) if self._is_stage_done(i, run_done_filename)]
+        log['resumed_runs'] = done
+        return [i for i in range(len(self.recording_list)) if i not in done]
+
+    def _setup_folders(self):
+        # setup all the recordings and start the log of the run
+        t0 = time.perf_counter()
+        resumed_setups = []
+        for i, recording in enumerate(self.recording_list):
+            if self.resume:
+                if self._is_stage_done(i, setup_done_filename):
+                    resumed_setups.append(i)
+                    continue
+                # unfinished or invalidated (other params or recording): the group starts from scratch
+                remove_folder(self.output_folders[i])
+                os.makedirs(str(self.output_folders[i]))
+            self._setup_recording(recording, self.output_folders[i])
+            self._mark_stage_done(self.output_folders[i], setup_done_filename, self._get_stage_hash(i))
+        setup_time = float(time.perf_counter() - t0)
 
-        except Exception as err:
-            if raise_error:
-                raise SpikeSortingError(f"Spike sorting failed: {err}. You can inspect the runtime trace in "
-                                        f"the {self.sorter_name}.log of the output folder.'")
-            else:
-                run_time = None
-                log['error'] = True
-                log['error_trace'] = traceback.format_exc()
+        # dump again params because some sorter do a folder reset (tdc)
+        self._dump_params()
 
+        log = {
+            'sorter_name': str(self.sorter_name),
+            'sorter_version': str(self.get_sorter_version()),
+            'datetime': datetime.datetime.now(),
+            'setup_time': setup_time,
+            'limits': {'timeout_s': self.timeout_s, 'max_memory_mb': self.max_memory_mb,
+                       'max_retries': self.max_retries, 'retry_backoff_s': self.retry_backoff_s},
+        }
+        if self.resume:
+            log['resumed_setups'] = resumed_setups
+        return log
+
+    @staticmethod
+    def _get_outcome(err):
+        if isinstance(err, SorterTimeoutError):
+            return 'timeout'
+        if isinstance(err, SorterMemoryError):
+            return 'memory'
+        return 'failed'
+
+    def _get_retry_delay(self, err, attempt, log):
+        # the backoff delay before the next attempt, None when there is no retry left
+        if attempt >= self.max_retries:
+            return None
+        delay = self.retry_backoff_s * 2 ** attempt
+        log.setdefault('failed_attempts', []).append({'outcome': self._get_outcome(err), 'error_message': str(err),
+                                                      'datetime': datetime.datetime.now()})
+        print('WARNING! {} attempt {} failed ({}), retry in {:0.1f}s'.format(self.sorter_name, attempt + 1, err,
+                                                                             delay))
+        return delay
+
+    def _handle_run_error(self, err, log, raise_error):
+        # must be called in the except clause (for the traceback)
+        # return the error to raise once the log is written (None if raise_error=False)
+        log['error'] = True
+        log['outcome'] = self._get_outcome(err)
+        log['error_message'] = str(err)
+        log['error_trace'] = traceback.format_exc()
+        if not raise_error:
+            return None
+        # the limit errors keep their type
+        error_class = type(err) if log['outcome'] != 'failed' else SpikeSortingError
+        error = error_class(f"Spike sorting failed: {err}. You can inspect the runtime trace in "
+                            f"the {self.sorter_name}.log of the output folder.'")
+        error.__cause__ = err
+        return error
+
+    def _check_stop_reason(self, shell_script):
+        # raise when the ShellScript was stopped because it exceeded timeout_s or max_memory_mb
+        reason = shell_script.stopReason()
+        if reason == 'timeout':
+            raise SorterTimeoutError(f"{self.sorter_name} was stopped after timeout_s={self.timeout_s}s")
+        if reason == 'memory':
+            raise SorterMemoryError(f"{self.sorter_name} was stopped for using more than "
+                                    f"max_memory_mb={self.max_memory_mb}")
+
+    def _write_run_logs(self, log, run_time):
+        log['status'] = 'done' if run_time is not None else 'failed'
         log['run_time'] = run_time
+        if run_time is not None:
+            log['outcome'] = 'done'
+        self.outcome = log['outcome']
+        self.num_attempts = log['num_attempts']
+
+        # intermediate files are only touched when the result could be read back
+        result_ok = [False] * len(self.output_folders)
+        if run_time is not None:
+            result_ok = self._write_compact_results(log['datetime'])
 
         # dump log inside folders
+        # the runtime trace is not copied: only its path, the byte offsets of this run and its last lines
+        # the sorter log is truncated by each run (ShellScript, MockSorter): this run starts at 0
         for i in range(len(self.output_folders)):
             output_folder = self.output_folders[i]
+            # the size of the sorted data, used to learn run time coefficients (see scheduler.py)
+            log['num_channels'] = int(self.recording_list[i].get_num_channels())
+            log['num_frames'] = int(self.recording_list[i].get_num_frames())
             runtime_trace_path = output_folder / f'{self.sorter_name}.log'
-            runtime_trace = []
             if runtime_trace_path.is_file():
-                with open(runtime_trace_path, 'r') as fp:
-                    line = fp.readline()
-                    while line:
-                        runtime_trace.append(line.strip())
-                        line = fp.readline()
-            log['runtime_trace'] = runtime_trace
+                tail, size = read_log_tail(runtime_trace_path, max_lines=self.runtime_trace_tail_lines)
+                log['runtime_trace_path'] = runtime_trace_path.name
+                log['runtime_trace_offsets'] = [0, size]
+                log['runtime_trace_tail'] = tail
+            else:
+                log['runtime_trace_path'] = None
+                log['runtime_trace_offsets'] = None
+                log['runtime_trace_tail'] = []
+            if self.keep_intermediates != 'keep':
+                if result_ok[i]:
+                    log['intermediates'] = self._handle_intermediates(i)
+                else:
+                    log['intermediates'] = {'policy': 'keep', 'files': [], 'freed_bytes': 0}
             with open(str(output_folder / 'spikeinterface_log.json'), 'w', encoding='utf8') as f:
                 json.dump(_check_json(log), f, indent=4)
 
@@ -194,9 +629,7 @@ class BaseSorter:
             if run_time is None:
                 print('Error running', self.sorter_name)
             else:
-                print('{} run time {:0.2f}s'.format(self.sorter_name, t1 - t0))
-
-        return run_time
+                print('{} run time {:0.2f}s'.format(self.sorter_name, run_time))
 
     @staticmethod
     def get_sorter_version():
@@ -208,6 +641,26 @@ class BaseSorter:
         # need be implemented in subclass
         raise NotImplemenetdError
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        """
+        Estimate the resources needed to sort ONE recording (or SubExtractor) with the full params.
+
+        Returns
+        -------
+        estimate: dict
+            'disk_bytes', 'scratch_bytes' and 'peak_ram_bytes' (see resources.py)
+        """
+        # need be implemented in subclass
+        raise NotImplementedError
+
+    @classmethod
+    def get_num_cores(cls, params):
+        """
+        Number of cores used by the sorter with the full params (see resources.get_task_resources()).
+        """
+        return 1
+
     def _setup_recording(self, recording, output_folder):
         # need be implemented in subclass
         # this setup ONE recording (or SubExtractor)
@@ -215,44 +668,231 @@ class BaseSorter:
         # this must take care of geometry file (ORB, CSV, ...)
         raise NotImplementedError
 
+    def _write_binary(self, recording, file_path, **kwargs):
+        # write the traces of ONE recording in a binary file, kwargs of write_to_binary_dat_format()
+        # with an export_folder the file is shared by all the runs on the same traces with the same kwargs
+        if self.export_folder is None:
+            _write_traces(recording, file_path, **kwargs)
+            return
+        file_path = Path(file_path)
+        if file_path.suffix == '':
+            # as write_to_binary_dat_format()
+            file_path = file_path.parent / (file_path.name + '.dat')
+        txt = json.dumps(_check_json(dict(kwargs, recording=get_recording_fingerprint(recording))), sort_keys=True)
+        export_file = self.export_folder / (hashlib.sha1(txt.encode('utf8')).hexdigest() + file_path.suffix)
+        if not export_file.is_file():
+            os.makedirs(str(self.export_folder), exist_ok=True)
+            # write then rename: concurrent runs never link a partial file
+            tmp_file = self.export_folder / ('.tmp_' + uuid.uuid4().hex[:12] + export_file.suffix)
+            _write_traces(recording, tmp_file, **kwargs)
+            os.replace(str(tmp_file), str(export_file))
+        elif self.verbose:
+            print('Use exported traces', export_file)
+        _link_file(export_file, file_path)
+
     def _run(self, recording, output_folder):
         # need be implemented in subclass
         # this run the sorter on ONE recording (or SubExtractor)
-        # this must run or generate the command line to run the sorter for one recording
+        # the sorters running an external program implement _prepare_script() and _finalize_run() instead
+        recording = recover_recording(recording)
+        shell_script = self._prepare_script(recording, output_folder)
+        shell_script.start(timeout_s=self.timeout_s, max_memory_mb=self.max_memory_mb)
+        retcode = shell_script.wait()
+        self._check_stop_reason(shell_script)
+        self._finalize_run(recording, output_folder, retcode)
+
+    @classmethod
+    def is_external(cls):
+        # True for the sorters running an external program (they can be run by run_async())
+        return cls._prepare_script is not BaseSorter._prepare_script
+
+    def runs_external_program(self):
+        # True if this run (with these params) is an external program: overridden when it depends on the params
+        return self.is_external()
+
+    def _prepare_script(self, recording, output_folder):
+        # implemented in subclass for sorters running an external program
+        # this write the files and return the ShellScript (not started) running the sorter on ONE recording
+        raise NotImplementedError
+
+    def _finalize_run(self, recording, output_folder, retcode):
+        # implemented in subclass for sorters running an external program
+        # this check the return code and the output of the ShellScript of _prepare_script()
         raise NotImplementedError
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
+        # need be implemented in subclass
+        # this read the sorter native output of ONE output folder
         raise NotImplementedError
 
+    @staticmethod
+    def _has_valid_compact_result(output_folder):
+        # the compact copy of the result is valid when it matches the last run (same log datetime)
+        output_folder = Path(output_folder)
+        compact_folder = output_folder / compact_folder_name
+        log_file = output_folder / 'spikeinterface_log.json'
+        if compact_folder.is_dir() and log_file.is_file():
+            with open(str(log_file), 'r', encoding='utf8') as f:
+                log_datetime = json.load(f).get('datetime', None)
+            info = read_compact_sorting_info(compact_folder)
+            return log_datetime is not None and info['metadata'].get('log_datetime', None) == log_datetime
+        return False
+
+    @classmethod
+    def get_result_from_folder(cls, output_folder):
+        # the compact copy is used when valid otherwise the native output is parsed
+        output_folder = Path(output_folder)
+        if cls._has_valid_compact_result(output_folder):
+            return CompactSortingExtractor(output_folder / compact_folder_name)
+        return cls._get_result_from_folder(output_folder)
+
+    @classmethod
+    def ensure_compact_result(cls, output_folder):
+        """
+        Parse the native output of a finished run and write its compact copy if it
+        is missing or outdated. Return True if a valid compact copy exists after the call.
+        """
+        output_folder = Path(output_folder)
+        if cls._has_valid_compact_result(output_folder):
+            return True
+        log_file = output_folder / 'spikeinterface_log.json'
+        if not log_file.is_file():
+            return False
+        with open(str(log_file), 'r', encoding='utf8') as f:
+            log_datetime = json.load(f).get('datetime', None)
+        if log_datetime is None:
+            return False
+        sorting = cls._get_result_from_folder(output_folder)
+        metadata = {'sorter_name': cls.sorter_name, 'log_datetime': log_datetime}
+        try:
+            write_compact_sorting(sorting, output_folder / compact_folder_name, metadata=metadata)
+        except ValueError:
+            # spike features which can not be stored in the compact format: the native output is read
+            return False
+        return True
+
+    def _write_compact_results(self, log_datetime):
+        # parse the native output once and save it in the compact format for fast later reading
+        # return for each group if it succeeded
+        result_ok = []
+        for recording, output_folder in zip(self.recording_list, self.output_folders):
+            try:
+                sorting = self._get_result_from_folder(output_folder)
+                sorting.set_sampling_frequency(recording.get_sampling_frequency())
+                metadata = {'sorter_name': self.sorter_name, 'log_datetime': log_datetime.isoformat()}
+                write_compact_sorting(sorting, output_folder / compact_folder_name, metadata=metadata)
+                result_ok.append(True)
+            except Exception as err:
+                print('WARNING! Could not write the compact result of {}: {}'.format(output_folder, err))
+                result_ok.append(False)
+        return result_ok
+
+    def _handle_intermediates(self, i):
+        # apply the keep_intermediates policy to the declared intermediate files of ONE output folder
+        output_folder = self.output_folders[i]
+        # the subfolders (groups, segments) of the final output folder are mirrored when moving
+        final_output_folder = output_folder if self._final_output_folders is None else self._final_output_folders[i]
+        destination = None
+        if self.keep_intermediates == 'move':
+            destination = self.intermediates_folder / final_output_folder.relative_to(self.root_output_folder)
+        files = []
+        for pattern in self.intermediate_files:
+            files.extend(sorted(f for f in output_folder.glob(pattern) if f.is_file()))
+        freed_bytes = 0
+        for f in files:
+            size = f.stat().st_size
+            if self.keep_intermediates == 'delete':
+                f.unlink()
+                freed_bytes += size
+            elif self.keep_intermediates == 'compress':
+                gz_file = f.parent / (f.name + '.gz')
+                with open(str(f), 'rb') as src, gzip.open(str(gz_file), 'wb', compresslevel=1) as dst:
+                    shutil.copyfileobj(src, dst, 16 * 1024 ** 2)
+                f.unlink()
+                freed_bytes += size - gz_file.stat().st_size
+            elif self.keep_intermediates == 'move':
+                dst = destination / f.relative_to(output_folder)
+                os.makedirs(str(dst.parent), exist_ok=True)
+                shutil.move(str(f), str(dst))
+                freed_bytes += size
+        if self.verbose and len(files) > 0:
+            print('{} intermediate files: {} MB freed'.format(self.keep_intermediates, freed_bytes / 1024 ** 2))
+        intermediates = {'policy': self.keep_intermediates,
+                         'files': [str(f.relative_to(output_folder)) for f in files], 'freed_bytes': int(freed_bytes)}
+        if destination is not None:
+            intermediates['destination'] = str(destination)
+        return intermediates
+
+    def get_channel_frames(self):
+        # total number of channels x frames sorted (all groups and segments)
+        return int(sum(rec.get_num_channels() * rec.get_num_frames() for rec in self.recording_list))
+
     def get_result_list(self):
         sorting_list = []
         for i, _ in enumerate(self.recording_list):
             sorting = self.get_result_from_folder(self.output_folders[i])
+            if self.delete_folders and isinstance(sorting, CompactSortingExtractor):
+                sorting.load_in_memory()
             sorting_list.append(sorting)
         return sorting_list
 
+    def _stitch_time_segments(self, sorting_list):
+        # one sorting per group, in the time of the group recording
+        stitched = []
+        for g, recording in enumerate(self.group_recordings):
+            inds = [i for i, (group, _, _) in enumerate(self._time_segments) if group == g]
+            segments = [self._time_segments[i][1:] for i in inds]
+            stitched.append(stitch_time_segments(recording, [sorting_list[i] for i in inds], segments))
+        return stitched
+
+    def _remove_halo_units(self, sorting_list):
+        # a unit seen by several spatial groups is kept by the group owning its peak channel
+        kept_list = []
+        for i, sorting in enumerate(sorting_list):
+            if sorting is None:
+                kept_list.append(None)
+                continue
+            sorting = remove_halo_units(self._spatial_recording, sorting, self._spatial_cores[i])
+            for unit in sorting.get_unit_ids():
+                sorting.set_unit_property(unit, 'spatial_group', i)
+            kept_list.append(sorting)
+        return kept_list
+
     def get_result(self):
+        sorting = self._assemble_result()
+        if self.delete_folders:
+            # split output folders are removed with their root (which holds the assembled result)
+            folders = [self.root_output_folder] if self.is_split() else self.output_folders
+            for out in folders:
+                if self.verbose:
+                    print("Removing ", str(out))
+                remove_folder(out)
+        return sorting
+
+    def _assemble_result(self):
         sorting_list = self.get_result_list()
+        recording_list = self.recording_list
+        if self._time_segments is not None:
+            sorting_list = self._stitch_time_segments(sorting_list)
+            recording_list = self.group_recordings
+        if self._spatial_cores is not None:
+            sorting_list = self._remove_halo_units(sorting_list)
         if len(sorting_list) == 1:
             sorting = sorting_list[0]
         else:
-            for i, sorting in enumerate(sorting_list):
-                property_name = self.recording_list[i].get_channel_property(self.recording_list[i].get_channel_ids()[0],
-                                                                            self.grouping_property)
-                if sorting is not None:
-                    for unit in sorting.get_unit_ids():
-                        sorting.set_unit_property(unit, self.grouping_property, property_name)
+            if self.grouping_property is not None:
+                for i, sorting in enumerate(sorting_list):
+                    property_name = recording_list[i].get_channel_property(recording_list[i].get_channel_ids()[0],
+                                                                           self.grouping_property)
+                    if sorting is not None:
+                        for unit in sorting.get_unit_ids():
+                            sorting.set_unit_property(unit, self.grouping_property, property_name)
 
             # reassemble the sorting outputs
             sorting_list = [sort for sort in sorting_list if sort is not None]
             multi_sorting = se.MultiSortingExtractor(sortings=sorting_list)
             sorting = multi_sorting
 
-        if self.delete_folders:
-            for out in self.output_folders:
-                if self.verbose:
-                    print("Removing ", str(out))
-                shutil.rmtree(str(out), ignore_errors=True)
         sorting.set_sampling_frequency(self.recording_list[0].get_sampling_frequency())
         return sorting
@@ -5,8 +5,8 @@ import sys
 
 import spikeextractors as se
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, python_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import recover_recording
 
 try:
     import h5py
@@ -38,6 +38,8 @@ class CombinatoSorter(BaseSorter):
     sorter_name: str = 'combinato'
     combinato_path: Union[str, None] = os.getenv('COMBINATO_PATH', None)
     requires_locations = False
+    cost_coefficient = 0.3
+    intermediate_files = ['recording.h5']
     _default_params = {
         'detect_sign': -1,  # -1 - 1 - 0
         'MaxClustersPerTemp': 5,
@@ -115,6 +117,13 @@ class CombinatoSorter(BaseSorter):
         except Exception as e:
             print("Could not set COMBINATO_PATH environment variable:", e)
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # recording.h5 with the first channel only, loaded at once
+        channel_nbytes = get_recording_bytes(recording) // recording.get_num_channels()
+        return make_estimate(disk_bytes=2 * channel_nbytes, scratch_bytes=channel_nbytes,
+                             peak_ram_bytes=python_ram_bytes + 2 * channel_nbytes)
+
     def _setup_recording(self, recording, output_folder):
         if not self.is_installed():
             raise Exception(CombinatoSorter.installation_mesg)
@@ -129,9 +138,7 @@ class CombinatoSorter(BaseSorter):
         f.create_dataset("data", data=recording.get_traces(channel_ids=[chid]).flatten())
         f.close()
 
-    def _run(self, recording, output_folder):
-        recording = recover_recording(recording)
-
+    def _prepare_script(self, recording, output_folder):
         p = self.params.copy()
         p['threshold_factor'] = p.pop('detect_threshold')
         sign_thr = p.pop('detect_sign')
@@ -173,15 +180,14 @@ class CombinatoSorter(BaseSorter):
                                      sign_thr=sign_thr)
         shell_cmd = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                 log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_cmd.start()
-
-        retcode = shell_cmd.wait()
+        return shell_cmd
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('combinato returned a non-zero exit code')
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
 
         output_folder = Path(output_folder)
         result_fname = str(output_folder / 'recording')
@@ -0,0 +1,261 @@
+"""
+A compact, columnar format for sorting outputs.
+
+A sorting is stored in a folder with:
+  * spike_times.npy: all spike frames, grouped by unit and sorted in time inside each unit
+  * spike_labels.npy: the unit id of each spike (ascending)
+  * unit_ids.npy: the unit ids (ascending)
+  * spike_feature<i>.npy: the values of a spike feature (amplitudes, pc_features...) for all the units
+    having it, grouped by unit in the order of spike_times
+  * unit_array_properties.npz: the unit properties which are arrays (templates...)
+  * sorting_info.json: sampling frequency, unit properties, spike feature index and free metadata
+
+This is much faster to open than most sorter native outputs and arrays are
+memory-mapped, so opening thousands of them is cheap.
+"""
+from pathlib import Path
+import json
+import os
+import shutil
+
+import numpy as np
+
+import spikeextractors as se
+from spikeextractors.baseextractor import _check_json
+from spikeextractors.extraction_tools import check_get_unit_spike_train
+
+# name of the compact sorting folder inside an output folder
+compact_folder_name = 'spikeinterface_sorting'
+
+
+def write_compact_sorting(sorting, folder_path, metadata=None):
+    """
+    Write a SortingExtractor in the compact format.
+
+    The folder is written next to its final location and then renamed so that a
+    concurrent reader never sees a half written sorting.
+
+    Parameters
+    ----------
+    sorting: SortingExtractor
+        The sorting to be saved
+    folder_path: str or Path
+        The folder to be created (replaced if it exists)
+    metadata: dict or None
+        Extra json-serializable info saved in sorting_info.json
+    """
+    folder_path = Path(folder_path)
+    tmp_folder = folder_path.parent / (folder_path.name + '.tmp{}'.format(os.getpid()))
+    if tmp_folder.is_dir():
+        shutil.rmtree(str(tmp_folder))
+    os.makedirs(str(tmp_folder))
+
+    arrays = get_compact_arrays(sorting)
+    for name in ('spike_times', 'spike_labels', 'unit_ids'):
+        np.save(str(tmp_folder / (name + '.npy')), arrays[name])
+
+    spike_features = {}
+    for i, (feature_name, feature) in enumerate(arrays['spike_features'].items()):
+        file_name = 'spike_feature{}.npy'.format(i)
+        np.save(str(tmp_folder / file_name), feature['values'])
+        spike_features[feature_name] = {'file': file_name, 'units': feature['units']}
+
+    # the array properties are kept as arrays
+    unit_properties = {}
+    array_properties = {}
+    array_properties_index = {}
+    for unit_id, props in arrays['unit_properties'].items():
+        unit_properties[unit_id] = {}
+        for prop_name, value in props.items():
+            if isinstance(value, np.ndarray):
+                key = 'p{}'.format(len(array_properties))
+                array_properties[key] = value
+                array_properties_index.setdefault(unit_id, {})[prop_name] = key
+            else:
+                unit_properties[unit_id][prop_name] = value
+    if len(array_properties) > 0:
+        np.savez(str(tmp_folder / 'unit_array_properties.npz'), **array_properties)
+
+    info = dict()
+    info['sampling_frequency'] = arrays['sampling_frequency']
+    info['unit_properties'] = unit_properties
+    info['unit_array_properties'] = array_properties_index
+    info['spike_features'] = spike_features
+    info['metadata'] = metadata if metadata is not None else {}
+    with (tmp_folder / 'sorting_info.json').open('w', encoding='utf8') as f:
+        json.dump(_check_json(info), f)
+
+    if folder_path.is_dir():
+        shutil.rmtree(str(folder_path))
+    os.rename(str(tmp_folder), str(folder_path))
+
+
+def get_compact_arrays(sorting):
+    """
+    The content of the compact format in memory: a dict with 'spike_times', 'spike_labels', 'unit_ids' arrays,
+    'sampling_frequency', 'unit_properties' and 'spike_features' (feature name -> 'values' of all the units
+    and 'units': unit id -> [start, stop] in 'values').
+    This is cheap to send between processes (see CompactArraysSortingExtractor).
+
+    A ValueError is raised if the values of a spike feature can not be stored in one array
+    (different shapes across units): the native output must be read.
+    """
+    unit_ids = np.sort(np.array(sorting.get_unit_ids(), dtype='int64'))
+    times_list = []
+    labels_list = []
+    unit_properties = {}
+    feature_values = {}
+    feature_units = {}
+    for unit_id in unit_ids:
+        times = np.asarray(sorting.get_unit_spike_train(unit_id=unit_id)).astype('int64')
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        times_list.append(times)
+        labels_list.append(np.full(times.size, unit_id, dtype='int64'))
+        props = {}
+        for prop_name in sorting.get_unit_property_names(unit_id):
+            props[prop_name] = sorting.get_unit_property(unit_id, prop_name)
+        unit_properties[str(unit_id)] = props
+
+        # the spike features follow the time order of the spikes
+        inverse_order = np.argsort(order)
+        for feature_name in sorting.get_unit_spike_feature_names(unit_id):
+            values = np.asarray(sorting.get_unit_spike_features(unit_id, feature_name))
+            if feature_name.endswith('_idxs'):
+                # indexes of the spikes having a (partial) feature
+                values = inverse_order[values.astype('int64')]
+            elif len(values) == len(order):
+                values = values[order]
+            values_list = feature_values.setdefault(feature_name, [])
+            start = sum(len(v) for v in values_list)
+            values_list.append(values)
+            feature_units.setdefault(feature_name, {})[str(unit_id)] = [start, start + len(values)]
+
+    spike_features = {}
+    for feature_name, values_list in feature_values.items():
+        try:
+            values = np.concatenate(values_list, axis=0)
+        except ValueError:
+            raise ValueError('The spike feature {} has different shapes across units'.format(feature_name))
+        if values.dtype.kind == 'O':
+            raise ValueError('The spike feature {} is not a numeric array'.format(feature_name))
+        spike_features[feature_name] = {'values': values, 'units': feature_units[feature_name]}
+
+    if len(unit_ids) > 0:
+        spike_times = np.concatenate(times_list)
+        spike_labels = np.concatenate(labels_list)
+    else:
+        spike_times = np.zeros(0, dtype='int64')
+        spike_labels = np.zeros(0, dtype='int64')
+
+    return {'spike_times': spike_times, 'spike_labels': spike_labels, 'unit_ids': unit_ids,
+            'sampling_frequency': sorting.get_sampling_frequency(), 'unit_properties': unit_properties,
+            'spike_features': spike_features}
+
+
+def _set_compact_features(sorting, spike_features):
+    # views on the feature arrays (memory-mapped for a folder), set without the checks of set_unit_spike_features()
+    for feature_name, feature in spike_features.items():
+        for unit_id, (start, stop) in feature['units'].items():
+            sorting._features.setdefault(int(unit_id), {})[feature_name] = feature['values'][start:stop]
+
+
+def read_compact_sorting_info(folder_path):
+    with (Path(folder_path) / 'sorting_info.json').open('r', encoding='utf8') as f:
+        info = json.load(f)
+    return info
+
+
+def update_compact_sorting_metadata(folder_path, **metadata):
+    info = read_compact_sorting_info(folder_path)
+    info['metadata'].update(metadata)
+    with (Path(folder_path) / 'sorting_info.json').open('w', encoding='utf8') as f:
+        json.dump(_check_json(info), f)
+
+
+class CompactSortingExtractor(se.SortingExtractor):
+    """
+    Read a sorting written with write_compact_sorting().
+    Spike arrays are memory-mapped.
+    """
+    extractor_name = 'CompactSorting'
+    installed = True
+    is_writable = True
+    mode = 'folder'
+    installation_mesg = ""
+
+    def __init__(self, folder_path):
+        se.SortingExtractor.__init__(self)
+        folder_path = Path(folder_path)
+        self._spike_times = np.load(str(folder_path / 'spike_times.npy'), mmap_mode='r')
+        self._spike_labels = np.load(str(folder_path / 'spike_labels.npy'), mmap_mode='r')
+        self._unit_ids = np.load(str(folder_path / 'unit_ids.npy'))
+        info = read_compact_sorting_info(folder_path)
+        self.metadata = info['metadata']
+        self._sampling_frequency = info['sampling_frequency']
+        for unit_id, props in info['unit_properties'].items():
+            for prop_name, value in props.items():
+                self.set_unit_property(int(unit_id), prop_name, value)
+        # written before the spike features and array properties were kept
+        array_properties_index = info.get('unit_array_properties', {})
+        if len(array_properties_index) > 0:
+            with np.load(str(folder_path / 'unit_array_properties.npz')) as array_properties:
+                for unit_id, props in array_properties_index.items():
+                    for prop_name, key in props.items():
+                        self.set_unit_property(int(unit_id), prop_name, array_properties[key])
+        spike_features = {}
+        for feature_name, feature in info.get('spike_features', {}).items():
+            spike_features[feature_name] = {'values': np.load(str(folder_path / feature['file']), mmap_mode='r'),
+                                            'units': feature['units']}
+        _set_compact_features(self, spike_features)
+        self._kwargs = {'folder_path': str(folder_path.absolute())}
+
+    def get_unit_ids(self):
+        return [int(u) for u in self._unit_ids]
+
+    def load_in_memory(self):
+        # detach from the files, needed before deleting the folder on some OS
+        self._spike_times = np.array(self._spike_times)
+        self._spike_labels = np.array(self._spike_labels)
+        for features in self._features.values():
+            for feature_name in features:
+                features[feature_name] = np.array(features[feature_name])
+
+    @check_get_unit_spike_train
+    def get_unit_spike_train(self, unit_id, start_frame=None, end_frame=None):
+        # labels are sorted so each unit is a contiguous slice
+        i0 = np.searchsorted(self._spike_labels, unit_id, side='left')
+        i1 = np.searchsorted(self._spike_labels, unit_id, side='right')
+        times = self._spike_times[i0:i1]
+        j0 = np.searchsorted(times, start_frame, side='left')
+        j1 = np.searchsorted(times, end_frame, side='left')
+        return np.array(times[j0:j1]).astype(int)
+
+    @staticmethod
+    def write_sorting(sorting, save_path):
+        write_compact_sorting(sorting, save_path)
+
+
+class CompactArraysSortingExtractor(CompactSortingExtractor):
+    """
+    A sorting from the arrays of get_compact_arrays(), for instance sent back by a dask worker.
+    """
+    extractor_name = 'CompactArraysSorting'
+    is_writable = False
+    mode = 'custom'
+
+    def __init__(self, arrays, metadata=None):
+        se.SortingExtractor.__init__(self)
+        self._spike_times = np.asarray(arrays['spike_times'])
+        self._spike_labels = np.asarray(arrays['spike_labels'])
+        self._unit_ids = np.asarray(arrays['unit_ids'])
+        self.metadata = metadata if metadata is not None else {}
+        self._sampling_frequency = arrays['sampling_frequency']
+        for unit_id, props in arrays['unit_properties'].items():
+            for prop_name, value in props.items():
+                self.set_unit_property(int(unit_id), prop_name, value)
+        _set_compact_features(self, arrays['spike_features'])
+        self._kwargs = {}
+
+    def load_in_memory(self):
+        pass
@@ -0,0 +1,129 @@
+"""
+Multi-session sorting: several recordings of the same probe sorted as one, see run_sorter(recordings=[...]).
+
+The recordings are concatenated in time with a lazy MultiRecordingTimeExtractor (no copy).
+Then:
+  * the sorters reading the recording in python (herdingspikes, mountainsort4...) read the sessions directly
+  * the sorters reading raw binary files get the files of the sessions when they accept several
+    files (klusta) and the sessions are raw files with the same dtype and layout
+  * otherwise the concatenation is written once by BaseSorter._write_binary(): when the sessions
+    are raw files of the exported dtype, their bytes are copied without decoding the traces
+
+The frame offsets of the sessions are saved in spikeinterface_sessions.json at the root of the output
+folder and the sorting is split back into one SortingExtractor per session (same unit ids in all the
+sessions), see split_sorting() and read_session_sortings().
+"""
+from pathlib import Path
+import json
+
+import numpy as np
+
+import spikeextractors as se
+
+sessions_filename = 'spikeinterface_sessions.json'
+
+
+def concatenate_recordings(recordings):
+    """
+    Concatenate recordings in time (lazy).
+
+    Returns
+    -------
+    recording: MultiRecordingTimeExtractor
+    frame_offsets: list of int
+        The first frame of each recording in the concatenation
+    """
+    assert len(recordings) > 0, 'recordings is empty'
+    num_channels = recordings[0].get_num_channels()
+    for i, recording in enumerate(recordings[1:]):
+        assert recording.get_num_channels() == num_channels, \
+            'recording {} does not have the channels of recording 0'.format(i + 1)
+    frame_offsets = [int(f) for f in np.cumsum([0] + [rec.get_num_frames() for rec in recordings[:-1]])]
+    return se.MultiRecordingTimeExtractor(recordings), frame_offsets
+
+
+def get_raw_files(recording):
+    """
+    The raw binary files holding the traces of a BinDatRecordingExtractor or of a concatenation of them,
+    when they can be read directly: time axis 0, all the channels in order, same dtype.
+
+    Returns
+    -------
+    raw: dict or None
+        'files', 'offsets' (bytes), 'num_frames', 'dtype' and 'has_gain' (the traces are scaled when read),
+        None if the files can not be read directly
+    """
+    if isinstance(recording, se.MultiRecordingTimeExtractor):
+        parts = recording._recordings
+    else:
+        parts = [recording]
+    raw = {'files': [], 'offsets': [], 'num_frames': [], 'dtype': None, 'has_gain': False}
+    for part in parts:
+        if not isinstance(part, se.BinDatRecordingExtractor) or part._time_axis != 0:
+            return None
+        if list(part._channels) != list(range(part._numchan)):
+            return None
+        dtype = np.dtype(part._dtype)
+        if raw['dtype'] is not None and dtype != raw['dtype']:
+            return None
+        raw['dtype'] = dtype
+        raw['files'].append(Path(part._datfile).absolute())
+        raw['offsets'].append(int(part._timeseries.offset))
+        raw['num_frames'].append(int(part.get_num_frames()))
+        raw['has_gain'] = raw['has_gain'] or part.has_unscaled
+    return raw
+
+
+def copy_raw_files(recording, file_path, dtype=None, time_axis=0, **kwargs):
+    """
+    Write the traces like write_to_binary_dat_format() by copying the bytes of the raw files
+    (see get_raw_files()), without decoding them.
+
+    Returns
+    -------
+    done: bool
+        False if the traces can not be copied (other layout or dtype): nothing is written
+    """
+    raw = get_raw_files(recording)
+    if raw is None or raw['has_gain'] or time_axis != 0 or (dtype is not None and np.dtype(dtype) != raw['dtype']):
+        return False
+    frame_bytes = recording.get_num_channels() * raw['dtype'].itemsize
+    with open(str(file_path), 'wb') as dst:
+        for raw_file, offset, num_frames in zip(raw['files'], raw['offsets'], raw['num_frames']):
+            with open(str(raw_file), 'rb') as src:
+                src.seek(offset)
+                remaining = num_frames * frame_bytes
+                while remaining > 0:
+                    data = src.read(min(remaining, 64 * 1024 ** 2))
+                    if len(data) == 0:
+                        raise IOError('{} is shorter than expected'.format(raw_file))
+                    dst.write(data)
+                    remaining -= len(data)
+    return True
+
+
+def write_sessions(output_folder, frame_offsets, num_frames):
+    sessions = {'frame_offsets': [int(f) for f in frame_offsets], 'num_frames': [int(n) for n in num_frames]}
+    with open(str(Path(output_folder) / sessions_filename), 'w', encoding='utf8') as f:
+        json.dump(sessions, f, indent=4)
+
+
+def split_sorting(sorting, frame_offsets, num_frames):
+    """
+    Split the sorting of a concatenation into one sorting per session, with the frames of the session.
+    """
+    return [se.SubSortingExtractor(sorting, start_frame=int(offset), end_frame=int(offset + n))
+            for offset, n in zip(frame_offsets, num_frames)]
+
+
+def read_session_sortings(sorter_name_or_class, output_folder):
+    """
+    Read the result of run_sorter(recordings=[...]) in output_folder, split into one sorting per session.
+    """
+    from .sorterlist import sorter_dict
+    SorterClass = sorter_dict[sorter_name_or_class] if isinstance(sorter_name_or_class, str) \
+        else sorter_name_or_class
+    with open(str(Path(output_folder) / sessions_filename), 'r', encoding='utf8') as f:
+        sessions = json.load(f)
+    sorting = SorterClass.get_result_from_folder(output_folder)
+    return split_sorting(sorting, sessions['frame_offsets'], sessions['num_frames'])
@@ -0,0 +1,347 @@
+"""
+A task queue in a folder of a shared filesystem, for run_sorters(engine='filequeue').
+
+No scheduler is needed: any number of workers, on any node that sees the folder, run
+
+    python -m spikesorters.worker <queue_folder>
+
+The queue folder contains:
+
+    pending/<task_id>.json                 the tasks to run (json, the recording as dump_to_dict())
+    claimed/<task_id>.json.<worker_id>     the tasks being run
+    done/<task_id>.json                    the outcome of finished tasks (run_time or error)
+
+A worker claims a task by renaming it from pending/ to claimed/: the rename is atomic,
+so only one worker gets it. While it runs the task, the worker touches the claimed file
+(heartbeat). A claimed file without heartbeat for more than stale_s seconds belongs to a
+dead worker (or node): it is requeued by the workers and by run_sorters().
+Tasks are claimed in the order of their task_id (the submission order).
+"""
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import uuid
+import copy
+import socket
+import threading
+import traceback
+import subprocess
+
+from spikeextractors.baseextractor import _check_json
+
+pending_folder_name = 'pending'
+claimed_folder_name = 'claimed'
+done_folder_name = 'done'
+
+
+def get_worker_id():
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def _write_json_atomic(path, d):
+    # write then rename: readers never see a partial file
+    path = Path(path)
+    tmp_path = path.parent / ('.tmp_' + path.name + '_' + uuid.uuid4().hex[:8])
+    with open(str(tmp_path), 'w', encoding='utf8') as f:
+        json.dump(_check_json(copy.deepcopy(d)), f, indent=4)
+    os.replace(str(tmp_path), str(path))
+
+
+def _list_json(folder):
+    try:
+        return sorted(name for name in os.listdir(str(folder)) if not name.startswith('.tmp_'))
+    except FileNotFoundError:
+        return []
+
+
+class FileQueue:
+    """
+    A task queue in a folder (see module docstring).
+
+    Parameters
+    ----------
+    queue_folder: str or Path
+        The folder of the queue (created if needed), on a filesystem shared by all the workers
+    """
+
+    def __init__(self, queue_folder):
+        self.queue_folder = Path(queue_folder).absolute()
+        for name in (pending_folder_name, claimed_folder_name, done_folder_name):
+            os.makedirs(str(self.queue_folder / name), exist_ok=True)
+
+    def __repr__(self):
+        return 'FileQueue({})'.format(self.queue_folder)
+
+    @property
+    def pending_folder(self):
+        return self.queue_folder / pending_folder_name
+
+    @property
+    def claimed_folder(self):
+        return self.queue_folder / claimed_folder_name
+
+    @property
+    def done_folder(self):
+        return self.queue_folder / done_folder_name
+
+    def put(self, task, index=0):
+        """
+        Add a task (a json serializable dict). The index gives the claiming order.
+
+        Returns
+        -------
+        task_id: str
+        """
+        task_id = '{:06d}-{}'.format(index, uuid.uuid4().hex[:12])
+        task = dict(task, task_id=task_id)
+        task.setdefault('num_requeues', 0)
+        _write_json_atomic(self.pending_folder / (task_id + '.json'), task)
+        return task_id
+
+    def claim(self, worker_id):
+        """
+        Claim the first pending task.
+
+        Returns
+        -------
+        task: dict or None
+            None when there is no pending task
+        claimed_path: Path or None
+        """
+        for name in _list_json(self.pending_folder):
+            claimed_path = self.claimed_folder / (name + '.' + worker_id)
+            try:
+                os.rename(str(self.pending_folder / name), str(claimed_path))
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+            try:
+                # the mtime of the renamed file is the one of the submission: start the heartbeat now
+                os.utime(str(claimed_path))
+                with open(str(claimed_path), 'r', encoding='utf8') as f:
+                    task = json.load(f)
+            except FileNotFoundError:
+                # seen as stale and requeued in between
+                continue
+            return task, claimed_path
+        return None, None
+
+    def heartbeat(self, claimed_path):
+        try:
+            os.utime(str(claimed_path))
+        except FileNotFoundError:
+            # requeued by another worker that thought this one was dead
+            pass
+
+    def finish(self, claimed_path, task, worker_id, run_time, error=None):
+        """
+        Write the outcome of a claimed task in done/ and release the claim.
+        """
+        outcome = {
+            'task_id': task['task_id'],
+            'rec_name': task.get('rec_name', None),
+            'sorter_name': task.get('sorter_name', None),
+            'worker_id': worker_id,
+            'status': 'done' if error is None else 'failed',
+            'run_time': run_time,
+            'error': error,
+            'num_requeues': task.get('num_requeues', 0),
+        }
+        _write_json_atomic(self.done_folder / (task['task_id'] + '.json'), outcome)
+        try:
+            os.remove(str(claimed_path))
+        except FileNotFoundError:
+            pass
+
+    def requeue_stale(self, stale_s, max_requeues=2):
+        """
+        Put back in pending/ the claimed tasks without heartbeat for more than stale_s seconds.
+        A task requeued more than max_requeues times (it may kill its workers) is marked as failed.
+
+        Returns
+        -------
+        requeued: list of task_id
+        """
+        requeued = []
+        now = time.time()
+        for name in _list_json(self.claimed_folder):
+            claimed_path = self.claimed_folder / name
+            try:
+                if now - claimed_path.stat().st_mtime < stale_s:
+                    continue
+                # rename first: only one process requeues a given claim
+                requeue_path = self.claimed_folder / ('.tmp_requeue_' + name)
+                os.rename(str(claimed_path), str(requeue_path))
+            except FileNotFoundError:
+                continue
+            with open(str(requeue_path), 'r', encoding='utf8') as f:
+                task = json.load(f)
+            task_id = task['task_id']
+            worker_id = name.split('.json.', 1)[-1]
+            if (self.done_folder / (task_id + '.json')).is_file():
+                # finished between the stat and the rename
+                pass
+            elif task['num_requeues'] >= max_requeues:
+                self.finish(requeue_path, task, worker_id, None,
+                            error='the task was requeued {} times after its workers stopped sending heartbeats '
+                                  '(last worker {})'.format(task['num_requeues'], worker_id))
+            else:
+                task['num_requeues'] += 1
+                _write_json_atomic(self.pending_folder / (task_id + '.json'), task)
+                requeued.append(task_id)
+            if requeue_path.is_file():
+                os.remove(str(requeue_path))
+        return requeued
+
+    def get_outcome(self, task_id):
+        outcome_path = self.done_folder / (task_id + '.json')
+        if not outcome_path.is_file():
+            return None
+        with open(str(outcome_path), 'r', encoding='utf8') as f:
+            return json.load(f)
+
+    def get_num_pending(self):
+        return len(_list_json(self.pending_folder))
+
+    def wait(self, task_ids, stale_s=120., max_requeues=2, poll_s=1., timeout=None):
+        """
+        Wait for the outcome of tasks, requeueing stale claims meanwhile.
+
+        Returns
+        -------
+        outcomes: dict
+            task_id -> outcome dict (see finish())
+        """
+        t0 = time.perf_counter()
+        outcomes = {}
+        while len(outcomes) < len(task_ids):
+            for task_id in task_ids:
+                if task_id not in outcomes:
+                    outcome = self.get_outcome(task_id)
+                    if outcome is not None:
+                        outcomes[task_id] = outcome
+            if len(outcomes) == len(task_ids):
+                break
+            if timeout is not None and time.perf_counter() - t0 > timeout:
+                raise TimeoutError('{} tasks of {} not finished'.format(len(task_ids) - len(outcomes), self))
+            self.requeue_stale(stale_s, max_requeues=max_requeues)
+            time.sleep(poll_s)
+        return outcomes
+
+
+def make_task(arg_list, rec_name):
+    """
+    The json serializable task of a run_sorters() task (a launcher.SortingTask, the recording must be
+    dump_to_dict()).
+    """
+    assert isinstance(arg_list.recording, dict), \
+        'the recording of a filequeue task must be serialized with dump_to_dict()'
+    task = arg_list._asdict()
+    task['rec_name'] = rec_name
+    task['output_folder'] = Path(arg_list.output_folder).absolute()
+    if arg_list.result_cache is not None:
+        task['result_cache'] = {'cache_folder': arg_list.result_cache.cache_folder,
+                                'max_size_mb': arg_list.result_cache.max_size_mb}
+    return task
+
+
+def run_task(task):
+    # run one task of the queue with the launcher (the inverse of make_task())
+    from .launcher import _run_one, SortingTask
+    from .resultcache import ResultCache
+
+    fields = {name: task[name] for name in SortingTask._fields}
+    fields['output_folder'] = Path(task['output_folder'])
+    if task['result_cache'] is not None:
+        fields['result_cache'] = ResultCache(task['result_cache']['cache_folder'],
+                                             max_size_mb=task['result_cache']['max_size_mb'])
+    return _run_one(SortingTask(**fields))
+
+
+def run_worker(queue_folder, max_tasks=None, idle_timeout=None, heartbeat_s=10., stale_s=120., max_requeues=2,
+               poll_s=1., verbose=True):
+    """
+    Claim and run the tasks of a queue folder until there is no task for idle_timeout seconds
+    (None: forever) or max_tasks tasks were run.
+
+    Parameters
+    ----------
+    queue_folder: str or Path
+        The queue folder
+    max_tasks: int or None
+        Exit after this number of tasks
+    idle_timeout: float or None
+        Exit after this time in s without task
+    heartbeat_s: float
+        Interval of the heartbeats of the running task
+    stale_s: float
+        Claims without heartbeat for this time are requeued (must be much larger than heartbeat_s)
+    max_requeues: int
+        A task requeued more times is marked as failed
+    poll_s: float
+        Interval to look for new tasks
+
+    Returns
+    -------
+    num_tasks: int
+        The number of tasks run by this worker
+    """
+    queue = FileQueue(queue_folder)
+    worker_id = get_worker_id()
+    num_tasks = 0
+    last_task_time = time.perf_counter()
+    while max_tasks is None or num_tasks < max_tasks:
+        task, claimed_path = queue.claim(worker_id)
+        if task is None:
+            queue.requeue_stale(stale_s, max_requeues=max_requeues)
+            if idle_timeout is not None and time.perf_counter() - last_task_time > idle_timeout:
+                break
+            time.sleep(poll_s)
+            continue
+
+        if verbose:
+            print('worker {} runs {} {} ({})'.format(worker_id, task.get('rec_name'), task.get('sorter_name'),
+                                                     task['task_id']))
+        stop_event = threading.Event()
+
+        def beat():
+            while not stop_event.wait(heartbeat_s):
+                queue.heartbeat(claimed_path)
+
+        heartbeat_thread = threading.Thread(target=beat, daemon=True)
+        heartbeat_thread.start()
+        run_time, error = None, None
+        try:
+            run_time = run_task(task)
+        except Exception:
+            error = traceback.format_exc()
+            if verbose:
+                print(error)
+        finally:
+            stop_event.set()
+            heartbeat_thread.join()
+        queue.finish(claimed_path, task, worker_id, run_time, error=error)
+        num_tasks += 1
+        last_task_time = time.perf_counter()
+    return num_tasks
+
+
+def start_local_workers(queue_folder, num_workers, idle_timeout=None, heartbeat_s=10., stale_s=120.):
+    """
+    Start worker processes on this machine.
+
+    Returns
+    -------
+    processes: list of subprocess.Popen
+    """
+    cmd = [sys.executable, '-m', 'spikesorters.worker', str(queue_folder), '--heartbeat', str(heartbeat_s),
+           '--stale', str(stale_s)]
+    if idle_timeout is not None:
+        cmd += ['--idle-timeout', str(idle_timeout)]
+    # the workers must import this version of spikesorters
+    env = dict(os.environ)
+    package_parent = str(Path(__file__).absolute().parent.parent)
+    env['PYTHONPATH'] = os.pathsep.join([package_parent] + [p for p in [env.get('PYTHONPATH', None)] if p])
+    return [subprocess.Popen(cmd, env=env) for _ in range(num_workers)]
@@ -5,8 +5,8 @@ import sys
 
 import spikeextractors as se
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, matlab_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import recover_recording
 
 
 def check_if_installed(hdsort_path: Union[str, None]):
@@ -30,6 +30,9 @@ class HDSortSorter(BaseSorter):
     sorter_name: str = 'hdsort'
     hdsort_path: Union[str, None] = os.getenv('HDSORT_PATH', None)
     requires_locations = False
+    cost_coefficient = 0.5
+    uses_matlab = True
+    intermediate_files = ['recording.h5']
     _default_params = {
         'detect_threshold': 4.2,
         'detect_sign': -1,  # -1 - 1
@@ -101,6 +104,18 @@ class HDSortSorter(BaseSorter):
         except Exception as e:
             print("Could not set HDSORT_PATH environment variable:", e)
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # recording.h5 (Mea1k format) unless the recording is already a Mea1k or MaxOne file
+        nbytes = get_recording_bytes(recording)
+        if type(recording).__name__ in ('Mea1kRecordingExtractor', 'MaxOneRecordingExtractor'):
+            scratch_bytes = 0
+        else:
+            scratch_bytes = nbytes
+        # hdsort also writes a preprocessed copy
+        return make_estimate(disk_bytes=scratch_bytes + nbytes, scratch_bytes=scratch_bytes,
+                             peak_ram_bytes=matlab_ram_bytes + params['chunk_size'] * recording.get_num_channels() * 8)
+
     def _setup_recording(self, recording, output_folder):
         if not self.is_installed():
             raise Exception(HDSortSorter.installation_mesg)
@@ -135,7 +150,7 @@ class HDSortSorter(BaseSorter):
         # make substitutions in txt files
         hdsort_master_txt = hdsort_master_txt.format(
             hdsort_path=str(
-                Path(HDSortSorter.hdsort_path).absolute()),
+                Path(self.hdsort_path).absolute()),
             utils_path=str(utils_path.absolute()),
             config_path=str((output_folder / 'hdsort_config.m').absolute()),
             file_name=p['file_name'],
@@ -173,11 +188,9 @@ class HDSortSorter(BaseSorter):
             with (output_folder / fname).open('w') as f:
                 f.write(txt)
 
-    def _run(self, recording, output_folder):
-        recording = recover_recording(recording)
+    def _prepare_script(self, recording, output_folder):
         tmpdir = output_folder
         os.makedirs(str(tmpdir), exist_ok=True)
-        samplerate = recording.get_sampling_frequency()
 
         if recording.is_filtered and self.params['filter']:
             print("Warning! The recording is already filtered, but HDsort filter is enabled. You can disable "
@@ -197,19 +210,19 @@ class HDSortSorter(BaseSorter):
 
         shell_script = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                    log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_script.start()
-
-        retcode = shell_script.wait()
+        return shell_script
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('HDsort returned a non-zero exit code')
 
+        samplerate = recording.get_sampling_frequency()
         samplerate_fname = str(output_folder / 'samplerate.txt')
         with open(samplerate_fname, 'w') as f:
             f.write('{}'.format(samplerate))
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         output_folder = Path(output_folder)
         sorting = se.HDSortSortingExtractor(file_path=str(output_folder / 'hdsort_output' /
                                                           'hdsort_output_results.mat'))
@@ -5,6 +5,7 @@ import spikeextractors as se
 import spiketoolkit as st
 
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, python_ram_bytes
 from ..sorter_tools import recover_recording
 
 try:
@@ -19,6 +20,7 @@ class HerdingspikesSorter(BaseSorter):
     sorter_name = 'herdingspikes'
     
     requires_locations = True
+    cost_coefficient = 0.05
     compatible_with_parallel = {'loky': True, 'multiprocessing': True, 'threading': False}
     _default_params = {
         # core params
@@ -133,6 +135,11 @@ class HerdingspikesSorter(BaseSorter):
     def get_sorter_version():
         return hs.__version__
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # in process, traces are read by chunks and only the detected spikes are saved
+        return make_estimate(disk_bytes=0, scratch_bytes=0, peak_ram_bytes=python_ram_bytes)
+
     def _setup_recording(self, recording, output_folder):
         
         p = self.params
@@ -209,5 +216,5 @@ class HerdingspikesSorter(BaseSorter):
         self.C.SaveHDF5(sorted_file, sampling=self.Probe.fps)
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         return se.HS2SortingExtractor(file_path=Path(output_folder) / 'HS2_sorted.hdf5', load_unit_info=True)
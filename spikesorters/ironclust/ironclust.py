@@ -8,7 +8,7 @@ import spikeextractors as se
 
 from ..utils.shellscript import ShellScript
 from ..basesorter import BaseSorter
-from ..sorter_tools import recover_recording
+from ..resources import make_estimate, get_recording_bytes, matlab_ram_bytes
 
 
 def check_if_installed(ironclust_path: Union[str, None]):
@@ -34,6 +34,9 @@ class IronClustSorter(BaseSorter):
     ironclust_path: Union[str, None] = os.getenv('IRONCLUST_PATH', None)
     
     requires_locations = True
+    cost_coefficient = 0.1
+    uses_matlab = True
+    intermediate_files = ['ironclust_dataset/raw.mda']
 
     _default_params = {
         'detect_sign': -1,  # Use -1, 0, or 1, depending on the sign of the spikes in the recording
@@ -145,6 +148,14 @@ class IronClustSorter(BaseSorter):
         except Exception as e:
             print("Could not set IRONCLUST_PATH environment variable:", e)
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # raw.mda with the recording dtype + int16 filtered cache in tmp
+        nbytes = get_recording_bytes(recording)
+        filtered_nbytes = get_recording_bytes(recording, dtype='int16')
+        return make_estimate(disk_bytes=nbytes + filtered_nbytes, scratch_bytes=nbytes + filtered_nbytes,
+                             peak_ram_bytes=matlab_ram_bytes + filtered_nbytes)
+
     def _setup_recording(self, recording: se.RecordingExtractor, output_folder: Path):
         if not self.is_installed():
             raise Exception(IronClustSorter.installation_mesg)
@@ -153,8 +164,7 @@ class IronClustSorter(BaseSorter):
         # Generate three files in the dataset directory: raw.mda, geom.csv, params.json
         se.MdaRecordingExtractor.write_recording(recording=recording, save_path=str(dataset_dir))
 
-    def _run(self, recording: se.RecordingExtractor, output_folder: Path):
-        recording = recover_recording(recording)
+    def _prepare_script(self, recording: se.RecordingExtractor, output_folder: Path):
         dataset_dir = output_folder / 'ironclust_dataset'
         source_dir = Path(__file__).parent
 
@@ -216,23 +226,23 @@ class IronClustSorter(BaseSorter):
 
         shell_script = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                    log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_script.start()
-
-        retcode = shell_script.wait()
+        return shell_script
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('ironclust returned a non-zero exit code')
 
+        tmpdir = output_folder / 'tmp'
         result_fname = str(tmpdir / 'firings.mda')
         if not os.path.exists(result_fname):
             raise Exception('Result file does not exist: ' + result_fname)
 
         samplerate_fname = str(tmpdir / 'samplerate.txt')
         with open(samplerate_fname, 'w') as f:
-            f.write('{}'.format(samplerate))
+            f.write('{}'.format(recording.get_sampling_frequency()))
 
     @staticmethod
-    def get_result_from_folder(output_folder: Union[str, Path]):
+    def _get_result_from_folder(output_folder: Union[str, Path]):
         output_folder = Path(output_folder)
         tmpdir = output_folder / 'tmp'
 
@@ -8,8 +8,9 @@ import numpy as np
 
 import spikeextractors as se
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, matlab_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import get_git_commit, recover_recording
+from ..sorter_tools import get_git_commit
 
 
 def check_if_installed(kilosort_path: Union[str, None]):
@@ -35,6 +36,10 @@ class KilosortSorter(BaseSorter):
     kilosort_path: Union[str, None] = os.getenv('KILOSORT_PATH', None)
     
     requires_locations = False
+    cost_coefficient = 0.3
+    uses_matlab = True
+    setup_params = []  # the exported traces do not depend on the params
+    intermediate_files = ['recording.dat', 'temp_wh.dat']
     
     _default_params = {
         'detect_threshold': 6,
@@ -95,6 +100,13 @@ class KilosortSorter(BaseSorter):
         except Exception as e:
             print("Could not set KILOSORT_PATH environment variable:", e)
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # int16 recording.dat + int16 temp_wh.dat, the whitened data is kept in RAM up to ForceMaxRAMforDat
+        nbytes = get_recording_bytes(recording, dtype='int16')
+        peak_ram = matlab_ram_bytes + min(nbytes, 20e9)
+        return make_estimate(disk_bytes=2 * nbytes, scratch_bytes=2 * nbytes, peak_ram_bytes=peak_ram)
+
     def _setup_recording(self, recording, output_folder):
         source_dir = Path(__file__).parent
         p = self.params
@@ -110,7 +122,7 @@ class KilosortSorter(BaseSorter):
 
         # save binary file
         input_file_path = output_folder / 'recording'
-        recording.write_to_binary_dat_format(input_file_path, dtype='int16', chunk_mb=500)
+        self._write_binary(recording, input_file_path, dtype='int16', chunk_mb=500)
 
         # set up kilosort config files and run kilosort on data
         with (source_dir / 'kilosort_master.m').open('r') as f:
@@ -145,7 +157,7 @@ class KilosortSorter(BaseSorter):
         # make substitutions in txt files
         kilosort_master_txt = kilosort_master_txt.format(
             kilosort_path=str(
-                Path(KilosortSorter.kilosort_path).absolute()),
+                Path(self.kilosort_path).absolute()),
             output_folder=str(output_folder),
             channel_path=str(
                 (output_folder / 'kilosort_channelmap.m').absolute()),
@@ -185,8 +197,7 @@ class KilosortSorter(BaseSorter):
         shutil.copy(str(source_dir.parent / 'utils' / 'writeNPY.m'), str(output_folder))
         shutil.copy(str(source_dir.parent / 'utils' / 'constructNPYheader.m'), str(output_folder))
 
-    def _run(self, recording, output_folder):
-        recording = recover_recording(recording)
+    def _prepare_script(self, recording, output_folder):
         if 'win' in sys.platform and sys.platform != 'darwin':
             shell_cmd = '''
                         cd {tmpdir}
@@ -200,14 +211,13 @@ class KilosortSorter(BaseSorter):
                     '''.format(tmpdir=output_folder)
         shell_script = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                    log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_script.start()
-
-        retcode = shell_script.wait()
+        return shell_script
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('kilosort returned a non-zero exit code')
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         sorting = se.KiloSortSortingExtractor(folder_path=output_folder)
         return sorting
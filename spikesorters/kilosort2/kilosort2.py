@@ -8,8 +8,9 @@ import json
 
 import spikeextractors as se
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, matlab_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import get_git_commit, recover_recording
+from ..sorter_tools import get_git_commit
 
 
 def check_if_installed(kilosort2_path: Union[str, None]):
@@ -34,6 +35,10 @@ class Kilosort2Sorter(BaseSorter):
     sorter_name: str = 'kilosort2'
     kilosort2_path: Union[str, None] = os.getenv('KILOSORT2_PATH', None)
     requires_locations = False
+    cost_coefficient = 0.4
+    uses_matlab = True
+    setup_params = []  # the exported traces do not depend on the params
+    intermediate_files = ['recording.dat', 'temp_wh.dat']
 
     _default_params = {
         'detect_threshold': 5,
@@ -108,6 +113,14 @@ class Kilosort2Sorter(BaseSorter):
         except Exception as e:
             print("Could not set KILOSORT2_PATH environment variable:", e)
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # int16 recording.dat + int16 temp_wh.dat, batches of NT frames in RAM
+        nbytes = get_recording_bytes(recording, dtype='int16')
+        NT = params['NT'] if params['NT'] is not None else 64 * 1024 + params['ntbuff']
+        peak_ram = matlab_ram_bytes + 8 * NT * recording.get_num_channels() * 4
+        return make_estimate(disk_bytes=2 * nbytes, scratch_bytes=2 * nbytes, peak_ram_bytes=peak_ram)
+
     def _setup_recording(self, recording, output_folder):
         source_dir = Path(Path(__file__).parent)
         p = self.params
@@ -123,7 +136,7 @@ class Kilosort2Sorter(BaseSorter):
 
         # save binary file
         input_file_path = output_folder / 'recording.dat'
-        recording.write_to_binary_dat_format(input_file_path, dtype='int16', chunk_mb=500)
+        self._write_binary(recording, input_file_path, dtype='int16', chunk_mb=500)
 
         if p['car']:
             use_car = 1
@@ -141,7 +154,7 @@ class Kilosort2Sorter(BaseSorter):
         # make substitutions in txt files
         kilosort2_master_txt = kilosort2_master_txt.format(
             kilosort2_path=str(
-                Path(Kilosort2Sorter.kilosort2_path).absolute()),
+                Path(self.kilosort2_path).absolute()),
             output_folder=str(output_folder),
             channel_path=str(
                 (output_folder / 'kilosort2_channelmap.m').absolute()),
@@ -189,8 +202,7 @@ class Kilosort2Sorter(BaseSorter):
         shutil.copy(str(source_dir.parent / 'utils' / 'writeNPY.m'), str(output_folder))
         shutil.copy(str(source_dir.parent / 'utils' / 'constructNPYheader.m'), str(output_folder))
 
-    def _run(self, recording, output_folder):
-        recording = recover_recording(recording)
+    def _prepare_script(self, recording, output_folder):
         if 'win' in sys.platform and sys.platform != 'darwin':
             shell_cmd = '''
                         cd {tmpdir}
@@ -204,14 +216,14 @@ class Kilosort2Sorter(BaseSorter):
                     '''.format(tmpdir=output_folder)
         shell_script = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                    log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_script.start()
-        retcode = shell_script.wait()
+        return shell_script
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('kilosort2 returned a non-zero exit code')
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         output_folder = Path(output_folder)
         with (output_folder / 'spikeinterface_params.json').open('r') as f:
             sorter_params = json.load(f)['sorter_params']
@@ -5,8 +5,9 @@ import sys
 import spikeextractors as se
 
 from ..basesorter import BaseSorter
+from ..concatenation import get_raw_files
+from ..resources import make_estimate, get_recording_bytes, python_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import recover_recording
 
 try:
     import klusta
@@ -24,6 +25,9 @@ class KlustaSorter(BaseSorter):
     sorter_name = 'klusta'
     
     requires_locations = False
+    cost_coefficient = 1.0
+    setup_params = []  # the exported traces do not depend on the params
+    intermediate_files = ['recording.dat']
 
     _default_params = {
         'adjacency_radius': None,
@@ -73,6 +77,23 @@ class KlustaSorter(BaseSorter):
     def get_sorter_version():
         return klusta.__version__
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # int16 recording.dat unless the recording is already a usable binary file
+        if cls._get_raw_data_files(recording) is not None:
+            nbytes = 0
+        else:
+            nbytes = get_recording_bytes(recording, dtype='int16')
+        return make_estimate(disk_bytes=nbytes, scratch_bytes=nbytes, peak_ram_bytes=python_ram_bytes + 500e6)
+
+    @staticmethod
+    def _get_raw_data_files(recording):
+        # the raw files klusta can read directly: no header
+        raw = get_raw_files(recording)
+        if raw is not None and any(offset != 0 for offset in raw['offsets']):
+            return None
+        return raw
+
     def _setup_recording(self, recording, output_folder):
         source_dir = Path(__file__).parent
 
@@ -87,17 +108,17 @@ class KlustaSorter(BaseSorter):
         recording.save_to_probe_file(probe_file, grouping_property=None,
                                      radius=p['adjacency_radius'])
 
-        # source file
-        if isinstance(recording, se.BinDatRecordingExtractor) and recording._time_axis == 0 and \
-                      recording._timeseries.offset == 0:
-            # no need to copy
-            raw_filename = str(Path(recording._datfile).resolve())
-            dtype = recording._timeseries.dtype.str
+        # source file(s)
+        raw = self._get_raw_data_files(recording)
+        if raw is not None:
+            # no need to copy: klusta concatenates the files (sessions) itself
+            raw_filenames = [str(Path(f).resolve()) for f in raw['files']]
+            dtype = raw['dtype'].str
         else:
             # save binary file (chunk by hcunk) into a new file
-            raw_filename = output_folder / 'recording.dat'
+            raw_filenames = [str(output_folder / 'recording.dat')]
             dtype = 'int16'
-            recording.write_to_binary_dat_format(raw_filename, time_axis=0, dtype=dtype, chunk_mb=500)
+            self._write_binary(recording, raw_filenames[0], time_axis=0, dtype=dtype, chunk_mb=500)
 
         if p['detect_sign'] < 0:
             detect_sign = 'negative'
@@ -112,7 +133,8 @@ class KlustaSorter(BaseSorter):
 
         # Note: should use format with dict approach here
         klusta_config = ''.join(klusta_config).format(experiment_name,
-                                                      probe_file, raw_filename,
+                                                      probe_file,
+                                                      ', '.join('r"{}"'.format(f) for f in raw_filenames),
                                                       float(recording.get_sampling_frequency()),
                                                       recording.get_num_channels(), "'{}'".format(dtype),
                                                       p['threshold_strong_std_factor'], p['threshold_weak_std_factor'],
@@ -125,8 +147,7 @@ class KlustaSorter(BaseSorter):
         with (output_folder / 'config.prm').open('w') as f:
             f.writelines(klusta_config)
 
-    def _run(self, recording, output_folder):
-        recording = recover_recording(recording)
+    def _prepare_script(self, recording, output_folder):
         if 'win' in sys.platform and sys.platform != 'darwin':
             shell_cmd = '''
                         klusta --overwrite {klusta_config}
@@ -139,10 +160,9 @@ class KlustaSorter(BaseSorter):
 
         shell_script = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                    log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_script.start()
-
-        retcode = shell_script.wait()
+        return shell_script
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('klusta returned a non-zero exit code')
 
@@ -150,6 +170,6 @@ class KlustaSorter(BaseSorter):
             raise Exception('Klusta did not run successfully')
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         sorting = se.KlustaSortingExtractor(file_or_folder_path=Path(output_folder) / 'recording.kwik')
         return sorting
@@ -2,35 +2,448 @@
 Utils functions to launch several sorter on several recording in parralell or not.
 """
 import os
+import sys
 from pathlib import Path
 import multiprocessing
-import shutil
 import json
 import traceback
 import json
+import datetime
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor, Future, CancelledError, wait,
+                                FIRST_COMPLETED)
+import concurrent.futures
+import asyncio
+import functools
 
 import spikeextractors as se
+from spikeextractors.baseextractor import _check_json
 
 from .sorterlist import sorter_dict, run_sorter
+from .resultcache import get_result_cache, get_result_cache_key
+from .compactsorting import (compact_folder_name, update_compact_sorting_metadata, get_compact_arrays,
+                             CompactArraysSortingExtractor)
+from .manifest import Manifest, rebuild_manifest, append_to_manifest, append_pending_to_manifest
+from .trash import remove_folder
+from .sorter_tools import SpikeSortingError
+from .resources import (estimate_task_resources, get_resource_needs, get_missing_resources, reserve_resources,
+                        get_task_resources, fit_task_resources, InsufficientResourcesError)
+from .scheduler import CostModel, get_channel_frames, get_lpt_order, predict_makespan, write_schedule_report
+from .filequeue import FileQueue, make_task, start_local_workers
+
+# kwargs of the sorters that can be set per sorter with task_policy
+task_policy_keys = ('timeout_s', 'max_memory_mb', 'max_retries', 'retry_backoff_s')
+
+# one task of run_sorters() and submit_sorters(), built by _prepare_tasks()
+# recording is a dump_to_dict() when the engine runs the task in another process
+SortingTask = namedtuple('SortingTask', ['recording', 'sorter_name', 'output_folder', 'grouping_property', 'verbose',
+                                         'params', 'sorter_kwargs', 'run_sorter_kwargs', 'result_cache',
+                                         'cache_key'])
+
+
+def _make_sorter(arg_list):
+    if isinstance(arg_list.recording, dict):
+        recording = se.load_extractor_from_dict(arg_list.recording)
+    else:
+        recording = arg_list.recording
+
+    SorterClass = sorter_dict[arg_list.sorter_name]
+    sorter = SorterClass(recording=recording, output_folder=arg_list.output_folder,
+                         grouping_property=arg_list.grouping_property, verbose=arg_list.verbose,
+                         delete_output_folder=False, **arg_list.sorter_kwargs)
+    sorter.set_params(**arg_list.params)
+    return sorter
+
+
+def _record_run(sorter, arg_list, run_time):
+    # manifest entry (also for failures) and result cache
+    append_to_manifest(arg_list.output_folder, run_time, sorter.get_sorter_version(), sorter.params,
+                       channel_frames=sorter.get_channel_frames(), outcome=sorter.outcome,
+                       num_attempts=sorter.num_attempts)
+    if arg_list.result_cache is not None and run_time is not None:
+        arg_list.result_cache.put(arg_list.cache_key, sorter.get_result(),
+                                  metadata={'sorter_name': sorter.sorter_name, 'run_time': run_time})
 
 
 def _run_one(arg_list):
-    # the multiprocessing python module force to have one unique tuple argument
-    rec, sorter_name, output_folder, grouping_property, verbose, params, run_sorter_kwargs = arg_list
-    if isinstance(rec, dict):
-        recording = se.load_extractor_from_dict(rec)
+    # the multiprocessing python module force to have one unique tuple argument (a SortingTask)
+    # return the run time (None if the sorter failed with raise_error=False)
+    sorter = _make_sorter(arg_list)
+    try:
+        run_time = sorter.run(**arg_list.run_sorter_kwargs)
+    except Exception:
+        _record_run(sorter, arg_list, None)
+        raise
+    _record_run(sorter, arg_list, run_time)
+    return run_time
+
+
+def _run_until_complete(coroutine):
+    # as asyncio.run() (python >= 3.7): a new event loop, also used by the child watcher of the subprocesses
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+async def _run_one_async(arg_list, executor, semaphore):
+    # the sorters running an external program wait for it in the event loop,
+    # the other ones run in a thread of the executor
+    run_sorter_kwargs = arg_list.run_sorter_kwargs
+    # get_event_loop() in a coroutine is the running loop (get_running_loop() needs python 3.7)
+    loop = asyncio.get_event_loop()
+    async with semaphore:
+        sorter = await loop.run_in_executor(executor, _make_sorter, arg_list)
+        try:
+            if sorter.runs_external_program():
+                run_time = await sorter.run_async(raise_error=run_sorter_kwargs.get('raise_error', True),
+                                                  executor=executor)
+            else:
+                run_time = await loop.run_in_executor(executor, functools.partial(sorter.run, **run_sorter_kwargs))
+        except Exception:
+            await loop.run_in_executor(executor, _record_run, sorter, arg_list, None)
+            raise
+        await loop.run_in_executor(executor, _record_run, sorter, arg_list, run_time)
+    return run_time
+
+
+def _run_filequeue(task_list, task_names, working_folder, engine_kwargs):
+    queue_folder = engine_kwargs.get('queue_folder', None) or working_folder / 'spikeinterface_queue'
+    stale_s = engine_kwargs.get('stale_s', 120.)
+    queue = FileQueue(queue_folder)
+    # the index keeps the submission order (longest first)
+    task_ids = [queue.put(make_task(arg_list, rec_name), index=i)
+                for i, (arg_list, (rec_name, _)) in enumerate(zip(task_list, task_names))]
+    workers = start_local_workers(queue.queue_folder, engine_kwargs.get('workers', 0), stale_s=stale_s)
+    try:
+        outcomes = queue.wait(task_ids, stale_s=stale_s, max_requeues=engine_kwargs.get('max_requeues', 2),
+                              timeout=engine_kwargs.get('timeout', None))
+    finally:
+        for process in workers:
+            process.terminate()
+            process.wait()
+    # like the other engines, all the tasks are run before raising the first error
+    for task_id, (rec_name, sorter_name) in zip(task_ids, task_names):
+        outcome = outcomes[task_id]
+        if outcome['status'] != 'done':
+            raise SpikeSortingError('{} on {} failed on worker {}:\n{}'.format(sorter_name, rec_name,
+                                                                              outcome['worker_id'], outcome['error']))
+
+
+def _run_one_compact(arg_list):
+    # dask engine: the result goes back to the client as compact arrays, not as a pickled extractor
+    run_time = _run_one(arg_list)
+    arrays = None
+    if run_time is not None:
+        SorterClass = sorter_dict[arg_list.sorter_name]
+        arrays = get_compact_arrays(SorterClass.get_result_from_folder(arg_list.output_folder))
+    return run_time, arrays
+
+
+def _get_recording_paths(rec_dict):
+    # the files of a dumped recording (and of the recordings it wraps)
+    paths = []
+    for key, value in rec_dict.get('kwargs', {}).items():
+        values = value if isinstance(value, list) else [value]
+        for v in values:
+            if isinstance(v, dict) and 'class' in v:
+                paths.extend(_get_recording_paths(v))
+            elif key in ('file_path', 'folder_path', 'file_or_folder_path') and v is not None:
+                paths.append(str(v))
+    return paths
+
+
+def _check_paths(paths):
+    # run on each dask worker
+    return [os.path.exists(path) for path in paths]
+
+
+def _get_preferred_workers(task_list, worker_paths):
+    # the workers whose filesystem holds the files of the recording of each task
+    # no preference when all the workers (shared filesystem) or none of them have the files
+    preferred = []
+    for arg_list in task_list:
+        paths = set(_get_recording_paths(arg_list.recording))
+        holders = [address for address, existing in worker_paths.items()
+                   if len(paths) > 0 and paths <= existing]
+        preferred.append(holders if 0 < len(holders) < len(worker_paths) else None)
+    return preferred
+
+
+def _submit_dask(client, task_list, task_names, use_resources=True, locality=True):
+    workers_info = client.scheduler_info()['workers']
+    worker_resources = [info.get('resources', {}) for info in workers_info.values()]
+
+    preferred = [None] * len(task_list)
+    if locality and len(workers_info) > 1:
+        all_paths = sorted(set(p for arg_list in task_list for p in _get_recording_paths(arg_list.recording)))
+        if len(all_paths) > 0:
+            checks = client.run(_check_paths, all_paths)
+            worker_paths = {address: set(p for p, exists in zip(all_paths, check) if exists)
+                            for address, check in checks.items()}
+            preferred = _get_preferred_workers(task_list, worker_paths)
+
+    futures = []
+    recordings = {}
+    for arg_list, (rec_name, sorter_name), workers in zip(task_list, task_names, preferred):
+        resources = None
+        if use_resources:
+            if rec_name not in recordings:
+                recordings[rec_name] = se.load_extractor_from_dict(arg_list.recording)
+            recording = recordings[rec_name]
+            task_resources = get_task_resources(sorter_dict[sorter_name], recording, arg_list.params,
+                                                grouping_property=arg_list.grouping_property)
+            resources = fit_task_resources(task_resources, worker_resources,
+                                           task_name='{} on {}'.format(sorter_name, rec_name)) or None
+        futures.append(client.submit(_run_one_compact, arg_list, resources=resources, workers=workers,
+                                     allow_other_workers=workers is not None, pure=False))
+    return futures
+
+
+def _get_concurrency_limits(task_list, max_concurrent):
+    # sorter_name -> max number of concurrent tasks
+    limits = {}
+    for arg_list in task_list:
+        sorter_name = arg_list.sorter_name
+        if isinstance(max_concurrent, Mapping):
+            limits[sorter_name] = max_concurrent.get(sorter_name, None) or os.cpu_count()
+        else:
+            limits[sorter_name] = max_concurrent or os.cpu_count()
+    return limits
+
+
+async def _run_all_async(task_list, limits, threads):
+    semaphores = {sorter_name: asyncio.Semaphore(n) for sorter_name, n in limits.items()}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = await asyncio.gather(*[_run_one_async(arg_list, executor, semaphores[arg_list.sorter_name])
+                                         for arg_list in task_list], return_exceptions=True)
+    # like the other engines, all the tasks are run before raising the first error
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+def _get_task_policy(task_policy, sorter_name):
+    # task_policy is a dict of policy kwargs for all the sorters or a dict sorter_name -> dict
+    if task_policy is None:
+        return {}
+    if all(k in task_policy_keys for k in task_policy.keys()):
+        policy = task_policy
     else:
-        recording = rec
+        policy = task_policy.get(sorter_name, {})
+    bad_keys = [k for k in policy.keys() if k not in task_policy_keys]
+    assert len(bad_keys) == 0, 'Bad task_policy keys for {}: {}'.format(sorter_name, bad_keys)
+    return dict(policy)
 
+
+def _restore_from_cache(result_cache, cache_key, sorter_name, params, output_folder):
+    # copy the cached result in the output folder and make a log that looks like a finished run
+    if not result_cache.restore(cache_key, output_folder / compact_folder_name):
+        return False
+    metadata = result_cache.get_metadata(cache_key)
     SorterClass = sorter_dict[sorter_name]
-    sorter = SorterClass(recording=recording, output_folder=output_folder,
-                         grouping_property=grouping_property, verbose=verbose, delete_output_folder=False)
-    sorter.set_params(**params)
-    sorter.run(**run_sorter_kwargs)
+    now = datetime.datetime.now()
+    update_compact_sorting_metadata(output_folder / compact_folder_name, log_datetime=now.isoformat())
+    log = {
+        'sorter_name': sorter_name,
+        'sorter_version': str(SorterClass.get_sorter_version()),
+        'datetime': now,
+        'run_time': metadata.get('run_time', 0.),
+        'result_cache_key': cache_key,
+    }
+    with open(str(output_folder / 'spikeinterface_log.json'), 'w', encoding='utf8') as f:
+        json.dump(_check_json(log), f, indent=4)
+    full_params = SorterClass.default_params()
+    full_params.update(params)
+    append_to_manifest(output_folder, log['run_time'], log['sorter_version'], full_params, when=now)
+    return True
+
+
+def _check_task_resources(needs, rec_name, sorter_name, reserved=None):
+    if needs is None:
+        return
+    missing = get_missing_resources(needs, reserved=reserved)
+    if len(missing) > 0:
+        raise InsufficientResourcesError('Not enough resources to run {} on {}: '.format(sorter_name, rec_name) +
+                                         '; '.join(missing))
+
+
+def _run_queued(submit, task_list, needs_list, processes):
+    # start tasks only when their needs fit in the available resources minus the needs of running tasks
+    # each task fits alone (checked before), so the queue always progresses
+    # submit(arg_list) must return a concurrent.futures.Future
+    pending = list(range(len(task_list)))
+    running = {}
+    reserved = {}
+    while len(pending) > 0 or len(running) > 0:
+        for i in list(pending):
+            if len(running) >= processes:
+                break
+            needs = needs_list[i]
+            if needs is None or len(running) == 0 or len(get_missing_resources(needs, reserved=reserved)) == 0:
+                pending.remove(i)
+                running[i] = submit(task_list[i])
+                if needs is not None:
+                    reserve_resources(reserved, needs)
+        # resources can also be freed by other programs: wake up regularly
+        wait(list(running.values()), timeout=0.05, return_when=FIRST_COMPLETED)
+        done = [i for i, future in running.items() if future.done()]
+        for i in done:
+            running.pop(i).result()
+            if needs_list[i] is not None:
+                reserve_resources(reserved, needs_list[i], sign=-1)
+
+
+def _submit_to_pool(pool, arg_list):
+    # a multiprocessing.Pool task seen as a Future
+    future = Future()
+    pool.apply_async(_run_one, (arg_list,), callback=future.set_result, error_callback=future.set_exception)
+    return future
+
+
+def _get_process_executor(max_workers, max_tasks_per_child):
+    # workers of ProcessPoolExecutor are not daemonic (python >= 3.9): tasks can start their own processes
+    # spawn: no fork of a parent that holds threads (numba, dask, joblib pools)
+    if sys.version_info >= (3, 11):
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                   max_tasks_per_child=max_tasks_per_child)
+    # no max_tasks_per_child before 3.11: loky restarts the workers whose memory grows
+    from joblib.externals.loky import ProcessPoolExecutor as LokyProcessPoolExecutor
+    return LokyProcessPoolExecutor(max_workers=max_workers, context=multiprocessing.get_context('loky'))
+
+
+def _prepare_tasks(sorter_list, recording_dict_or_list, working_folder, *, sorter_params={}, grouping_property=None,
+                   mode='raise', need_serialize=False, verbose=False, run_sorter_kwargs={}, result_cache=None,
+                   sorter_kwargs={}, preflight=None, task_order=None, history_folders=None, task_policy=None):
+    # build the tasks of run_sorters() and submit_sorters()
+    # skipped are the (rec_name, sorter_name) not to run: already done (mode='keep') or restored from the cache
+    working_folder = Path(working_folder)
+
+    for sorter_name in sorter_list:
+        assert sorter_name in sorter_dict, '{} is not in sorter list'.format(sorter_name)
+
+    if isinstance(recording_dict_or_list, list):
+        # in case of list
+        recording_dict = {'recording_{}'.format(i): rec for i, rec in enumerate(recording_dict_or_list)}
+    elif isinstance(recording_dict_or_list, dict):
+        recording_dict = recording_dict_or_list
+    else:
+        raise (ValueError('bad recording dict'))
+
+    # when  grouping_property is not None : split in subrecording
+    # but the subrecording must have len=1 because otherwise it break
+    # the internal organisation of folder name.
+    if grouping_property is not None:
+        for rec_name, recording in recording_dict.items():
+            recording_list = recording.get_sub_extractors_by_property(grouping_property)
+            n_group = len(recording_list)
+            assert n_group == 1, 'run_sorters() works only if grouping_property=None or if it split into one subrecording'
+            recording_dict[rec_name] = recording_list[0]
+        grouping_property = None
+
+    result_cache = get_result_cache(result_cache)
+    scratch_folder = sorter_kwargs.get('scratch_folder', None)
+
+    # the manifest answers "is this task done" without parsing all logs
+    manifest = None
+    if working_folder.is_dir():
+        manifest = Manifest(working_folder)
+        if not manifest.exists():
+            manifest = rebuild_manifest(working_folder)
+
+    assert preflight in ('raise', 'queue', None), "preflight must be 'raise', 'queue' or None"
+
+    cost_model = CostModel(sorter_dict)
+    for folder in [working_folder] + list(history_folders if history_folders is not None else []):
+        cost_model.add_working_folder(folder)
+
+    task_list = []
+    needs_list = []
+    task_names = []
+    costs = []
+    skipped = []
+    for rec_name, recording in recording_dict.items():
+        for sorter_name in sorter_list:
+
+            output_folder = working_folder / rec_name / sorter_name
+
+            if is_log_ok(output_folder, manifest=manifest):
+                # check is output_folders exists
+                if mode == 'raise':
+                    raise (Exception('output folder already exists for {} {}'.format(rec_name, sorter_name)))
+                elif mode == 'overwrite':
+                    # before the removal: if the new run is killed, the old 'done' entry is not the last one
+                    append_pending_to_manifest(output_folder)
+                    remove_folder(output_folder)
+                elif mode == 'keep':
+                    skipped.append((rec_name, sorter_name))
+                    continue
+                else:
+                    raise (ValueError('mode not in raise, overwrite, keep'))
+            params = sorter_params.get(sorter_name, {})
+
+            cache_key = None
+            if result_cache is not None:
+                cache_key = get_result_cache_key(recording, sorter_dict[sorter_name], params,
+                                                 grouping_property=grouping_property,
+                                                 split_by_time=sorter_kwargs.get('split_by_time', None),
+                                                 split_by_space=sorter_kwargs.get('split_by_space', None))
+                os.makedirs(str(output_folder), exist_ok=True)
+                if _restore_from_cache(result_cache, cache_key, sorter_name, params, output_folder):
+                    if verbose:
+                        print('{} {} result found in cache'.format(rec_name, sorter_name))
+                    skipped.append((rec_name, sorter_name))
+                    continue
+
+            needs = None
+            if preflight is not None:
+                estimate = estimate_task_resources(sorter_dict[sorter_name], recording, params,
+                                                   grouping_property=grouping_property)
+                if estimate is not None:
+                    needs = get_resource_needs(estimate, output_folder, scratch_folder=scratch_folder)
+                    # fail fast: a task that does not fit alone will never run
+                    _check_task_resources(needs, rec_name, sorter_name)
+
+            if need_serialize:
+                assert recording.check_if_dumpable(), 'if engine is not "loop" then recording have to be dumpable'
+                rec = recording.dump_to_dict()
+            else:
+                rec = recording
+            task_sorter_kwargs = dict(sorter_kwargs, **_get_task_policy(task_policy, sorter_name))
+            if sorter_kwargs.get('intermediates_folder', None) is not None:
+                # same layout as the working folder: the tasks never move files to the same place
+                task_sorter_kwargs['intermediates_folder'] = \
+                    Path(sorter_kwargs['intermediates_folder']) / rec_name / sorter_name
+            task_list.append(SortingTask(recording=rec, sorter_name=sorter_name, output_folder=output_folder,
+                                         grouping_property=grouping_property, verbose=verbose, params=params,
+                                         sorter_kwargs=task_sorter_kwargs, run_sorter_kwargs=run_sorter_kwargs,
+                                         result_cache=result_cache, cache_key=cache_key))
+            needs_list.append(needs)
+            task_names.append((rec_name, sorter_name))
+            costs.append(cost_model.predict(sorter_name, get_channel_frames(recording)))
+
+    assert task_order in ('lpt', None), "task_order must be 'lpt' or None"
+    if task_order == 'lpt':
+        order = get_lpt_order(costs)
+        task_list = [task_list[i] for i in order]
+        needs_list = [needs_list[i] for i in order]
+        task_names = [task_names[i] for i in order]
+        costs = [costs[i] for i in order]
+
+    return task_list, needs_list, task_names, costs, skipped
 
 
 def run_sorters(sorter_list, recording_dict_or_list, working_folder, sorter_params={}, grouping_property=None,
-                mode='raise', engine=None, engine_kwargs={}, verbose=False, with_output=True, run_sorter_kwargs={}):
+                mode='raise', engine=None, engine_kwargs={}, verbose=False, with_output=True, run_sorter_kwargs={},
+                result_cache=None, keep_intermediates=None, intermediates_folder=None, scratch_folder=None,
+                preflight=None, split_by_time=None, split_by_space=None, task_order='lpt', history_folders=None,
+                resume=False, task_policy=None):
     """
     This run several sorter on several recording.
     Simple implementation are nested loops or with multiprocessing.
@@ -44,7 +457,7 @@ def run_sorters(sorter_list, recording_dict_or_list, working_folder, sorter_para
     verbose=True/False to control sorter verbosity
 
     Note: engine='multiprocessing' use the python multiprocessing module.
-    This do not allow to have subprocess in subprocess.
+    This do not allow to have subprocess in subprocess: use engine='process' for that.
     So sorter that already use internally multiprocessing, this will fail.
 
     Parameters
@@ -74,13 +487,33 @@ def run_sorters(sorter_list, recording_dict_or_list, working_folder, sorter_para
             * 'keep' : do not compute again if f=subfolder exists and log is OK
 
     engine: str
-        'loop', 'multiprocessing', or 'dask'
+        'loop', 'multiprocessing', 'process', 'asyncio' or 'dask'
+        'process' uses non daemonic spawned workers: unlike 'multiprocessing', a sorter can use
+        multiprocessing or joblib inside a task (mountainsort4, run_sorter_kwargs={'parallel': True}, ...)
+        'asyncio' is for sorters running an external program (kilosort, ironclust, spyking circus, ...):
+        the programs are subprocesses awaited by one event loop, the setup and the other sorters run
+        in a pool of threads. It cannot be used in a running event loop (jupyter): use submit_sorters().
+        'filequeue' writes the tasks in a queue folder of a shared filesystem, where they are run by any
+        number of `python -m spikesorters.worker <queue_folder>` processes on any nodes (see filequeue.py).
 
     engine_kwargs: dict
         This contains kwargs specific to the launcher engine:
             * 'loop' : no kargs
             * 'multiprocessing' : {'processes' : } number of processes
-            * 'dask' : {'client':} the dask client for submiting task
+            * 'process' : {'processes' : } number of processes and {'max_tasks_per_child' : } number of tasks
+              run by a worker before being replaced by a fresh one (default 1, python >= 3.11), so that memory
+              leaked by a sorter does not accumulate over long batches
+            * 'asyncio' : {'max_concurrent' : } maximum number of concurrent tasks, an int or a dict
+              sorter_name -> int (default os.cpu_count() for each sorter), for instance to limit the number
+              of GPU or matlab sorters, and {'threads' : } the number of threads for setups (default None)
+            * 'filequeue' : {'queue_folder' : } the queue folder (default working_folder/spikeinterface_queue),
+              {'workers' : } number of workers started on this machine (default 0: the workers are started by
+              hand or by a job scheduler), {'stale_s' : } claims without heartbeat for this time are requeued
+              (default 120), {'max_requeues' : } (default 2), {'timeout' : } in s (default None)
+            * 'dask' : {'client':} the dask client for submiting task, {'resources' : } tag the tasks with the
+              dask resources 'cores', 'memory' and 'matlab' of the sorter, when declared by the workers
+              (default True, see resources.get_task_resources()), {'locality' : } prefer the workers whose local
+              filesystem holds the files of the recording (default True)
             
     verbose: bool
         default True
@@ -95,6 +528,57 @@ def run_sorters(sorter_list, recording_dict_or_list, working_folder, sorter_para
             * 'n_jobs' : int
             * 'joblib_backend' : 'loky' / 'multiprocessing' / 'threading'
 
+    result_cache: ResultCache or str or Path or None
+        If given (a ResultCache or its folder), tasks whose recording data, sorter, sorter version and params are
+        already in the cache are not computed: the cached result is copied in the output folder.
+        Computed results are added to the cache.
+
+    keep_intermediates: 'keep', 'delete', 'compress', 'move' or None
+        What to do with the intermediate files of each task once its result is successfully read back.
+        See run_sorter().
+
+    intermediates_folder: str or Path or None
+        Where intermediate files are moved with keep_intermediates='move', in intermediates_folder/rec_name/sorter_name
+
+    scratch_folder: str or Path or None
+        A folder on a fast local disk (of the worker) where each task runs before being copied back.
+        See run_sorter().
+
+    preflight: 'raise', 'queue' or None
+        The disk space and memory needed by each task are estimated (see BaseSorter.estimate_resources()):
+            * 'raise' : an InsufficientResourcesError is raised before starting if one task does not fit
+              in the available resources, and before each task with engine='loop'
+            * 'queue' : same as 'raise' but with engine='multiprocessing' or 'process' a task is started only
+              when it fits in the resources left by the running tasks
+            * None (default) : no check, the estimates are rough
+
+    split_by_time: tuple (segment_s, overlap_s) or None
+        Sort each recording as overlapping time segments stitched back together. See run_sorter().
+
+    split_by_space: tuple (channels_per_group, halo_um) or None
+        Sort each recording as spatial groups of channels with halo channels. See run_sorter().
+
+    task_order: 'lpt' or None
+        With 'lpt' (default) tasks are submitted longest first to the 'multiprocessing', 'process', 'asyncio'
+        and 'dask' engines.
+        The run time of a task is predicted from num_channels x num_frames and a per sorter coefficient,
+        learned from the previous runs of the working folder and of history_folders (see scheduler.py).
+        The order, the predicted and the actual makespan are written in spikeinterface_schedule.json.
+        None keeps the recording x sorter order.
+
+    history_folders: list or None
+        Other working folders of run_sorters() used to learn the run time coefficients.
+
+    resume: bool
+        If True, the working folder can exist, the finished tasks are skipped and the unfinished tasks are
+        resumed from their finished stages (see run_sorter()). mode='raise' is then the same as mode='keep'.
+
+    task_policy: dict or None
+        The limits and retries of the tasks: 'timeout_s', 'max_memory_mb', 'max_retries' and 'retry_backoff_s'
+        (see run_sorter()). A dict of these for all the sorters or a dict sorter_name -> dict, for instance
+        {'kilosort2': {'timeout_s': 3600, 'max_retries': 2}}. The outcome of each task ('done', 'failed',
+        'timeout' or 'memory') and its number of attempts are written in its log and in the manifest.
+
     Returns
     ----------
 
@@ -102,98 +586,313 @@ def run_sorters(sorter_list, recording_dict_or_list, working_folder, sorter_para
         The output is nested dict[(rec_name, sorter_name)] of SortingExtractor.
 
     """
-    if mode == 'raise':
+    if mode == 'raise' and not resume:
         assert not os.path.exists(working_folder), 'working_folder already exists, please remove it'
+    if resume and mode == 'raise':
+        # the finished tasks of the resumed batch are not run again
+        mode = 'keep'
     working_folder = Path(working_folder)
 
     if engine is None:
         engine = 'loop'
 
-    for sorter_name in sorter_list:
-        assert sorter_name in sorter_dict, '{} is not in sorter list'.format(sorter_name)
+    need_serialize = engine not in ('loop', 'asyncio')
+    sorter_kwargs = {'keep_intermediates': keep_intermediates, 'intermediates_folder': intermediates_folder,
+                     'scratch_folder': scratch_folder, 'split_by_time': split_by_time,
+                     'split_by_space': split_by_space, 'resume': resume}
+    task_list, needs_list, task_names, costs, skipped = _prepare_tasks(
+        sorter_list, recording_dict_or_list, working_folder, sorter_params=sorter_params,
+        grouping_property=grouping_property, mode=mode, need_serialize=need_serialize, verbose=verbose,
+        run_sorter_kwargs=run_sorter_kwargs, result_cache=result_cache, sorter_kwargs=sorter_kwargs,
+        preflight=preflight, task_order=task_order if engine != 'loop' else None, history_folders=history_folders,
+        task_policy=task_policy)
 
-    if isinstance(recording_dict_or_list, list):
-        # in case of list
-        recording_dict = {'recording_{}'.format(i): rec for i, rec in enumerate(recording_dict_or_list)}
-    elif isinstance(recording_dict_or_list, dict):
-        recording_dict = recording_dict_or_list
+    if engine in ('multiprocessing', 'process'):
+        num_workers = engine_kwargs.get('processes', None) or os.cpu_count()
+    elif engine == 'dask':
+        num_workers = sum(engine_kwargs['client'].nthreads().values()) if 'client' in engine_kwargs else 1
+    elif engine == 'asyncio':
+        limits = _get_concurrency_limits(task_list, engine_kwargs.get('max_concurrent', None))
+        num_workers = sum(limits.values())
+    elif engine == 'filequeue':
+        num_workers = engine_kwargs.get('workers', 0) or 1
     else:
-        raise (ValueError('bad recording dict'))
-
-    # when  grouping_property is not None : split in subrecording
-    # but the subrecording must have len=1 because otherwise it break
-    # the internal organisation of folder name.
-    if grouping_property is not None:
-        for rec_name, recording in recording_dict.items():
-            recording_list = recording.get_sub_extractors_by_property(grouping_property)
-            n_group = len(recording_list)
-            assert n_group == 1, 'run_sorters() works only if grouping_property=None or if it split into one subrecording'
-            recording_dict[rec_name] = recording_list[0]
-        grouping_property = None
-
-    need_serialize = engine != 'loop'
-
-    task_list = []
-    for rec_name, recording in recording_dict.items():
-        for sorter_name in sorter_list:
-
-            output_folder = working_folder / rec_name / sorter_name
-
-            if is_log_ok(output_folder):
-                # check is output_folders exists
-                if mode == 'raise':
-                    raise (Exception('output folder already exists for {} {}'.format(rec_name, sorter_name)))
-                elif mode == 'overwrite':
-                    shutil.rmtree(str(output_folder))
-                elif mode == 'keep':
-                    continue
-                else:
-                    raise (ValueError('mode not in raise, overwrite, keep'))
-            params = sorter_params.get(sorter_name, {})
-            if need_serialize:
-                assert recording.check_if_dumpable(), 'run_sorters(engine=... ) if engine is not "loop" then recording have to be dumpable'
-                rec = recording.dump_to_dict()
-            else:
-                rec = recording
-            task_list.append((rec, sorter_name, output_folder, grouping_property, verbose, params, run_sorter_kwargs))
+        num_workers = 1
+    predicted_makespan = predict_makespan(costs, num_workers)
+    t0 = time.perf_counter()
 
     if engine == 'loop':
         # simple loop in main process
-        for arg_list in task_list:
+        for arg_list, needs, (rec_name, sorter_name) in zip(task_list, needs_list, task_names):
+            # previous tasks have used disk space
+            _check_task_resources(needs, rec_name, sorter_name)
             _run_one(arg_list)
 
     elif engine == 'multiprocessing':
         # use mp.Pool
         processes = engine_kwargs.get('processes', None)
         pool = multiprocessing.Pool(processes)
-        pool.map(_run_one, task_list)
-        pool.close()
+        try:
+            if preflight == 'queue':
+                if processes is None:
+                    processes = os.cpu_count()
+                _run_queued(lambda arg_list: _submit_to_pool(pool, arg_list), task_list, needs_list, processes)
+            else:
+                # one task per chunk: contiguous chunks would run the longest tasks (first) on the same worker
+                pool.map(_run_one, task_list, chunksize=1)
+        finally:
+            pool.close()
+            # the workers finish their background folder removals when they exit (finalizer of trash.py)
+            pool.join()
+
+    elif engine == 'process':
+        processes = engine_kwargs.get('processes', None) or os.cpu_count()
+        executor = _get_process_executor(processes, engine_kwargs.get('max_tasks_per_child', 1))
+        with executor:
+            if preflight == 'queue':
+                _run_queued(lambda arg_list: executor.submit(_run_one, arg_list), task_list, needs_list, processes)
+            else:
+                futures = [executor.submit(_run_one, arg_list) for arg_list in task_list]
+                for future in futures:
+                    future.result()
+
+    elif engine == 'asyncio':
+        _run_until_complete(_run_all_async(task_list, limits, engine_kwargs.get('threads', None)))
+
+    elif engine == 'filequeue':
+        _run_filequeue(task_list, task_names, working_folder, engine_kwargs)
 
     elif engine == 'dask':
         client = engine_kwargs.get('client', None)
         assert client is not None, 'For dask engine you have to provide : client = dask.distributed.Client(...)'
 
-        tasks = []
-        for arg_list in task_list:
-            task = client.submit(_run_one, arg_list)
-            tasks.append(task)
+        futures = _submit_dask(client, task_list, task_names, use_resources=engine_kwargs.get('resources', True),
+                               locality=engine_kwargs.get('locality', True))
+        dask_outputs = {}
+        for (rec_name, sorter_name), future in zip(task_names, futures):
+            run_time, arrays = future.result()
+            if arrays is not None:
+                dask_outputs[(rec_name, sorter_name)] = CompactArraysSortingExtractor(arrays)
 
-        for task in tasks:
-            task.result()
+    actual_makespan = float(time.perf_counter() - t0)
+    if len(task_list) > 0:
+        write_schedule_report(working_folder, engine, num_workers, task_names, costs, predicted_makespan,
+                              actual_makespan)
+        if verbose:
+            print('run_sorters: {} tasks, predicted makespan {:0.1f}s, actual makespan {:0.1f}s'.format(
+                len(task_list), predicted_makespan, actual_makespan))
 
     if with_output:
         if engine == 'dask':
-            print('Warning!! With engine="dask" you cannot have directly output results\n' \
-                  'Use : run_sorters(..., with_output=False)\n' \
-                  'And then: results = collect_sorting_outputs(output_folders)')
-            return
+            # the output folders may not be visible from here: the sortings came back from the workers
+            results = dict(dask_outputs)
+            for rec_name, sorter_name in skipped:
+                results[(rec_name, sorter_name)] = _load_sorting_output(sorter_name,
+                                                                        working_folder / rec_name / sorter_name)
+            return results
 
         results = collect_sorting_outputs(working_folder)
         return results
 
 
-def is_log_ok(output_folder):
+class SortingJobs:
+    """
+    Handle on the tasks started by submit_sorters().
+
+    Attributes
+    ----------
+    futures: dict
+        (rec_name, sorter_name) -> future (concurrent.futures.Future, or dask Future with engine='dask')
+        of the submitted tasks. The result of a future is the sorter run time.
+    skipped: list
+        (rec_name, sorter_name) of the tasks not submitted because already done (mode='keep')
+        or restored from the result cache
+    """
+
+    def __init__(self, working_folder, futures, skipped, engine, executor=None):
+        self.working_folder = Path(working_folder)
+        self.futures = futures
+        self.skipped = skipped
+        self.engine = engine
+        self._executor = executor
+        self._submit_time = time.perf_counter()
+        self._done_times = {}
+        for key, future in futures.items():
+            future.add_done_callback(lambda f, key=key: self._done_times.setdefault(key, time.perf_counter()))
+
+    def __repr__(self):
+        num_done = sum(future.done() for future in self.futures.values())
+        return 'SortingJobs({}/{} tasks done, {} skipped)'.format(num_done, len(self.futures), len(self.skipped))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _get_output(self, key, future):
+        rec_name, sorter_name = key
+        output_folder = self.working_folder / rec_name / sorter_name
+        metrics = {'status': 'done', 'run_time': None, 'elapsed': None, 'output_folder': str(output_folder)}
+        if future is not None:
+            done_time = self._done_times.setdefault(key, time.perf_counter())
+            metrics['elapsed'] = float(done_time - self._submit_time)
+            if future.cancelled():
+                metrics['status'] = 'cancelled'
+                return rec_name, sorter_name, CancelledError(), metrics
+            try:
+                metrics['run_time'] = future.result()
+            except Exception as err:
+                metrics['status'] = 'failed'
+                return rec_name, sorter_name, err, metrics
+        log_file = output_folder / 'spikeinterface_log.json'
+        if metrics['run_time'] is None and log_file.is_file():
+            with open(str(log_file), 'r', encoding='utf8') as f:
+                log = json.load(f)
+            metrics['run_time'] = log.get('run_time', None)
+            if metrics['run_time'] is None:
+                # raise_error=False: the error is only in the log
+                metrics['status'] = 'failed'
+                return rec_name, sorter_name, SpikeSortingError(log.get('error_message', 'unknown error')), metrics
+        try:
+            sorting = sorter_dict[sorter_name].get_result_from_folder(output_folder)
+        except Exception as err:
+            metrics['status'] = 'failed'
+            return rec_name, sorter_name, err, metrics
+        return rec_name, sorter_name, sorting, metrics
+
+    def as_completed(self, timeout=None):
+        """
+        Iterate over the tasks as they finish (skipped tasks first).
+
+        Yields
+        ------
+        (rec_name, sorter_name, sorting_or_error, metrics)
+            sorting_or_error is the SortingExtractor, or the exception of a failed or cancelled task.
+            metrics is a dict with 'status' ('done', 'failed' or 'cancelled'), 'run_time' (run time of the sorter),
+            'elapsed' (time from submission to completion, None for skipped tasks) and 'output_folder'.
+        """
+        for key in self.skipped:
+            yield self._get_output(key, None)
+        keys = {future: key for key, future in self.futures.items()}
+        if self.engine == 'dask':
+            from distributed import as_completed
+            iterator = as_completed(list(keys.keys()), raise_errors=False, timeout=timeout)
+        else:
+            iterator = concurrent.futures.as_completed(list(keys.keys()), timeout=timeout)
+        for future in iterator:
+            yield self._get_output(keys[future], future)
+        # all tasks are done: this does not block
+        self.shutdown()
+
+    def results(self):
+        """
+        Wait for all the tasks and return dict (rec_name, sorter_name) -> SortingExtractor of the successful ones.
+        """
+        return {(rec_name, sorter_name): sorting for rec_name, sorter_name, sorting, metrics in self.as_completed()
+                if metrics['status'] == 'done'}
+
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+
+    def cancel(self):
+        """
+        Cancel the tasks not started yet (with dask running tasks are cancelled too).
+
+        Returns
+        -------
+        num_cancelled: int
+        """
+        for future in self.futures.values():
+            if not future.done():
+                future.cancel()
+        return sum(future.cancelled() for future in self.futures.values())
+
+    def shutdown(self):
+        # wait for the running tasks and free the workers (thread and process engines)
+        # note: shutdown(wait=False) of a ProcessPoolExecutor with max_tasks_per_child can break its
+        # management thread when a worker is replaced at the same time
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def submit_sorters(sorter_list, recording_dict_or_list, working_folder, sorter_params={}, grouping_property=None,
+                   mode='raise', engine='process', engine_kwargs={}, verbose=False, run_sorter_kwargs={},
+                   result_cache=None, keep_intermediates=None, intermediates_folder=None, scratch_folder=None,
+                   preflight=None, split_by_time=None, split_by_space=None, task_order='lpt', history_folders=None,
+                   resume=False, task_policy=None):
+    """
+    Same as run_sorters() but returns as soon as the tasks are submitted.
+
+    Downstream work (comparison, curation...) can start on the first finished tasks
+    while the others are still running:
+
+        >>> jobs = submit_sorters(['tridesclous', 'kilosort2'], recording_dict, 'working_folder')
+        >>> for rec_name, sorter_name, sorting, metrics in jobs.as_completed():
+        ...     if metrics['status'] == 'done':
+        ...         compare(sorting)
+
+    See run_sorters() for the parameters. Differences are:
+
+    engine: str
+        'process' (default, see run_sorters()), 'thread' (for sorters that wait on an external program)
+        or 'dask'
+    engine_kwargs: dict
+        * 'process' : {'processes':, 'max_tasks_per_child':}
+        * 'thread' : {'threads':} number of threads
+        * 'dask' : {'client':} the dask client for submiting task
+    preflight: 'raise' or None
+        See run_sorters() (default None). There is no resource queue: tasks are all submitted at once
+
+    Returns
+    -------
+    jobs: SortingJobs
+        The handle on the tasks, with futures, as_completed() and cancel()
+    """
+    if mode == 'raise' and not resume:
+        assert not os.path.exists(working_folder), 'working_folder already exists, please remove it'
+    if resume and mode == 'raise':
+        mode = 'keep'
+    assert engine in ('process', 'thread', 'dask'), "engine must be 'process', 'thread' or 'dask'"
+    assert preflight in ('raise', None), "preflight must be 'raise' or None"
+    working_folder = Path(working_folder)
+
+    sorter_kwargs = {'keep_intermediates': keep_intermediates, 'intermediates_folder': intermediates_folder,
+                     'scratch_folder': scratch_folder, 'split_by_time': split_by_time,
+                     'split_by_space': split_by_space, 'resume': resume}
+    task_list, _, task_names, _, skipped = _prepare_tasks(
+        sorter_list, recording_dict_or_list, working_folder, sorter_params=sorter_params,
+        grouping_property=grouping_property, mode=mode, need_serialize=engine != 'thread', verbose=verbose,
+        run_sorter_kwargs=run_sorter_kwargs, result_cache=result_cache, sorter_kwargs=sorter_kwargs,
+        preflight=preflight, task_order=task_order, history_folders=history_folders, task_policy=task_policy)
+
+    executor = None
+    if engine == 'process':
+        processes = engine_kwargs.get('processes', None) or os.cpu_count()
+        executor = _get_process_executor(processes, engine_kwargs.get('max_tasks_per_child', 1))
+        submit = executor.submit
+    elif engine == 'thread':
+        executor = ThreadPoolExecutor(max_workers=engine_kwargs.get('threads', None))
+        submit = executor.submit
+    else:
+        client = engine_kwargs.get('client', None)
+        assert client is not None, 'For dask engine you have to provide : client = dask.distributed.Client(...)'
+        # pure=False: a task is run again when submitted again
+        submit = lambda func, arg_list: client.submit(func, arg_list, pure=False)
+
+    futures = OrderedDict()
+    for arg_list, key in zip(task_list, task_names):
+        futures[key] = submit(_run_one, arg_list)
+    return SortingJobs(working_folder, futures, skipped, engine, executor=executor)
+
+
+def is_log_ok(output_folder, manifest=None):
     # log is OK when run_time is not None
+    # with a manifest of the working folder, the log is not read
+    output_folder = Path(output_folder)
+    if manifest is not None:
+        return manifest.is_ok(output_folder.parent.name, output_folder.name) and output_folder.is_dir()
     if os.path.exists(output_folder / 'spikeinterface_log.json'):
         with open(output_folder / 'spikeinterface_log.json', mode='r', encoding='utf8') as logfile:
             log = json.load(logfile)
@@ -204,7 +903,22 @@ def is_log_ok(output_folder):
 
 
 def iter_output_folders(output_folders):
+    """
+    Iterator over the finished tasks of a working folder: (rec_name, sorter_name, output_folder).
+
+    The manifest of the working folder is used when it exists, otherwise
+    all subfolders and logs are scanned (see manifest.rebuild_manifest()).
+    """
     output_folders = Path(output_folders)
+    manifest = Manifest(output_folders)
+    if manifest.exists():
+        for entry in manifest.iter_entries():
+            output_folder = output_folders / entry['rec_name'] / entry['sorter_name']
+            # folders removed by hand are skipped, as without manifest
+            if entry['status'] == 'done' and output_folder.is_dir():
+                yield entry['rec_name'], entry['sorter_name'], output_folder
+        return
+
     for rec_name in os.listdir(output_folders):
         if not os.path.isdir(output_folders / rec_name):
             continue
@@ -228,13 +942,131 @@ def iter_sorting_output(output_folders):
         yield rec_name, sorter_name, sorting
 
 
-def collect_sorting_outputs(output_folders):
+def _load_sorting_output(sorter_name, output_folder):
+    SorterClass = sorter_dict[sorter_name]
+    return SorterClass.get_result_from_folder(output_folder)
+
+
+def _prepare_sorting_output(sorter_name, output_folder):
+    # run in a worker process: parse the native output once and write the compact copy
+    # so that the main process only has to open memory-mapped arrays
+    SorterClass = sorter_dict[sorter_name]
+    try:
+        return SorterClass.ensure_compact_result(output_folder)
+    except Exception:
+        return False
+
+
+class LazySortingOutputs(Mapping):
+    """
+    Read-only mapping results[(rec_name, sorter_name)] -> SortingExtractor
+    where each sorting is loaded on first access.
+
+    Loaded sortings are kept in a LRU cache of max_cached items so that
+    thousands of outputs can be visited without keeping them all in memory.
+
+    Parameters
+    ----------
+    output_folders: str or Path
+        The working folder of run_sorters()
+    max_cached: int
+        Maximum number of sortings kept in memory
+    """
+
+    def __init__(self, output_folders, max_cached=128):
+        assert max_cached >= 1, 'max_cached must be at least 1'
+        self.max_cached = max_cached
+        self._folders = OrderedDict()
+        for rec_name, sorter_name, output_folder in iter_output_folders(output_folders):
+            self._folders[(rec_name, sorter_name)] = output_folder
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'LazySortingOutputs({} outputs, {} loaded)'.format(len(self._folders), len(self._cache))
+
+    def __len__(self):
+        return len(self._folders)
+
+    def __iter__(self):
+        return iter(self._folders)
+
+    def __contains__(self, key):
+        return key in self._folders
+
+    def __getitem__(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        # load outside the lock so that several threads can load different outputs
+        output_folder = self._folders[key]
+        sorting = _load_sorting_output(key[1], output_folder)
+        with self._lock:
+            self._cache[key] = sorting
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return sorting
+
+    def get_output_folder(self, key):
+        return self._folders[key]
+
+    def is_loaded(self, key):
+        return key in self._cache
+
+
+def collect_sorting_outputs(output_folders, n_jobs=1, engine='thread', lazy=False, max_cached=128):
     """
     Collect results in a output_folders.
 
     The output is a  dict with double key access results[(rec_name, sorter_name)] of SortingExtractor.
+
+    Parameters
+    ----------
+    output_folders: str or Path
+        The working folder of run_sorters()
+    n_jobs: int
+        Number of workers used to load the outputs (-1 for all cpus). 1 loads serially.
+    engine: 'thread' or 'process'
+        * 'thread' : outputs are loaded in a thread pool (good when reading is I/O bound)
+        * 'process' : native outputs are parsed in a process pool which writes their compact copy,
+          then the main process opens the memory-mapped copies
+    lazy: bool
+        If True, return a LazySortingOutputs: each sorting is loaded on first access
+        and kept in a LRU cache of max_cached items. n_jobs and engine are ignored.
+    max_cached: int
+        Size of the LRU cache when lazy=True
+
+    Returns
+    -------
+    results: dict or LazySortingOutputs
     """
+    if lazy:
+        return LazySortingOutputs(output_folders, max_cached=max_cached)
+
+    folders = [(rec_name, sorter_name, output_folder)
+               for rec_name, sorter_name, output_folder in iter_output_folders(output_folders)]
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
     results = {}
-    for rec_name, sorter_name, sorting in iter_sorting_output(output_folders):
-        results[(rec_name, sorter_name)] = sorting
+    if n_jobs == 1 or len(folders) <= 1:
+        for rec_name, sorter_name, output_folder in folders:
+            results[(rec_name, sorter_name)] = _load_sorting_output(sorter_name, output_folder)
+    elif engine == 'thread':
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            sortings = executor.map(_load_sorting_output, [f[1] for f in folders], [f[2] for f in folders])
+            for (rec_name, sorter_name, _), sorting in zip(folders, sortings):
+                results[(rec_name, sorter_name)] = sorting
+    elif engine == 'process':
+        # spawn: forking a process that already loaded threaded libraries (numba/tbb) can deadlock
+        # (loky before python 3.11, ProcessPoolExecutor has no mp_context before python 3.7)
+        with _get_process_executor(n_jobs, None) as executor:
+            # the result of the worker is not used: when it failed the output is parsed here
+            list(executor.map(_prepare_sorting_output, [f[1] for f in folders], [f[2] for f in folders]))
+        for rec_name, sorter_name, output_folder in folders:
+            results[(rec_name, sorter_name)] = _load_sorting_output(sorter_name, output_folder)
+    else:
+        raise ValueError("engine must be 'thread' or 'process'")
     return results
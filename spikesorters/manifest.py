@@ -0,0 +1,226 @@
+"""
+An append-only index of the tasks of a run_sorters() working folder.
+
+The manifest is a JSON-lines file at the root of the working folder. Each task
+that finishes appends one line with:
+  * rec_name, sorter_name
+  * status: 'done' or 'failed'
+  * run_time, sorter_version, params_hash, datetime
+  * channel_frames: number of channels x frames sorted (when known)
+  * outcome: 'done', 'failed', 'timeout' or 'memory' and num_attempts (when known)
+
+A task overwritten by run_sorters(mode='overwrite') first appends a line with
+status 'pending' (rec_name, sorter_name and datetime only), before its output
+folder is removed: if the new run is killed, the task is not seen as done.
+
+The last line of a (rec_name, sorter_name) wins. Lines are appended under an
+exclusive fcntl lock of the file, and flushed before the lock is released.
+O_APPEND alone is not enough on NFS, where the client emulates it and writes
+of workers on different nodes (engine='filequeue', dask) can overwrite each
+other: the lock makes the client see the current end of the file. Lines that
+cannot be decoded anyway (a file written without lock, on a platform without
+fcntl) are skipped with a warning.
+
+With it, iter_output_folders(), is_log_ok() and run_sorters(mode='keep') do not
+need to list the working folder and parse every spikeinterface_log.json.
+Folders written outside of run_sorters() (or removed by hand) are not seen until
+rebuild_manifest() is called.
+"""
+from pathlib import Path
+import os
+import json
+import hashlib
+import datetime
+import warnings
+
+try:
+    import fcntl
+    HAVE_FCNTL = True
+except ImportError:
+    HAVE_FCNTL = False
+
+from spikeextractors.baseextractor import _check_json
+
+manifest_filename = 'spikeinterface_manifest.jsonl'
+
+
+def get_params_hash(params):
+    txt = json.dumps(_check_json(dict(params)), sort_keys=True)
+    return hashlib.sha1(txt.encode('utf8')).hexdigest()
+
+
+class Manifest:
+    """
+    Read and append the manifest of a working folder.
+
+    Entries are read once and then only the bytes appended since the last
+    read are parsed (see update()).
+
+    Parameters
+    ----------
+    working_folder: str or Path
+        The working folder of run_sorters()
+    """
+
+    def __init__(self, working_folder):
+        self.working_folder = Path(working_folder)
+        self.filename = self.working_folder / manifest_filename
+        self._entries = {}
+        self._offset = 0
+        self.update()
+
+    def __repr__(self):
+        return 'Manifest({}, {} tasks)'.format(self.filename, len(self._entries))
+
+    def exists(self):
+        return self.filename.is_file()
+
+    def update(self):
+        """
+        Parse the lines appended since the last call.
+        """
+        if not self.filename.is_file():
+            return
+        with open(str(self.filename), 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # a line being written by another process has no newline yet: keep it for later
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line.decode('utf8'))
+                key = (entry['rec_name'], entry['sorter_name'])
+            except (ValueError, TypeError, KeyError):
+                # a torn line must not make the whole working folder unreadable
+                warnings.warn('Skipping an undecodable line of {}'.format(self.filename))
+                continue
+            self._entries[key] = entry
+        self._offset += end
+
+    def append(self, entry):
+        _append_line(self.working_folder, entry)
+
+    def get(self, rec_name, sorter_name):
+        return self._entries.get((rec_name, sorter_name), None)
+
+    def is_ok(self, rec_name, sorter_name):
+        entry = self.get(rec_name, sorter_name)
+        return entry is not None and entry['status'] == 'done'
+
+    def iter_entries(self):
+        for entry in self._entries.values():
+            yield entry
+
+
+def _append_line(working_folder, entry):
+    # a locked write at the end of the manifest: the existing lines are not read
+    line = (json.dumps(_check_json(entry)) + '\n').encode('utf8')
+    os.makedirs(str(working_folder), exist_ok=True)
+    fd = os.open(str(Path(working_folder) / manifest_filename), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if HAVE_FCNTL:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            if HAVE_FCNTL:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def make_manifest_entry(rec_name, sorter_name, run_time, sorter_version, params, when=None, channel_frames=None,
+                        outcome=None, num_attempts=None):
+    if when is None:
+        when = datetime.datetime.now()
+    entry = {
+        'rec_name': str(rec_name),
+        'sorter_name': str(sorter_name),
+        'status': 'done' if run_time is not None else 'failed',
+        'run_time': run_time,
+        'sorter_version': str(sorter_version),
+        'params_hash': get_params_hash(params),
+        'datetime': when,
+    }
+    if channel_frames is not None:
+        entry['channel_frames'] = int(channel_frames)
+    if outcome is not None:
+        entry['outcome'] = str(outcome)
+    if num_attempts is not None:
+        entry['num_attempts'] = int(num_attempts)
+    return entry
+
+
+def make_pending_entry(rec_name, sorter_name, when=None):
+    if when is None:
+        when = datetime.datetime.now()
+    return {'rec_name': str(rec_name), 'sorter_name': str(sorter_name), 'status': 'pending', 'datetime': when}
+
+
+def append_to_manifest(output_folder, run_time, sorter_version, params, when=None, channel_frames=None,
+                       outcome=None, num_attempts=None):
+    """
+    Append the outcome of a task given its output folder (working_folder / rec_name / sorter_name).
+    """
+    output_folder = Path(output_folder)
+    entry = make_manifest_entry(output_folder.parent.name, output_folder.name, run_time, sorter_version, params,
+                                when=when, channel_frames=channel_frames, outcome=outcome,
+                                num_attempts=num_attempts)
+    _append_line(output_folder.parent.parent, entry)
+
+
+def append_pending_to_manifest(output_folder):
+    """
+    Mark a task as not finished given its output folder: only a new 'done' entry marks it finished again.
+    """
+    output_folder = Path(output_folder)
+    _append_line(output_folder.parent.parent, make_pending_entry(output_folder.parent.name, output_folder.name))
+
+
+def rebuild_manifest(working_folder):
+    """
+    Rebuild the manifest of a working folder by scanning all the subfolders
+    and their spikeinterface_log.json.
+
+    This is slow on large working folders: use it for folders made by an older
+    version or modified by hand.
+
+    Returns
+    -------
+    manifest: Manifest
+    """
+    working_folder = Path(working_folder)
+    lines = []
+    for rec_name in sorted(os.listdir(working_folder)):
+        if not (working_folder / rec_name).is_dir():
+            continue
+        for sorter_name in sorted(os.listdir(working_folder / rec_name)):
+            output_folder = working_folder / rec_name / sorter_name
+            log_file = output_folder / 'spikeinterface_log.json'
+            if not log_file.is_file():
+                continue
+            with open(str(log_file), 'r', encoding='utf8') as f:
+                log = json.load(f)
+            params = {}
+            params_file = output_folder / 'spikeinterface_params.json'
+            if params_file.is_file():
+                with open(str(params_file), 'r', encoding='utf8') as f:
+                    params = json.load(f).get('sorter_params', {})
+            channel_frames = None
+            if 'num_channels' in log and 'num_frames' in log:
+                channel_frames = log['num_channels'] * log['num_frames']
+            entry = make_manifest_entry(rec_name, sorter_name, log.get('run_time', None),
+                                        log.get('sorter_version', ''), params, when=log.get('datetime', None),
+                                        channel_frames=channel_frames, outcome=log.get('outcome', None),
+                                        num_attempts=log.get('num_attempts', None))
+            lines.append(json.dumps(_check_json(entry)) + '\n')
+
+    filename = working_folder / manifest_filename
+    tmp_filename = working_folder / (manifest_filename + '.tmp{}'.format(os.getpid()))
+    with open(str(tmp_filename), 'w', encoding='utf8') as f:
+        f.writelines(lines)
+    os.replace(str(tmp_filename), str(filename))
+    return Manifest(working_folder)
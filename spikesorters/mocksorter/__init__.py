@@ -0,0 +1 @@
+from .mocksorter import MockSorter
@@ -0,0 +1,191 @@
+from pathlib import Path
+import time
+import sys
+
+import numpy as np
+
+import spikeextractors as se
+
+from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes
+from ..sorter_tools import recover_recording
+from ..utils.shellscript import ShellScript
+from ..version import version
+
+
+class MockSorter(BaseSorter):
+    """
+    A fake sorter that does not sort anything.
+
+    It sleeps, burns CPU, allocates memory, fails at random and writes
+    random spikes in a firings.mda file. It is useful to measure the
+    overhead of the launcher engines independently of real sorters.
+    With run_async() (engine='asyncio') or external=True it sleeps and
+    allocates memory in a shell script, like the sorters running an external
+    program.
+    """
+
+    sorter_name = 'mocksorter'
+    requires_locations = False
+    cost_coefficient = 0.001
+    setup_params = []  # the exported traces do not depend on the params
+    intermediate_files = ['intermediate.dat', 'recording.dat']
+    compatible_with_parallel = {'loky': True, 'multiprocessing': True, 'threading': True}
+
+    _default_params = {
+        'sleep_s': 0.,
+        'cpu_burn_s': 0.,
+        'memory_mb': 0,
+        'num_units': 10,
+        'num_spikes': 1000,
+        'failure_rate': 0.,
+        'log_lines': 0,
+        'intermediate_mb': 0,
+        'seed': None,
+        'external': False,
+        'export': False,
+    }
+
+    _params_description = {
+        'sleep_s': "Time in s spent sleeping (simulates waiting for an external process)",
+        'cpu_burn_s': "Time in s spent computing (simulates an in-process sorter)",
+        'memory_mb': "Memory in MB allocated during the run",
+        'num_units': "Number of units in the output",
+        'num_spikes': "Total number of spikes in the output",
+        'failure_rate': "Probability (between 0 and 1) that the run raises an error",
+        'log_lines': "Number of extra lines written in the sorter log (simulates verbose sorters)",
+        'intermediate_mb': "Size in MB of an intermediate file written in the output folder",
+        'seed': "Seed for the random generator (None for a random seed)",
+        'external': "If True, the sleep, the memory and the log lines are done by a shell script also with run()",
+        'export': "If True, the setup exports the traces in a binary file (like most sorters)",
+    }
+
+    sorter_description = """Mock sorter that writes random spikes. It is meant for testing and benchmarking the
+    launcher, not for spike sorting."""
+
+    installation_mesg = ""
+
+    def __init__(self, **kargs):
+        BaseSorter.__init__(self, **kargs)
+
+    @classmethod
+    def is_installed(cls):
+        return True
+
+    @staticmethod
+    def get_sorter_version():
+        return version
+
+    def runs_external_program(self):
+        # _prepare_script() is defined for external=True only
+        return self.params['external']
+
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        nbytes = params['intermediate_mb'] * 1024 ** 2
+        if params['export']:
+            nbytes += get_recording_bytes(recording, dtype='float32')
+        return make_estimate(disk_bytes=nbytes + params['num_spikes'] * 16, scratch_bytes=nbytes,
+                             peak_ram_bytes=params['memory_mb'] * 1024 ** 2)
+
+    def _setup_recording(self, recording, output_folder):
+        if self.params['export']:
+            self._write_binary(recording, Path(output_folder) / 'recording.dat', dtype='float32', chunk_mb=500)
+
+    def _run(self, recording, output_folder):
+        if self.params['external']:
+            return BaseSorter._run(self, recording, output_folder)
+        recording = recover_recording(recording)
+        p = self.params
+        output_folder = Path(output_folder)
+
+        rng = np.random.RandomState(p['seed'])
+        log_lines = []
+
+        if p['sleep_s'] > 0:
+            time.sleep(p['sleep_s'])
+            log_lines.append('slept {} s'.format(p['sleep_s']))
+
+        if p['cpu_burn_s'] > 0:
+            t0 = time.perf_counter()
+            x = rng.randn(256, 256)
+            while time.perf_counter() - t0 < p['cpu_burn_s']:
+                x = np.tanh(x @ x.T / 256.)
+            log_lines.append('burnt {} s of cpu'.format(p['cpu_burn_s']))
+
+        if p['memory_mb'] > 0:
+            # touch all pages so that the memory is really resident
+            buffer = np.ones(int(p['memory_mb'] * 1024 ** 2 // 8), dtype='float64')
+            log_lines.append('allocated {} MB'.format(buffer.nbytes // 1024 ** 2))
+            del buffer
+
+        if p['intermediate_mb'] > 0:
+            data = np.zeros(int(p['intermediate_mb'] * 1024 ** 2 // 2), dtype='int16')
+            data[::7] = rng.randint(-100, 100, size=data[::7].size)
+            data.tofile(str(output_folder / 'intermediate.dat'))
+            log_lines.append('wrote {} MB of intermediate data'.format(p['intermediate_mb']))
+
+        with (output_folder / f'{self.sorter_name}.log').open('w') as f:
+            for i in range(p['log_lines']):
+                f.write('mocksorter log line {}\n'.format(i))
+            f.write('\n'.join(log_lines) + '\n')
+
+        self._write_output(recording, output_folder, rng)
+
+    def _prepare_script(self, recording, output_folder):
+        # with run_async() the sleep and the log lines are done by a shell script (bash only)
+        p = self.params
+        if p['memory_mb'] > 0:
+            # the memory is held during the sleep
+            sleep_cmd = '"{}" -c "import time; buffer = b\'x\' * {}; time.sleep({})"'.format(
+                sys.executable, int(p['memory_mb'] * 1024 ** 2), p['sleep_s'])
+        else:
+            sleep_cmd = 'sleep {}'.format(p['sleep_s'])
+        shell_cmd = '''
+            #!/bin/bash
+            i=0
+            while [ $i -lt {log_lines} ]; do
+                echo "mocksorter log line $i"
+                i=$((i+1))
+            done
+            {sleep_cmd}
+            echo "slept {sleep_s} s"
+        '''.format(log_lines=p['log_lines'], sleep_cmd=sleep_cmd, sleep_s=p['sleep_s'])
+        return ShellScript(shell_cmd, script_path=Path(output_folder) / f'run_{self.sorter_name}',
+                           log_path=Path(output_folder) / f'{self.sorter_name}.log', verbose=self.verbose)
+
+    def _finalize_run(self, recording, output_folder, retcode):
+        if retcode != 0:
+            raise Exception('mocksorter returned a non-zero exit code')
+        rng = np.random.RandomState(self.params['seed'])
+        self._write_output(recording, Path(output_folder), rng)
+
+    def _write_output(self, recording, output_folder, rng):
+        p = self.params
+        if rng.rand() < p['failure_rate']:
+            raise Exception('mocksorter simulated failure')
+
+        num_frames = recording.get_num_frames()
+        times = np.sort(rng.randint(0, num_frames, size=p['num_spikes']))
+        labels = rng.randint(1, p['num_units'] + 1, size=p['num_spikes'])
+        sorting = se.NumpySortingExtractor()
+        sorting.set_times_labels(times, labels)
+        sorting.set_sampling_frequency(recording.get_sampling_frequency())
+
+        se.MdaSortingExtractor.write_sorting(sorting, str(output_folder / 'firings.mda'))
+
+        samplerate_fname = str(output_folder / 'samplerate.txt')
+        with open(samplerate_fname, 'w') as f:
+            f.write('{}'.format(recording.get_sampling_frequency()))
+
+    @staticmethod
+    def _get_result_from_folder(output_folder):
+        output_folder = Path(output_folder)
+
+        result_fname = str(output_folder / 'firings.mda')
+        samplerate_fname = str(output_folder / 'samplerate.txt')
+        with open(samplerate_fname, 'r') as f:
+            samplerate = float(f.read())
+
+        sorting = se.MdaSortingExtractor(file_path=result_fname, sampling_frequency=samplerate)
+        return sorting
@@ -1,10 +1,12 @@
 import copy
+import os
 from pathlib import Path
 
 import spikeextractors as se
 from spiketoolkit.preprocessing import bandpass_filter, whiten
 
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, python_ram_bytes
 from ..sorter_tools import recover_recording
 
 try:
@@ -22,6 +24,7 @@ class Mountainsort4Sorter(BaseSorter):
 
     sorter_name = 'mountainsort4'
     requires_locations = False
+    cost_coefficient = 0.5
     compatible_with_parallel = {'loky': True, 'multiprocessing': False, 'threading': False}
 
     _default_params = {
@@ -79,6 +82,16 @@ class Mountainsort4Sorter(BaseSorter):
             return ml_ms4alg.__version__
         return 'unknown'
 
+    @classmethod
+    def get_num_cores(cls, params):
+        return params['num_workers'] if params['num_workers'] is not None else max(1, os.cpu_count() // 2)
+
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # in process: the (filtered, whitened) traces are prepared as float32 in a temporary file
+        nbytes = get_recording_bytes(recording, dtype='float32')
+        return make_estimate(disk_bytes=nbytes, scratch_bytes=nbytes, peak_ram_bytes=python_ram_bytes + nbytes // 10)
+
     def _setup_recording(self, recording, output_folder):
         pass
 
@@ -132,7 +145,7 @@ class Mountainsort4Sorter(BaseSorter):
             f.write('{}'.format(samplerate))
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         output_folder = Path(output_folder)
         tmpdir = output_folder
 
@@ -0,0 +1,239 @@
+"""
+Preflight estimation of the resources needed by a sorter.
+
+Each sorter implements estimate_resources(recording, params) which returns a
+dict with:
+  * 'disk_bytes': bytes written in the output folder (exported traces, temporary files, results)
+  * 'scratch_bytes': the part of disk_bytes that are intermediate files (see intermediate_files)
+  * 'peak_ram_bytes': peak memory of the sorter process
+
+These are estimates made from what the wrapper writes (dtype, number of
+copies): they are meant to catch the jobs that would fill a disk hours after
+the start, not to be accurate to the byte.
+"""
+from pathlib import Path
+import os
+import shutil
+
+import numpy as np
+
+try:
+    import psutil
+    HAVE_PSUTIL = True
+except ImportError:
+    HAVE_PSUTIL = False
+
+# rough memory footprint of a matlab or python process running a sorter (libraries, buffers...)
+matlab_ram_bytes = 2 * 1024 ** 3
+python_ram_bytes = 1024 ** 3
+
+
+class InsufficientResourcesError(RuntimeError):
+    """Raised when a sorter is not started because disk space or memory is missing"""
+
+
+def get_recording_dtype(recording):
+    try:
+        return np.dtype(recording.get_dtype())
+    except Exception:
+        return np.dtype(recording.get_traces(start_frame=0, end_frame=1).dtype)
+
+
+def get_recording_bytes(recording, dtype=None):
+    """
+    Size in bytes of the traces of a recording written with dtype (the recording dtype if None).
+    """
+    if dtype is None:
+        dtype = get_recording_dtype(recording)
+    return int(recording.get_num_channels()) * int(recording.get_num_frames()) * np.dtype(dtype).itemsize
+
+
+def make_estimate(disk_bytes=0, scratch_bytes=0, peak_ram_bytes=0):
+    return {'disk_bytes': int(disk_bytes), 'scratch_bytes': int(scratch_bytes), 'peak_ram_bytes': int(peak_ram_bytes)}
+
+
+def get_available_memory():
+    """
+    Available memory in bytes (None if unknown).
+    """
+    if HAVE_PSUTIL:
+        return int(psutil.virtual_memory().available)
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _existing_folder(path):
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def estimate_task_resources(SorterClass, recording, params={}, grouping_property=None):
+    """
+    Estimate the resources of a sorter on a recording, summing the disk over groups.
+    Return None if the sorter has no estimator.
+    """
+    full_params = SorterClass.default_params()
+    full_params.update(params)
+    if grouping_property is None:
+        recording_list = [recording]
+    else:
+        recording_list = recording.get_sub_extractors_by_property(grouping_property)
+    estimate = make_estimate()
+    try:
+        for rec in recording_list:
+            e = SorterClass.estimate_resources(rec, full_params)
+            estimate['disk_bytes'] += e['disk_bytes']
+            estimate['scratch_bytes'] += e['scratch_bytes']
+            estimate['peak_ram_bytes'] = max(estimate['peak_ram_bytes'], e['peak_ram_bytes'])
+    except NotImplementedError:
+        return None
+    return estimate
+
+
+def get_resource_needs(estimate, output_folder, scratch_folder=None):
+    """
+    Turn an estimate into needs per resource.
+
+    Returns
+    -------
+    needs: dict
+        'memory' -> bytes and one (st_dev, folder) key -> bytes per filesystem
+    """
+    needs = {'memory': estimate['peak_ram_bytes']}
+
+    def add_disk(folder, nbytes):
+        # one key per filesystem
+        folder = _existing_folder(folder)
+        dev = os.stat(str(folder)).st_dev
+        for key in needs:
+            if key != 'memory' and key[0] == dev:
+                needs[key] += nbytes
+                return
+        needs[(dev, folder)] = nbytes
+
+    if scratch_folder is None:
+        add_disk(output_folder, estimate['disk_bytes'])
+    else:
+        # everything is written on scratch, only the results are copied back
+        add_disk(scratch_folder, estimate['disk_bytes'])
+        add_disk(output_folder, estimate['disk_bytes'] - estimate['scratch_bytes'])
+    return needs
+
+
+def get_resource_id(key):
+    # 'memory' or the device id of a filesystem: the same for all folders of a filesystem
+    return key if key == 'memory' else key[0]
+
+
+def reserve_resources(reserved, needs, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) needs from reserved (a dict resource id -> bytes), in place.
+    """
+    for key, need in needs.items():
+        rid = get_resource_id(key)
+        reserved[rid] = reserved.get(rid, 0) + sign * need
+
+
+def get_available_resources(keys):
+    available = {}
+    for key in keys:
+        if key == 'memory':
+            available[key] = get_available_memory()
+        else:
+            available[key] = shutil.disk_usage(str(key[1])).free
+    return available
+
+
+def get_missing_resources(needs, reserved=None):
+    """
+    Compare needs to the currently available resources minus what is reserved by running tasks
+    (see reserve_resources()).
+
+    Returns
+    -------
+    missing: list of str
+        Human readable description of what is missing (empty if the task fits)
+    """
+    available = get_available_resources(needs.keys())
+    missing = []
+    for key, need in needs.items():
+        if available[key] is None:
+            continue
+        free = available[key]
+        if reserved is not None:
+            free -= reserved.get(get_resource_id(key), 0)
+        if need > free:
+            name = 'memory' if key == 'memory' else 'disk space in {}'.format(key[1])
+            missing.append('{}: {:.2f} GB needed, {:.2f} GB available'.format(name, need / 1024 ** 3,
+                                                                               free / 1024 ** 3))
+    return missing
+
+
+def check_resources(estimate, output_folder, scratch_folder=None, sorter_name=''):
+    """
+    Raise InsufficientResourcesError if the estimate does not fit in the free disk space or memory.
+    """
+    if estimate is None:
+        return
+    missing = get_missing_resources(get_resource_needs(estimate, output_folder, scratch_folder=scratch_folder))
+    if len(missing) > 0:
+        raise InsufficientResourcesError('Not enough resources to run {}: '.format(sorter_name) + '; '.join(missing))
+
+
+def get_task_resources(SorterClass, recording, params={}, grouping_property=None):
+    """
+    Abstract resources of a task, for the dask worker resources of run_sorters(engine='dask'):
+      * 'cores': SorterClass.get_num_cores()
+      * 'memory': the estimated peak memory in bytes (not given if the sorter has no estimator)
+      * 'matlab': 1 for the sorters running in matlab (a license)
+    """
+    full_params = SorterClass.default_params()
+    full_params.update(params)
+    resources = {'cores': int(SorterClass.get_num_cores(full_params))}
+    estimate = estimate_task_resources(SorterClass, recording, params, grouping_property=grouping_property)
+    if estimate is not None:
+        resources['memory'] = estimate['peak_ram_bytes']
+    if SorterClass.uses_matlab:
+        resources['matlab'] = 1
+    return resources
+
+
+def fit_task_resources(task_resources, worker_resources, task_name=''):
+    """
+    Adapt the resources of a task to the resources declared by the workers.
+
+    A task that asks for a resource declared by no worker would never start: only the resources
+    declared by at least one worker are kept. Cores are limited to the largest worker.
+
+    Parameters
+    ----------
+    task_resources: dict
+        See get_task_resources()
+    worker_resources: list of dict
+        The resources declared by each worker
+
+    Returns
+    -------
+    resources: dict
+        Raise InsufficientResourcesError if no worker has enough of a resource
+    """
+    resources = {}
+    for name, amount in task_resources.items():
+        available = [r[name] for r in worker_resources if name in r]
+        if len(available) == 0 or amount <= 0:
+            continue
+        if name == 'cores':
+            amount = min(amount, max(available))
+        elif amount > max(available):
+            raise InsufficientResourcesError('No worker has enough {} to run {}: {} needed, {} on the largest '
+                                             'worker'.format(name, task_name, amount, max(available)))
+        resources[name] = amount
+    return resources
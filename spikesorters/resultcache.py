@@ -0,0 +1,254 @@
+"""
+A content-addressed cache of sorting results.
+
+The key is a hash of:
+  * a fingerprint of the recording data (shape, sampling frequency, channel
+    properties and a few chunks of traces) plus either the serialized recording
+    (dump_to_dict()) with the path, size and modification time of its files, or
+    all the traces for the recordings that can not be dumped (in memory), so the
+    same data gives the same key whatever its name in run_sorters()
+  * the sorter name and its version (get_sorter_version())
+  * the full set of params (defaults included)
+  * the grouping_property
+
+Each entry is a folder in the compact format (see compactsorting.py).
+When the cache is larger than max_size_mb, the least recently used entries
+are removed.
+"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from spikeextractors.baseextractor import _check_json
+
+from .compactsorting import write_compact_sorting, read_compact_sorting_info, CompactSortingExtractor
+
+
+def _get_file_identities(dump_dict):
+    # (path, size, modification time) of the existing files and folders named in a dump_to_dict()
+    identities = []
+
+    def walk(obj):
+        if isinstance(obj, dict):
+            for key in sorted(obj.keys(), key=str):
+                walk(obj[key])
+        elif isinstance(obj, (list, tuple)):
+            for value in obj:
+                walk(value)
+        elif isinstance(obj, (str, Path)) and len(str(obj)) < 4096 and os.path.exists(str(obj)):
+            path = Path(obj).absolute()
+            files = [path] if path.is_file() else sorted(p for p in path.rglob('*') if p.is_file())
+            for file in files:
+                stat = file.stat()
+                identities.append([str(file), int(stat.st_size), int(stat.st_mtime_ns)])
+
+    walk(dump_dict)
+    return identities
+
+
+def get_recording_fingerprint(recording, grouping_property=None, num_chunks=4, chunk_size=1024):
+    """
+    Hash the content of a recording.
+
+    A few chunks of traces are always hashed. A recording that can be dumped is also identified by
+    dump_to_dict() and the path, size and modification time of its files, so that two recordings
+    differing outside the chunks get different fingerprints without reading all the traces.
+    The traces of the other recordings (in memory) are all hashed.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The recording
+    grouping_property: str or None
+        Channel property used for grouping, included in the hash
+    num_chunks: int
+        Number of chunks of traces, evenly spaced, included in the hash
+    chunk_size: int
+        Number of frames per chunk (and per read when all the traces are hashed)
+
+    Returns
+    -------
+    fingerprint: str
+        The sha1 hex digest
+    """
+    h = hashlib.sha1()
+    channel_ids = recording.get_channel_ids()
+    num_frames = recording.get_num_frames()
+    desc = {
+        'channel_ids': [int(c) for c in channel_ids],
+        'num_frames': int(num_frames),
+        'sampling_frequency': float(recording.get_sampling_frequency()),
+    }
+    property_names = ['location', 'gain', 'offset']
+    if grouping_property is not None:
+        property_names.append(grouping_property)
+    for prop_name in property_names:
+        if prop_name in recording.get_shared_channel_property_names():
+            desc[prop_name] = [recording.get_channel_property(c, prop_name) for c in channel_ids]
+    h.update(json.dumps(_check_json(desc), sort_keys=True).encode('utf8'))
+
+    chunk_size = min(chunk_size, num_frames)
+    starts = np.linspace(0, num_frames - chunk_size, num_chunks).astype('int64')
+    for start in np.unique(starts):
+        traces = recording.get_traces(start_frame=int(start), end_frame=int(start + chunk_size))
+        h.update(np.ascontiguousarray(traces).tobytes())
+
+    if recording.check_if_dumpable():
+        dump_dict = recording.dump_to_dict()
+        h.update(json.dumps(_check_json(dump_dict), sort_keys=True).encode('utf8'))
+        h.update(json.dumps(_get_file_identities(dump_dict)).encode('utf8'))
+    else:
+        read_size = max(chunk_size, 2 ** 20 // max(len(channel_ids), 1))
+        for start in range(0, num_frames, read_size):
+            traces = recording.get_traces(start_frame=start, end_frame=min(start + read_size, num_frames))
+            h.update(np.ascontiguousarray(traces).tobytes())
+    return h.hexdigest()
+
+
+def get_result_cache_key(recording, SorterClass, params, grouping_property=None, split_by_time=None,
+                         split_by_space=None):
+    """
+    Compute the cache key of a (recording, sorter, params) combination.
+    params are completed with the sorter default params.
+    """
+    full_params = SorterClass.default_params()
+    full_params.update(params)
+    desc = {
+        'recording': get_recording_fingerprint(recording, grouping_property=grouping_property),
+        'sorter_name': SorterClass.sorter_name,
+        'sorter_version': str(SorterClass.get_sorter_version()),
+        'params': full_params,
+        'grouping_property': grouping_property,
+    }
+    if split_by_time is not None:
+        # only added when used so that existing keys are unchanged
+        desc['split_by_time'] = list(split_by_time)
+    if split_by_space is not None:
+        desc['split_by_space'] = list(split_by_space)
+    txt = json.dumps(_check_json(desc), sort_keys=True)
+    return hashlib.sha1(txt.encode('utf8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded cache of sorting results, shared by run_sorter() and run_sorters().
+
+    Entries are written atomically (write then rename) so several processes
+    can use the same cache folder.
+
+    Parameters
+    ----------
+    cache_folder: str or Path
+        The folder of the cache (created if needed)
+    max_size_mb: float or None
+        Maximum size of the cache. None for unbounded.
+    """
+
+    def __init__(self, cache_folder, max_size_mb=None):
+        self.cache_folder = Path(cache_folder).absolute()
+        self.max_size_mb = max_size_mb
+        os.makedirs(str(self.cache_folder), exist_ok=True)
+
+    def __repr__(self):
+        return 'ResultCache({}, max_size_mb={})'.format(self.cache_folder, self.max_size_mb)
+
+    def _entry_folder(self, key):
+        return self.cache_folder / key
+
+    def has(self, key):
+        return (self._entry_folder(key) / 'sorting_info.json').is_file()
+
+    def _touch(self, key):
+        try:
+            os.utime(str(self._entry_folder(key) / 'sorting_info.json'), None)
+        except OSError:
+            pass
+
+    def get(self, key):
+        """
+        Return the cached sorting or None.
+        """
+        if not self.has(key):
+            return None
+        self._touch(key)
+        try:
+            return CompactSortingExtractor(self._entry_folder(key))
+        except (OSError, ValueError):
+            # entry removed concurrently
+            return None
+
+    def get_metadata(self, key):
+        return read_compact_sorting_info(self._entry_folder(key))['metadata']
+
+    def put(self, key, sorting, metadata=None):
+        """
+        Store a sorting and evict old entries if needed.
+        """
+        write_compact_sorting(sorting, self._entry_folder(key), metadata=metadata)
+        self.evict()
+
+    def restore(self, key, folder_path):
+        """
+        Copy an entry into folder_path. Return False if the key is not in the cache.
+        """
+        if not self.has(key):
+            return False
+        self._touch(key)
+        folder_path = Path(folder_path)
+        if folder_path.is_dir():
+            shutil.rmtree(str(folder_path))
+        try:
+            shutil.copytree(str(self._entry_folder(key)), str(folder_path))
+        except (OSError, shutil.Error):
+            return False
+        return True
+
+    def get_size_mb(self):
+        return sum(size for _, _, size in self._list_entries()) / 1024 ** 2
+
+    def _list_entries(self):
+        entries = []
+        for name in os.listdir(str(self.cache_folder)):
+            entry = self.cache_folder / name
+            info_file = entry / 'sorting_info.json'
+            if not info_file.is_file():
+                continue
+            try:
+                last_access = os.path.getmtime(str(info_file))
+                size = sum(f.stat().st_size for f in entry.iterdir())
+            except OSError:
+                continue
+            entries.append((name, last_access, size))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size_mb.
+        """
+        if self.max_size_mb is None:
+            return
+        entries = sorted(self._list_entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        max_size = self.max_size_mb * 1024 ** 2
+        for name, _, size in entries:
+            if total <= max_size:
+                break
+            shutil.rmtree(str(self.cache_folder / name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for name, _, _ in self._list_entries():
+            shutil.rmtree(str(self.cache_folder / name), ignore_errors=True)
+
+
+def get_result_cache(result_cache):
+    """
+    Accept a ResultCache, a folder or None.
+    """
+    if result_cache is None or isinstance(result_cache, ResultCache):
+        return result_cache
+    return ResultCache(result_cache)
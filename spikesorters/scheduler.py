@@ -0,0 +1,133 @@
+"""
+Cost model and longest-processing-time-first ordering of run_sorters() tasks.
+
+The cost of a task is predicted as:
+
+    num_channels x num_frames / 1e6 x coefficient(sorter)
+
+The coefficient of a sorter is its cost_coefficient class attribute (a rough
+prior) until runs of this sorter are known: then it is the median of the
+run_time / (channels x frames / 1e6) of the previous runs, read from the
+manifest (or the spikeinterface_log.json files) of working folders.
+
+Tasks are then submitted longest first: with a pool of workers this avoids
+a long task started last that determines the makespan of the batch.
+"""
+from pathlib import Path
+import os
+import json
+import heapq
+
+import numpy as np
+
+from spikeextractors.baseextractor import _check_json
+
+from .manifest import Manifest
+
+schedule_filename = 'spikeinterface_schedule.json'
+
+
+def get_channel_frames(recording):
+    return int(recording.get_num_channels()) * int(recording.get_num_frames())
+
+
+class CostModel:
+    """
+    Predict the run time of sorters from the size of the recording.
+
+    Parameters
+    ----------
+    sorter_dict: dict
+        sorter_name -> SorterClass (for the cost_coefficient priors)
+    """
+
+    def __init__(self, sorter_dict):
+        self.sorter_dict = sorter_dict
+        self._ratios = {}
+
+    def add_run(self, sorter_name, run_time, channel_frames):
+        if run_time is None or not channel_frames:
+            return
+        self._ratios.setdefault(sorter_name, []).append(run_time / (channel_frames / 1e6))
+
+    def add_working_folder(self, working_folder):
+        """
+        Learn from the finished tasks of a run_sorters() working folder.
+        The manifest is used when it exists, otherwise the logs are read.
+        """
+        working_folder = Path(working_folder)
+        if not working_folder.is_dir():
+            return
+        manifest = Manifest(working_folder)
+        if manifest.exists():
+            for entry in manifest.iter_entries():
+                if entry['status'] == 'done':
+                    self.add_run(entry['sorter_name'], entry['run_time'], entry.get('channel_frames', None))
+            return
+        for rec_name in os.listdir(working_folder):
+            if not (working_folder / rec_name).is_dir():
+                continue
+            for sorter_name in os.listdir(working_folder / rec_name):
+                log_file = working_folder / rec_name / sorter_name / 'spikeinterface_log.json'
+                if not log_file.is_file():
+                    continue
+                with open(str(log_file), 'r', encoding='utf8') as f:
+                    log = json.load(f)
+                if 'num_channels' in log and 'num_frames' in log:
+                    self.add_run(sorter_name, log.get('run_time', None), log['num_channels'] * log['num_frames'])
+
+    def get_num_runs(self, sorter_name):
+        return len(self._ratios.get(sorter_name, []))
+
+    def get_coefficient(self, sorter_name):
+        ratios = self._ratios.get(sorter_name, [])
+        if len(ratios) > 0:
+            return float(np.median(ratios))
+        return float(self.sorter_dict[sorter_name].cost_coefficient)
+
+    def predict(self, sorter_name, channel_frames):
+        """
+        Predicted run time in seconds.
+        """
+        return channel_frames / 1e6 * self.get_coefficient(sorter_name)
+
+
+def get_lpt_order(costs):
+    """
+    Indices of the tasks sorted by decreasing cost (longest processing time first).
+    Equal costs keep their original order.
+    """
+    return [int(i) for i in np.argsort(-np.asarray(costs, dtype='float64'), kind='stable')]
+
+
+def predict_makespan(costs, num_workers):
+    """
+    Makespan of tasks started in the given order, each one on the first free worker.
+    """
+    if len(costs) == 0:
+        return 0.
+    workers = [0.] * max(1, min(int(num_workers), len(costs)))
+    for cost in costs:
+        heapq.heappush(workers, heapq.heappop(workers) + cost)
+    return float(max(workers))
+
+
+def write_schedule_report(working_folder, engine, num_workers, task_names, costs, predicted_makespan,
+                          actual_makespan):
+    """
+    Write the submission order, the predicted costs and the predicted and actual makespan
+    in spikeinterface_schedule.json of the working folder.
+    """
+    report = {
+        'engine': engine,
+        'num_workers': int(num_workers),
+        'predicted_makespan': predicted_makespan,
+        'actual_makespan': actual_makespan,
+        'tasks': [{'rec_name': str(rec_name), 'sorter_name': str(sorter_name), 'predicted_cost': cost}
+                  for (rec_name, sorter_name), cost in zip(task_names, costs)],
+    }
+    working_folder = Path(working_folder)
+    os.makedirs(str(working_folder), exist_ok=True)
+    with open(str(working_folder / schedule_filename), 'w', encoding='utf8') as f:
+        json.dump(_check_json(report), f, indent=4)
+    return report
@@ -2,6 +2,9 @@
 Some utils function to run command.
 """
 from subprocess import Popen, PIPE, CalledProcessError, call, check_output
+from pathlib import Path
+import os
+import json
 import shlex
 import sys
 import spikeextractors as se
@@ -72,5 +75,63 @@ def recover_recording(rec_arg):
     return recording
 
 
+def read_log_tail(log_file, max_lines=50, block_size=8192):
+    """
+    Read the last lines of a (possibly huge) text file by reading blocks from the end.
+
+    Returns
+    -------
+    lines: list of str
+        The last max_lines lines
+    size: int
+        The size of the file in bytes
+    """
+    with open(str(log_file), 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        data = b''
+        while pos > 0 and data.count(b'\n') <= max_lines:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = [line.strip() for line in data.decode('utf8', errors='replace').splitlines()]
+    if pos > 0:
+        # the first line is probably truncated
+        lines = lines[1:]
+    if max_lines == 0:
+        return [], size
+    return lines[-max_lines:], size
+
+
+def iter_runtime_trace(output_folder):
+    """
+    Iterate over the lines of the runtime trace of the last run in output_folder,
+    using the path and byte offsets stored in spikeinterface_log.json.
+    """
+    output_folder = Path(output_folder)
+    with open(str(output_folder / 'spikeinterface_log.json'), 'r', encoding='utf8') as f:
+        log = json.load(f)
+    if log.get('runtime_trace_path', None) is None:
+        return
+    start, end = log['runtime_trace_offsets']
+    with open(str(output_folder / log['runtime_trace_path']), 'rb') as f:
+        f.seek(start)
+        for line in f:
+            if start >= end:
+                break
+            start += len(line)
+            yield line.decode('utf8', errors='replace').strip()
+
+
 class SpikeSortingError(RuntimeError):
     """Raised whenever spike sorting fails"""
+
+
+class SorterTimeoutError(SpikeSortingError):
+    """Raised when the program of a sorter is stopped because it ran for more than timeout_s"""
+
+
+class SorterMemoryError(SpikeSortingError):
+    """Raised when the program of a sorter is stopped because it used more than max_memory_mb"""
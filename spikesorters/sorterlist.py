@@ -10,6 +10,10 @@ from .spyking_circus import SpykingcircusSorter
 from .herdingspikes import HerdingspikesSorter
 from .waveclus import WaveClusSorter
 from .combinato import CombinatoSorter
+from .mocksorter import MockSorter
+from .resultcache import get_result_cache, get_result_cache_key
+from .resources import estimate_task_resources, check_resources
+from .concatenation import concatenate_recordings, split_sorting, write_sessions
 
 sorter_full_list = [
     HDSortSorter,
@@ -23,7 +27,8 @@ sorter_full_list = [
     SpykingcircusSorter,
     HerdingspikesSorter,
     WaveClusSorter,
-    CombinatoSorter
+    CombinatoSorter,
+    MockSorter
 ]
 
 sorter_dict = {s.sorter_name: s for s in sorter_full_list}
@@ -31,9 +36,11 @@ sorter_dict = {s.sorter_name: s for s in sorter_full_list}
 
 
 # generic laucnher via function approach
-def run_sorter(sorter_name_or_class, recording, output_folder=None, delete_output_folder=False,
+def run_sorter(sorter_name_or_class, recording=None, output_folder=None, delete_output_folder=False,
                grouping_property=None, parallel=False, verbose=False, raise_error=True, n_jobs=-1, joblib_backend='loky',
-               **params):
+               result_cache=None, keep_intermediates=None, intermediates_folder=None, scratch_folder=None,
+               preflight=None, split_by_time=None, split_by_space=None, resume=False, timeout_s=None,
+               max_memory_mb=None, max_retries=0, retry_backoff_s=10., recordings=None, **params):
     """
     Generic function to run a sorter via function approach.
 
@@ -45,6 +52,9 @@ def run_sorter(sorter_name_or_class, recording, output_folder=None, delete_outpu
     by class:
        >>> sorting = run_sorter(TridesclousSorter, recording)
 
+    several sessions sorted as one (same units in all the sessions):
+       >>> sorting_session1, sorting_session2 = run_sorter('kilosort2', recordings=[recording1, recording2])
+
     Parameters
     ----------
     sorter_name_or_class: str or SorterClass
@@ -68,13 +78,65 @@ def run_sorter(sorter_name_or_class, recording, output_folder=None, delete_outpu
         Number of jobs when parallel=True (default=-1)
     joblib_backend: str
         joblib backend when parallel=True (default='loky')
+    result_cache: ResultCache or str or Path or None
+        If given (a ResultCache or its folder), the result is taken from the cache when the same recording data was
+        already sorted with the same sorter, sorter version and params. Otherwise the result is added to the cache.
+    keep_intermediates: 'keep', 'delete', 'compress', 'move' or None
+        What to do with the intermediate files of the sorter (exported traces, temporary files) once the result
+        is successfully read back. The freed bytes are reported in the log.
+        None is 'keep' without scratch_folder and 'delete' with a scratch_folder.
+    intermediates_folder: str or Path or None
+        Where intermediate files are moved with keep_intermediates='move' (a cold storage for instance),
+        in the same subfolders as in output_folder. The destination is written in the log.
+    scratch_folder: str or Path or None
+        A folder on a fast local disk. If given, the export, the sorter temporary files and the sorting itself
+        are done in a subfolder of it, then the files are copied back to output_folder and the subfolder is removed,
+        on success as on failure.
+    preflight: 'raise' or None
+        If 'raise', the disk space and memory needed by the sorter (see estimate_resources()) are checked
+        before starting and an InsufficientResourcesError is raised if they are not available.
+        None (default) is no check: the estimates are rough.
+    split_by_time: tuple (segment_s, overlap_s) or None
+        If given, the recording (each group) is sorted as segments of segment_s seconds overlapping by overlap_s
+        seconds, in parallel with parallel=True. Units are merged across segments by template similarity in the
+        overlaps and duplicated spikes at the boundaries are removed (see timesplit.py).
+    split_by_space: tuple (channels_per_group, halo_um) or None
+        If given, the channels are automatically partitioned from their locations into compact groups of at most
+        channels_per_group channels, extended with the channels closer than halo_um (halo). Groups are sorted
+        in parallel with parallel=True and a unit found by several groups is kept by the group owning its
+        peak channel (see spacesplit.py). Can not be used with grouping_property.
+    resume: bool
+        If True, the output folder of a previous (failed or killed) run is not removed. In each group (or time
+        segment) folder, the setup and the run are marked as done with a hash of the sorter, its version, the params
+        and the recording: the stages done with the same hash are skipped, the other ones are done again.
+        Can not be used with scratch_folder.
+    timeout_s: float or None
+        For the sorters running an external program (matlab, MPI...): the maximum wall-clock time in s of the
+        program of each group (and each attempt). Beyond it, the program and its children are stopped with
+        SIGINT, then SIGTERM, then SIGKILL and the run fails with a SorterTimeoutError.
+    max_memory_mb: float or None
+        For the sorters running an external program: the maximum resident memory in MB of the program and its
+        children (checked every second with psutil). Beyond it, the program is stopped and the run fails with a
+        SorterMemoryError. Without psutil, it is a limit of the virtual memory of the program (setrlimit).
+    max_retries: int
+        Number of times a failed run is retried (default 0), after retry_backoff_s * 2 ** attempt seconds.
+        The setup is kept and only the groups not finished are run again. The failed attempts and the outcome
+        ('done', 'failed', 'timeout' or 'memory') are written in the log.
+    retry_backoff_s: float
+        The delay before the first retry in s (default 10)
+    recordings: list of RecordingExtractor or None
+        If given instead of recording, the sessions (same channels and sampling frequency) are concatenated
+        in time without copy and sorted as one recording. Raw binary sessions of the same dtype are given
+        as several files to the sorters accepting them (klusta) or copied once without decoding in the
+        exported traces. The frame offsets of the sessions are written in spikeinterface_sessions.json
+        (see concatenation.read_session_sortings()).
     **params: keyword args
         Spike sorter specific arguments (they can be retrieved with 'get_default_params(sorter_name_or_class)'
 
     Returns
     -------
-    sortingextractor: SortingExtractor
-        The spike sorted data
+    sortingextractor: SortingExtractor or list of SortingExtractor
+        The spike sorted data, one per session with recordings (with the frames of the session)
 
     """
     if isinstance(sorter_name_or_class, str):
@@ -84,12 +146,46 @@ def run_sorter(sorter_name_or_class, recording, output_folder=None, delete_outpu
     else:
         raise (ValueError('Unknown sorter'))
 
+    if recordings is not None:
+        assert recording is None, 'give recording or recordings, not both'
+        recording, frame_offsets = concatenate_recordings(recordings)
+        num_frames = [rec.get_num_frames() for rec in recordings]
+
+    result_cache = get_result_cache(result_cache)
+    if result_cache is not None:
+        cache_key = get_result_cache_key(recording, SorterClass, params, grouping_property=grouping_property,
+                                         split_by_time=split_by_time, split_by_space=split_by_space)
+        sortingextractor = result_cache.get(cache_key)
+        if sortingextractor is not None:
+            if verbose:
+                print('{} result found in cache {}'.format(SorterClass.sorter_name, cache_key))
+            if recordings is not None:
+                return split_sorting(sortingextractor, frame_offsets, num_frames)
+            return sortingextractor
+
+    if preflight == 'raise':
+        estimate = estimate_task_resources(SorterClass, recording, params, grouping_property=grouping_property)
+        check_resources(estimate, output_folder if output_folder is not None else '.', scratch_folder=scratch_folder,
+                        sorter_name=SorterClass.sorter_name)
+
     sorter = SorterClass(recording=recording, output_folder=output_folder, grouping_property=grouping_property,
-                         verbose=verbose, delete_output_folder=delete_output_folder)
+                         verbose=verbose, delete_output_folder=delete_output_folder,
+                         keep_intermediates=keep_intermediates, intermediates_folder=intermediates_folder,
+                         scratch_folder=scratch_folder, split_by_time=split_by_time,
+                         split_by_space=split_by_space, resume=resume, timeout_s=timeout_s,
+                         max_memory_mb=max_memory_mb, max_retries=max_retries, retry_backoff_s=retry_backoff_s)
     sorter.set_params(**params)
-    sorter.run(raise_error=raise_error, parallel=parallel, n_jobs=n_jobs, joblib_backend=joblib_backend)
+    run_time = sorter.run(raise_error=raise_error, parallel=parallel, n_jobs=n_jobs, joblib_backend=joblib_backend)
     sortingextractor = sorter.get_result()
 
+    if result_cache is not None and run_time is not None:
+        result_cache.put(cache_key, sortingextractor, metadata={'sorter_name': SorterClass.sorter_name,
+                                                                'run_time': run_time})
+
+    if recordings is not None:
+        if sorter.root_output_folder.is_dir():
+            write_sessions(sorter.root_output_folder, frame_offsets, num_frames)
+        return split_sorting(sortingextractor, frame_offsets, num_frames)
     return sortingextractor
 
 
@@ -632,3 +728,40 @@ def run_combinato(*args, **kwargs):
         The spike sorted data
     """
     return run_sorter('combinato', *args, **kwargs)
+
+
+def run_mocksorter(*args, **kwargs):
+    """
+    Runs mocksorter, a fake sorter used for testing and benchmarking the launchers
+
+    Parameters
+    ----------
+    *args: arguments of 'run_sorter'
+        recording: RecordingExtractor
+            The recording extractor to be spike sorted
+        output_folder: str or Path
+            Path to output folder
+        delete_output_folder: bool
+            If True, output folder is deleted (default False)
+        grouping_property: str
+            Splits spike sorting by 'grouping_property' (e.g. 'groups')
+        parallel: bool
+            If True and spike sorting is by 'grouping_property', spike sorting jobs are launched in parallel
+        verbose: bool
+            If True, output is verbose
+        raise_error: bool
+            If True, an error is raised if spike sorting fails (default). If False, the process continues and the error
+            is logged in the log file
+        n_jobs: int
+            Number of jobs when parallel=True (default=-1)
+        joblib_backend: str
+            joblib backend when parallel=True (default='loky')
+    **kwargs: keyword args
+        Spike sorter specific arguments (they can be retrieved with 'get_default_params('mocksorter')
+
+    Returns
+    -------
+    sortingextractor: SortingExtractor
+        The spike sorted data
+    """
+    return run_sorter('mocksorter', *args, **kwargs)
@@ -0,0 +1,114 @@
+"""
+Sort a high channel count probe as spatially compact groups of channels.
+
+The channels are partitioned by recursive bisection of their locations into
+compact "core" groups of at most channels_per_group channels. Each group is
+extended with "halo" channels: the channels of other groups closer than
+halo_um to one of its channels, so that a neuron at the border of a group is
+fully seen by the group that owns it.
+
+Each group (core + halo) is sorted independently (in parallel, see
+BaseSorter(split_by_space=...)). A neuron near a border is then found by
+several groups: a unit is kept only by the group whose core contains the peak
+channel of its template, computed on all the channels of the probe.
+"""
+import numpy as np
+
+import spikeextractors as se
+
+from .timesplit import get_templates
+
+
+def get_spatial_partition(locations, channels_per_group, halo_um):
+    """
+    Partition channels into spatially compact groups with halo channels.
+
+    Parameters
+    ----------
+    locations: array (num_channels, ndim)
+        The channel locations
+    channels_per_group: int
+        Maximum number of core channels per group
+    halo_um: float
+        Channels closer than halo_um to a core channel are added to the group
+
+    Returns
+    -------
+    partition: list of (core, channels)
+        Channel indices: core channels (each channel is the core of exactly one group)
+        and all the channels of the group (core + halo), sorted
+    """
+    locations = np.asarray(locations, dtype='float64')
+    num_channels = locations.shape[0]
+    assert channels_per_group > 0, 'channels_per_group must be positive'
+    num_groups = int(np.ceil(num_channels / channels_per_group))
+
+    def bisect(inds, k):
+        # split along the largest extent, with sizes proportional to the number of groups on each side
+        if k == 1:
+            return [inds]
+        k0 = k // 2
+        axis = int(np.argmax(np.ptp(locations[inds], axis=0)))
+        order = inds[np.argsort(locations[inds, axis], kind='stable')]
+        n0 = int(round(len(inds) * k0 / k))
+        return bisect(order[:n0], k0) + bisect(order[n0:], k - k0)
+
+    partition = []
+    for core in bisect(np.arange(num_channels), num_groups):
+        core = np.sort(core)
+        diff = locations[:, None, :] - locations[None, core, :]
+        distance = np.min(np.sqrt(np.sum(diff ** 2, axis=2)), axis=1)
+        channels = np.union1d(core, np.flatnonzero(distance <= halo_um))
+        partition.append((core, channels))
+    return partition
+
+
+def get_peak_channels(recording, sorting, ms_before=1., ms_after=2., max_spikes_per_unit=100):
+    """
+    Channel id of the largest (absolute) template amplitude of each unit.
+    The templates are computed without the channel baselines (see timesplit.get_templates()).
+
+    Returns
+    -------
+    peak_channels: dict
+        unit_id -> channel_id (units without spikes are not in the dict)
+    """
+    fs = recording.get_sampling_frequency()
+    nbefore = int(ms_before * fs / 1000.)
+    nafter = int(ms_after * fs / 1000.)
+    spike_trains = {}
+    for unit_id in sorting.get_unit_ids():
+        times = np.asarray(sorting.get_unit_spike_train(unit_id)).astype('int64')
+        if times.size > max_spikes_per_unit:
+            times = times[np.linspace(0, times.size - 1, max_spikes_per_unit).astype('int64')]
+        spike_trains[unit_id] = times
+    templates = get_templates(recording, spike_trains, nbefore, nafter)
+    channel_ids = recording.get_channel_ids()
+    return {unit_id: channel_ids[int(np.argmax(np.max(np.abs(template), axis=1)))]
+            for unit_id, template in templates.items()}
+
+
+def remove_halo_units(recording, sorting, core_channel_ids, **kwargs):
+    """
+    Keep the units of a group whose template peak is on a core channel.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The full recording: the peak is searched on all channels so that a unit found by several
+        groups has the same peak channel in all of them
+    sorting: SortingExtractor
+        The sorting of the group
+    core_channel_ids: list
+        The core channels of the group
+    **kwargs:
+        Passed to get_peak_channels()
+
+    Returns
+    -------
+    sorting: SubSortingExtractor
+    """
+    peak_channels = get_peak_channels(recording, sorting, **kwargs)
+    core_channel_ids = set(core_channel_ids)
+    unit_ids = [u for u in sorting.get_unit_ids() if peak_channels.get(u, None) in core_channel_ids]
+    return se.SubSortingExtractor(sorting, unit_ids=unit_ids)
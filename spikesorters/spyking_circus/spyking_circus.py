@@ -7,8 +7,8 @@ import sys
 
 import spikeextractors as se
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, python_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import recover_recording
 
 try:
     import circus
@@ -23,6 +23,8 @@ class SpykingcircusSorter(BaseSorter):
 
     sorter_name = 'spykingcircus'
     requires_locations = False
+    cost_coefficient = 0.5
+    intermediate_files = ['recording.npy']
 
     _default_params = {
         'detect_sign': -1,  # -1 - 1 - 0
@@ -75,6 +77,18 @@ class SpykingcircusSorter(BaseSorter):
     def get_sorter_version():
         return circus.__version__
 
+    @classmethod
+    def get_num_cores(cls, params):
+        return params['num_workers'] if params['num_workers'] is not None else max(1, os.cpu_count() // 2)
+
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # float32 recording.npy (filtered in place), chunks of 2**24 samples in RAM per worker
+        nbytes = get_recording_bytes(recording, dtype='float32')
+        num_workers = cls.get_num_cores(params)
+        peak_ram = python_ram_bytes + num_workers * 2 ** 24 * 4
+        return make_estimate(disk_bytes=nbytes, scratch_bytes=nbytes, peak_ram_bytes=peak_ram)
+
     def _setup_recording(self, recording, output_folder):
         p = self.params
         source_dir = Path(__file__).parent
@@ -126,8 +140,7 @@ class SpykingcircusSorter(BaseSorter):
         if p['num_workers'] is None:
             p['num_workers'] = np.maximum(1, int(os.cpu_count()/2))
 
-    def _run(self,  recording, output_folder):
-        recording = recover_recording(recording)
+    def _prepare_script(self, recording, output_folder):
         if recording.is_filtered and self.params['filter']:
             print("Warning! The recording is already filtered, but Spyking-Circus filter is enabled. You can disable "
                   "filters by setting 'filter' parameter to False")
@@ -145,14 +158,13 @@ class SpykingcircusSorter(BaseSorter):
 
         shell_script = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                    log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_script.start()
-
-        retcode = shell_script.wait()
+        return shell_script
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('spykingcircus returned a non-zero exit code')
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         sorting = se.SpykingCircusSortingExtractor(folder_path=Path(output_folder) / 'recording')
         return sorting
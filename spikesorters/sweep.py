@@ -0,0 +1,260 @@
+"""
+Parameter sweeps of one sorter on one recording, see run_sorter_sweep().
+
+Each param set of the grid is sorted in its own subfolder of the sweep folder. The traces
+exported by the setup of the sorter (BaseSorter._write_binary()) are written once in
+sweep_folder/spikeinterface_exports and linked in the subfolders: the param sets share the
+exports, which are kept for the next sweeps in the same folder.
+
+SorterClass.setup_params are the params that change the exported traces. The param sets with
+the same values of these params form an export group: the first param set of a group starts
+first, the other ones when its setup (and so its export) is done, signaled by a marker file
+sweep_folder/params<i>.setup_done. The param sets run in parallel within a budget
+of cores, memory and matlab licenses (see resources.get_task_resources()).
+"""
+from pathlib import Path
+import os
+import json
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from spikeextractors.baseextractor import _check_json
+
+from .sorterlist import sorter_dict, sorter_full_list
+from .sorter_tools import recover_recording
+from .compactsorting import get_compact_arrays, CompactArraysSortingExtractor
+from .resources import get_task_resources, get_available_memory
+from .trash import remove_folder, trash_folder_name
+from .launcher import _get_process_executor
+
+export_folder_name = 'spikeinterface_exports'
+sweep_filename = 'spikeinterface_sweep.json'
+# the pending param sets of a group wait for the marker of the first one
+export_poll_s = 0.2
+
+
+def get_param_sets(param_grid):
+    """
+    The param sets of a grid: a dict param -> list of values (all the combinations)
+    or a list of dicts (the param sets themselves).
+    """
+    if isinstance(param_grid, dict):
+        names = list(param_grid.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+    return [dict(params) for params in param_grid]
+
+
+def get_export_groups(SorterClass, param_sets):
+    """
+    The export group of each param set: param sets with the same values of SorterClass.setup_params
+    share the same exported traces (all the params when setup_params is None).
+
+    Returns
+    -------
+    groups: list of int
+    """
+    keys = []
+    groups = []
+    for params in param_sets:
+        full_params = SorterClass.default_params()
+        full_params.update(params)
+        if SorterClass.setup_params is not None:
+            full_params = {name: full_params[name] for name in SorterClass.setup_params}
+        key = json.dumps(_check_json(full_params), sort_keys=True)
+        if key not in keys:
+            keys.append(key)
+        groups.append(keys.index(key))
+    return groups
+
+
+def _fits(resources, used, budget):
+    return all(used.get(name, 0) + amount <= budget[name] for name, amount in resources.items() if name in budget)
+
+
+def _reserve(used, resources, sign=1):
+    for name, amount in resources.items():
+        used[name] = used.get(name, 0) + sign * amount
+
+
+def _setup_and_mark(setup_folders, setup_marker):
+    log = setup_folders()
+    Path(setup_marker).touch()
+    return log
+
+
+def _run_sweep_task(task):
+    # run one param set in a worker, return its outcome and the compact arrays of the sorting
+    sorter_name, rec, output_folder, params, sorter_kwargs, setup_marker = task
+    outcome = {'status': 'failed', 'outcome': 'failed', 'run_time': None, 'error': None}
+    try:
+        SorterClass = sorter_dict[sorter_name]
+        sorter = SorterClass(recording=recover_recording(rec), output_folder=output_folder, **sorter_kwargs)
+        sorter.set_params(**params)
+        if setup_marker is not None:
+            # the exports are written by the setup: the other param sets of the group can start after it
+            sorter._setup_folders = functools.partial(_setup_and_mark, sorter._setup_folders, setup_marker)
+        run_time = sorter.run(raise_error=False)
+    except Exception as err:
+        # setup failure
+        outcome['error'] = str(err)
+        return outcome, None
+    outcome['outcome'] = sorter.outcome
+    if run_time is None:
+        with open(str(Path(output_folder) / 'spikeinterface_log.json'), 'r', encoding='utf8') as f:
+            outcome['error'] = json.load(f).get('error_message', None)
+        return outcome, None
+    outcome['status'] = 'done'
+    outcome['run_time'] = run_time
+    return outcome, get_compact_arrays(sorter.get_result())
+
+
+def run_sorter_sweep(sorter_name_or_class, recording, param_grid, sweep_folder=None, n_jobs=1, budget=None,
+                     engine=None, grouping_property=None, sorter_kwargs=None, metric_func=None, verbose=False):
+    """
+    Run a sorter on one recording with all the param sets of a grid, sharing the export of the traces.
+
+        >>> rows = run_sorter_sweep('kilosort2', recording, {'projection_threshold': [[10, 4], [8, 3]],
+        ...                                                  'detect_threshold': [5, 6]}, n_jobs=2)
+        >>> table = pandas.DataFrame(rows)
+
+    Parameters
+    ----------
+    sorter_name_or_class: str or SorterClass
+        The sorter
+    recording: RecordingExtractor
+        The recording extractor to be spike sorted
+    param_grid: dict or list of dict
+        A dict param -> list of values (all the combinations are run) or a list of param sets.
+        The other params are the default ones.
+    sweep_folder: str or Path or None
+        The param set i is sorted in sweep_folder/params<i> (default: <sorter_name>_sweep).
+        The results of a previous sweep are removed, its exported traces are kept and reused.
+    n_jobs: int
+        Maximum number of param sets running at the same time (-1 for the number of cores)
+    budget: dict or None
+        Maximum total of the resources of the running param sets (see resources.get_task_resources()):
+        'cores', 'memory' (bytes) and 'matlab' (licenses). A param set starts only if it fits in what the
+        running ones leave (or if nothing runs). None is the cores of the machine and its available memory.
+    engine: 'process', 'thread' or None
+        'process' needs a dumpable recording, 'thread' is for sorters running an external program.
+        None is 'process' if the recording is dumpable, 'thread' otherwise.
+    grouping_property: str or None
+        Splits spike sorting by 'grouping_property' (see run_sorter())
+    sorter_kwargs: dict or None
+        Other kwargs of the sorter: keep_intermediates, timeout_s, max_memory_mb, max_retries...
+    metric_func: function or None
+        metric_func(sorting) returns a dict of metrics added to the row of each sorted param set
+        (agreement with a ground truth for instance)
+    verbose: bool
+        If True, output is verbose
+
+    Returns
+    -------
+    rows: list of dict
+        One row per param set, in the order of the grid, with a column per param of the grid and:
+        'sorting' (None if the sorting failed), 'status', 'outcome', 'run_time', 'error', 'num_units',
+        'num_spikes', 'export_group', 'output_folder' and the metrics of metric_func.
+        The rows without 'sorting' are also written in sweep_folder/spikeinterface_sweep.json.
+    """
+    if isinstance(sorter_name_or_class, str):
+        SorterClass = sorter_dict[sorter_name_or_class]
+    elif sorter_name_or_class in sorter_full_list:
+        SorterClass = sorter_name_or_class
+    else:
+        raise (ValueError('Unknown sorter'))
+
+    if sweep_folder is None:
+        sweep_folder = SorterClass.sorter_name + '_sweep'
+    sweep_folder = Path(sweep_folder).absolute()
+    if sweep_folder.is_dir():
+        for path in sweep_folder.iterdir():
+            if path.name in (export_folder_name, trash_folder_name):
+                continue
+            if path.is_dir():
+                remove_folder(path)
+            else:
+                path.unlink()
+    os.makedirs(str(sweep_folder), exist_ok=True)
+
+    param_sets = get_param_sets(param_grid)
+    groups = get_export_groups(SorterClass, param_sets)
+    # the first param set of a group does the export
+    leaders = {}
+    for i, group in enumerate(groups):
+        leaders.setdefault(group, i)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if engine is None:
+        engine = 'process' if recording.check_if_dumpable() else 'thread'
+    assert engine in ('process', 'thread'), "engine must be 'process', 'thread' or None"
+    if budget is None:
+        budget = {'cores': os.cpu_count()}
+        available_memory = get_available_memory()
+        if available_memory is not None:
+            budget['memory'] = available_memory
+
+    rec = recording.dump_to_dict() if engine == 'process' else recording
+    kwargs = dict(sorter_kwargs if sorter_kwargs is not None else {}, grouping_property=grouping_property,
+                  verbose=verbose, export_folder=sweep_folder / export_folder_name)
+    output_folders = [sweep_folder / 'params{}'.format(i) for i in range(len(param_sets))]
+    setup_markers = [sweep_folder / 'params{}.setup_done'.format(i) for i in range(len(param_sets))]
+    task_kwargs = [dict(kwargs) for _ in param_sets]
+    if kwargs.get('intermediates_folder', None) is not None:
+        # the param sets never move their intermediate files to the same place
+        for i, output_folder in enumerate(output_folders):
+            task_kwargs[i]['intermediates_folder'] = Path(kwargs['intermediates_folder']) / output_folder.name
+    tasks = [(SorterClass.sorter_name, rec, output_folders[i], params, task_kwargs[i],
+              setup_markers[i] if leaders[groups[i]] == i else None) for i, params in enumerate(param_sets)]
+    resources = [get_task_resources(SorterClass, recording, params, grouping_property=grouping_property)
+                 for params in param_sets]
+
+    if engine == 'process':
+        executor = _get_process_executor(n_jobs, 1)
+    else:
+        executor = ThreadPoolExecutor(max_workers=n_jobs)
+
+    outputs = [None] * len(tasks)
+    pending = list(range(len(tasks)))
+    running = {}
+    used = {}
+    with executor:
+        while len(pending) > 0 or len(running) > 0:
+            waiting_export = False
+            for i in list(pending):
+                if len(running) >= n_jobs:
+                    break
+                leader = leaders[groups[i]]
+                if leader != i and outputs[leader] is None and not setup_markers[leader].is_file():
+                    # waits for the export of its group (or for the failure of the first param set)
+                    waiting_export = True
+                    continue
+                if len(running) == 0 or _fits(resources[i], used, budget):
+                    pending.remove(i)
+                    running[i] = executor.submit(_run_sweep_task, tasks[i])
+                    _reserve(used, resources[i])
+            wait(list(running.values()), timeout=export_poll_s if waiting_export else None,
+                 return_when=FIRST_COMPLETED)
+            for i in [i for i, future in running.items() if future.done()]:
+                outputs[i] = running.pop(i).result()
+                _reserve(used, resources[i], sign=-1)
+
+    rows = []
+    for i, params in enumerate(param_sets):
+        outcome, arrays = outputs[i]
+        row = dict(params)
+        row['sorting'] = CompactArraysSortingExtractor(arrays) if arrays is not None else None
+        row.update(outcome)
+        row['num_units'] = len(arrays['unit_ids']) if arrays is not None else None
+        row['num_spikes'] = len(arrays['spike_times']) if arrays is not None else None
+        row['export_group'] = groups[i]
+        row['output_folder'] = output_folders[i]
+        if metric_func is not None and row['sorting'] is not None:
+            row.update(metric_func(row['sorting']))
+        rows.append(row)
+
+    table = [{k: v for k, v in row.items() if k != 'sorting'} for row in rows]
+    with open(str(sweep_folder / sweep_filename), 'w', encoding='utf8') as f:
+        json.dump(_check_json({'sorter_name': SorterClass.sorter_name, 'rows': table}), f, indent=4)
+    return rows
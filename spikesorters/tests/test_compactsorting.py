@@ -0,0 +1,84 @@
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import spikeextractors as se
+
+from spikesorters import MockSorter, CompactSortingExtractor
+from spikesorters.compactsorting import write_compact_sorting, compact_folder_name
+
+
+def test_compact_sorting():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    for unit_id in sorting_gt.get_unit_ids():
+        sorting_gt.set_unit_property(unit_id, 'quality', 'good')
+
+    folder = 'test_compact_sorting'
+    write_compact_sorting(sorting_gt, folder)
+    sorting = CompactSortingExtractor(folder)
+
+    assert sorting.get_unit_ids() == sorted(sorting_gt.get_unit_ids())
+    assert sorting.get_sampling_frequency() == sorting_gt.get_sampling_frequency()
+    for unit_id in sorting_gt.get_unit_ids():
+        st_gt = sorting_gt.get_unit_spike_train(unit_id)
+        assert np.array_equal(sorting.get_unit_spike_train(unit_id), np.sort(st_gt))
+        st = sorting.get_unit_spike_train(unit_id, start_frame=1000, end_frame=50000)
+        assert np.array_equal(st, np.sort(st_gt[(st_gt >= 1000) & (st_gt < 50000)]))
+        assert sorting.get_unit_property(unit_id, 'quality') == 'good'
+
+
+def test_compact_sorting_features():
+    _, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    rng = np.random.RandomState(0)
+    features = {}
+    for unit_id in sorting_gt.get_unit_ids():
+        n = len(sorting_gt.get_unit_spike_train(unit_id))
+        features[unit_id] = rng.randn(n, 3).astype('float32')
+        sorting_gt.set_unit_spike_features(unit_id, 'pc_features', features[unit_id])
+        sorting_gt.set_unit_spike_features(unit_id, 'amplitudes', features[unit_id][::2, 0],
+                                           indexes=np.arange(0, n, 2))
+        sorting_gt.set_unit_property(unit_id, 'template', np.ones((10, 4)) * unit_id)
+
+    folder = 'test_compact_sorting_features'
+    write_compact_sorting(sorting_gt, folder)
+    sorting = CompactSortingExtractor(folder)
+    for unit_id in sorting_gt.get_unit_ids():
+        assert np.array_equal(sorting.get_unit_spike_features(unit_id, 'pc_features'), features[unit_id])
+        assert np.array_equal(sorting.get_unit_spike_features(unit_id, 'amplitudes'), features[unit_id][::2, 0])
+        assert np.array_equal(sorting.get_unit_spike_features(unit_id, 'amplitudes_idxs'),
+                              np.arange(0, len(features[unit_id]), 2))
+        template = sorting.get_unit_property(unit_id, 'template')
+        assert isinstance(template, np.ndarray) and np.all(template == unit_id)
+    sorting.load_in_memory()
+    shutil.rmtree(folder)
+
+
+def test_compact_result_after_run():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    output_folder = Path('mocksorter_compact')
+    sorter = MockSorter(recording=recording, output_folder=output_folder)
+    sorter.set_params(seed=0)
+    sorter.run()
+    assert (output_folder / compact_folder_name).is_dir()
+
+    sorting = MockSorter.get_result_from_folder(output_folder)
+    assert isinstance(sorting, CompactSortingExtractor)
+    sorting_native = MockSorter._get_result_from_folder(output_folder)
+    for unit_id in sorting_native.get_unit_ids():
+        assert np.array_equal(sorting.get_unit_spike_train(unit_id), sorting_native.get_unit_spike_train(unit_id))
+
+    # a new log datetime invalidates the compact result
+    with (output_folder / 'spikeinterface_log.json').open('r') as f:
+        log = json.load(f)
+    log['datetime'] = '2000-01-01T00:00:00'
+    with (output_folder / 'spikeinterface_log.json').open('w') as f:
+        json.dump(log, f)
+    sorting = MockSorter.get_result_from_folder(output_folder)
+    assert not isinstance(sorting, CompactSortingExtractor)
+
+
+if __name__ == '__main__':
+    test_compact_sorting()
+    test_compact_sorting_features()
+    test_compact_result_after_run()
@@ -0,0 +1,75 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import spikeextractors as se
+
+from spikesorters import run_sorter, read_session_sortings
+from spikesorters.concatenation import concatenate_recordings, get_raw_files, copy_raw_files, sessions_filename
+
+
+def _make_sessions(folder):
+    folder.mkdir(parents=True)
+    recordings = []
+    for i, duration in enumerate([2, 3]):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=duration, seed=i)
+        traces = rec.get_traces().T.astype('float32')
+        traces.tofile(str(folder / 'session{}.raw'.format(i)))
+        recordings.append(se.BinDatRecordingExtractor(folder / 'session{}.raw'.format(i),
+                                                      sampling_frequency=rec.get_sampling_frequency(),
+                                                      numchan=4, dtype='float32', time_axis=0))
+    return recordings
+
+
+def test_concatenate_recordings():
+    folder = Path('test_concatenate_recordings')
+    if folder.is_dir():
+        shutil.rmtree(str(folder))
+    recordings = _make_sessions(folder)
+    recording, frame_offsets = concatenate_recordings(recordings)
+    assert frame_offsets == [0, recordings[0].get_num_frames()]
+    raw = get_raw_files(recording)
+    assert [f.name for f in raw['files']] == ['session0.raw', 'session1.raw']
+    assert raw['dtype'] == np.dtype('float32')
+    assert not copy_raw_files(recording, folder / 'copy.dat', dtype='int16')
+    assert copy_raw_files(recording, folder / 'copy.dat', dtype='float32')
+    copied = np.fromfile(str(folder / 'copy.dat'), dtype='float32').reshape(-1, 4)
+    assert np.array_equal(copied, recording.get_traces().T)
+    # not the same dtype: the files can not be read as one
+    recordings[1]._dtype = 'int16'
+    assert get_raw_files(se.MultiRecordingTimeExtractor(recordings)) is None
+    shutil.rmtree(str(folder))
+
+
+def test_run_sorter_sessions():
+    folder = Path('test_run_sorter_sessions')
+    if folder.is_dir():
+        shutil.rmtree(str(folder))
+    recordings = _make_sessions(folder / 'raw')
+    output_folder = folder / 'mocksorter'
+    sortings = run_sorter('mocksorter', recordings=recordings, output_folder=output_folder, num_spikes=300,
+                          export=True)
+    assert len(sortings) == 2
+    num_spikes = 0
+    for sorting, recording in zip(sortings, recordings):
+        for unit_id in sorting.get_unit_ids():
+            spike_train = sorting.get_unit_spike_train(unit_id)
+            assert np.all(spike_train >= 0) and np.all(spike_train < recording.get_num_frames())
+            num_spikes += spike_train.size
+    assert num_spikes == 300
+
+    # the raw bytes of the sessions are copied in the export
+    exported = np.fromfile(str(output_folder / 'recording.dat'), dtype='float32')
+    sessions = [np.fromfile(str(folder / 'raw' / 'session{}.raw'.format(i)), dtype='float32') for i in range(2)]
+    assert np.array_equal(exported, np.concatenate(sessions))
+
+    assert (output_folder / sessions_filename).is_file()
+    sortings2 = read_session_sortings('mocksorter', output_folder)
+    assert np.array_equal(sortings2[1].get_unit_spike_train(sortings2[1].get_unit_ids()[0]),
+                          sortings[1].get_unit_spike_train(sortings[1].get_unit_ids()[0]))
+    shutil.rmtree(str(folder))
+
+
+if __name__ == '__main__':
+    test_concatenate_recordings()
+    test_run_sorter_sessions()
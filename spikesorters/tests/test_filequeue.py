@@ -0,0 +1,73 @@
+import os
+import shutil
+import time
+
+import spikeextractors as se
+
+from spikesorters import run_sorters
+from spikesorters.filequeue import FileQueue
+
+
+def test_requeue_stale():
+    queue_folder = 'test_filequeue'
+    if os.path.exists(queue_folder):
+        shutil.rmtree(queue_folder)
+    queue = FileQueue(queue_folder)
+    task_id = queue.put({'rec_name': 'rec', 'sorter_name': 'mocksorter'})
+    assert queue.get_num_pending() == 1
+
+    task, claimed_path = queue.claim('node0-1')
+    assert task['task_id'] == task_id
+    assert queue.claim('node1-1') == (None, None)
+
+    # alive: the heartbeat is recent
+    assert queue.requeue_stale(stale_s=60.) == []
+
+    # dead: no heartbeat for a long time
+    old = time.time() - 3600
+    os.utime(str(claimed_path), (old, old))
+    assert queue.requeue_stale(stale_s=60.) == [task_id]
+    task, claimed_path = queue.claim('node1-1')
+    assert task['num_requeues'] == 1
+
+    # a task that kills all its workers ends as failed
+    os.utime(str(claimed_path), (old, old))
+    assert queue.requeue_stale(stale_s=60., max_requeues=1) == []
+    assert queue.get_num_pending() == 0
+    outcome = queue.get_outcome(task_id)
+    assert outcome['status'] == 'failed'
+    assert outcome['worker_id'] == 'node1-1'
+    shutil.rmtree(queue_folder)
+
+
+def test_run_sorters_filequeue():
+    recording_dict = {}
+    for i in range(6):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i, dumpable=True,
+                                                 dump_folder='test_run_sorters_filequeue_rec{}'.format(i))
+        recording_dict['rec_{}'.format(i)] = rec
+
+    working_folder = 'test_run_sorters_filequeue'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    sorter_params = {'mocksorter': {'sleep_s': 1.}}
+    results = run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params,
+                          engine='filequeue', engine_kwargs={'workers': 3})
+    assert len(results) == 6
+
+    queue = FileQueue(os.path.join(working_folder, 'spikeinterface_queue'))
+    outcomes = [queue.get_outcome(name[:-5]) for name in os.listdir(str(queue.done_folder))]
+    assert len(outcomes) == 6
+    assert all(outcome['status'] == 'done' for outcome in outcomes)
+    # the tasks are shared by the workers
+    assert len(set(outcome['worker_id'] for outcome in outcomes)) > 1
+
+    shutil.rmtree(working_folder)
+    for i in range(6):
+        shutil.rmtree('test_run_sorters_filequeue_rec{}'.format(i), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_requeue_stale()
+    test_run_sorters_filequeue()
@@ -5,7 +5,9 @@ import time
 import pytest
 import spikeextractors as se
 
-from spikesorters import run_sorters, collect_sorting_outputs
+from spikesorters import run_sorters, submit_sorters, collect_sorting_outputs, LazySortingOutputs
+from spikesorters.compactsorting import compact_folder_name
+from spikesorters.launcher import _get_preferred_workers, SortingTask
 
 
 def test_run_sorters_with_list():
@@ -100,24 +102,215 @@ def test_run_sorters_dask():
     t0 = time.perf_counter()
     results = run_sorters(sorter_list, recording_dict, working_folder, engine='dask',
                           engine_kwargs={'client': client}, with_output=True)
-    # dask do not return results always None
-    assert results is None
+    assert len(results) == 8
     t1 = time.perf_counter()
     print(t1 - t0)
 
 
+def test_run_sorters_dask_local():
+    pytest.importorskip('distributed')
+    from dask.distributed import Client, LocalCluster
+
+    recording_dict = {}
+    for i in range(4):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i, dumpable=True,
+                                                 dump_folder='test_run_sorters_dask_local_rec{}'.format(i))
+        recording_dict['rec_{}'.format(i)] = rec
+
+    working_folder = 'test_run_sorters_dask_local'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    # the workers declare cores: each task takes one
+    with LocalCluster(n_workers=2, threads_per_worker=2, processes=False, resources={'cores': 1},
+                      dashboard_address=None) as cluster, Client(cluster) as client:
+        sorter_params = {'mocksorter': {'num_units': 5, 'num_spikes': 100}}
+        results = run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params,
+                              engine='dask', engine_kwargs={'client': client})
+    assert len(results) == 4
+    for (rec_name, sorter_name), sorting in results.items():
+        assert len(sorting.get_unit_ids()) == 5
+        num_spikes = sum(len(sorting.get_unit_spike_train(u)) for u in sorting.get_unit_ids())
+        assert num_spikes == 100
+
+    # locality: the worker that holds the files of a recording is preferred
+    rec_dict = recording_dict['rec_0'].dump_to_dict()
+    path = rec_dict['kwargs']['folder_path']
+    task = SortingTask(**dict.fromkeys(SortingTask._fields))._replace(recording=rec_dict)
+    assert _get_preferred_workers([task], {'w0': {path}, 'w1': set()}) == [['w0']]
+    assert _get_preferred_workers([task], {'w0': {path}, 'w1': {path}}) == [None]
+
+    shutil.rmtree(working_folder)
+    for i in range(4):
+        shutil.rmtree('test_run_sorters_dask_local_rec{}'.format(i), ignore_errors=True)
+
+
+def test_run_sorters_process():
+    # the tasks use a joblib multiprocessing pool: this fails with daemonic workers (engine='multiprocessing')
+    recording_dict = {}
+    for i in range(2):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=4, seed=i, dumpable=True,
+                                                 dump_folder='test_run_sorters_process_rec{}'.format(i))
+        recording_dict['rec_{}'.format(i)] = rec
+
+    working_folder = 'test_run_sorters_process'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    run_sorter_kwargs = {'parallel': True, 'n_jobs': 2, 'joblib_backend': 'multiprocessing'}
+    results = run_sorters(['mocksorter'], recording_dict, working_folder, engine='process',
+                          engine_kwargs={'processes': 2, 'max_tasks_per_child': 1}, run_sorter_kwargs=run_sorter_kwargs,
+                          split_by_time=(1., 0.2))
+    assert len(results) == 2
+    for rec_name in recording_dict:
+        assert os.path.isdir(os.path.join(working_folder, rec_name, 'mocksorter', 'segment3'))
+    shutil.rmtree(working_folder)
+    for i in range(2):
+        shutil.rmtree('test_run_sorters_process_rec{}'.format(i), ignore_errors=True)
+
+
+def test_run_sorters_asyncio():
+    recording_dict = {}
+    for i in range(6):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i)
+        recording_dict['rec_{}'.format(i)] = rec
+
+    working_folder = 'test_run_sorters_asyncio'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    # the mocksorter sleeps in a shell script: at most 3 scripts at a time
+    sorter_params = {'mocksorter': {'sleep_s': 1., 'log_lines': 5, 'external': True}}
+    t0 = time.perf_counter()
+    results = run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params,
+                          engine='asyncio', engine_kwargs={'max_concurrent': {'mocksorter': 3}})
+    makespan = time.perf_counter() - t0
+    assert len(results) == 6
+    assert 2. <= makespan < 5.
+    with open(os.path.join(working_folder, 'rec_0', 'mocksorter', 'mocksorter.log'), 'r') as f:
+        lines = f.read().splitlines()
+    assert lines[-1] == 'slept 1.0 s'
+    assert len(lines) == 6
+    shutil.rmtree(working_folder)
+
+
+def test_run_sorters_asyncio_in_process():
+    rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    working_folder = 'test_run_sorters_asyncio_in_process'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    # external=False: the mocksorter runs in a thread, with its in-process params
+    sorter_params = {'mocksorter': {'intermediate_mb': 1, 'num_spikes': 50}}
+    results = run_sorters(['mocksorter'], {'rec_0': rec}, working_folder, sorter_params=sorter_params,
+                          engine='asyncio')
+    assert len(results) == 1
+    output_folder = os.path.join(working_folder, 'rec_0', 'mocksorter')
+    assert os.path.isfile(os.path.join(output_folder, 'intermediate.dat'))
+    assert not os.path.exists(os.path.join(output_folder, 'run_mocksorter.sh'))
+    shutil.rmtree(working_folder)
+
+
+def test_submit_sorters():
+    recording_dict = {}
+    for i in range(4):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i)
+        recording_dict['rec_{}'.format(i)] = rec
+
+    working_folder = 'test_submit_sorters'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    sorter_params = {'mocksorter': {'sleep_s': 0.2}}
+    jobs = submit_sorters(['mocksorter'], {k: v for k, v in recording_dict.items() if k != 'rec_3'}, working_folder,
+                          sorter_params=sorter_params, engine='thread', engine_kwargs={'threads': 2})
+    assert len(jobs.futures) == 3
+    outputs = list(jobs.as_completed())
+    assert len(outputs) == 3
+    for rec_name, sorter_name, sorting, metrics in outputs:
+        assert metrics['status'] == 'done'
+        assert metrics['run_time'] >= 0.2
+        assert len(sorting.get_unit_ids()) == 10
+    assert jobs.done()
+
+    # keep mode: done tasks are given first, failures are reported as errors
+    sorter_params = {'mocksorter': {'failure_rate': 1.}}
+    jobs = submit_sorters(['mocksorter'], recording_dict, working_folder, mode='keep', sorter_params=sorter_params,
+                          engine='thread', run_sorter_kwargs={'raise_error': False})
+    outputs = list(jobs.as_completed())
+    assert [o[0] for o in outputs[:3]] == ['rec_0', 'rec_1', 'rec_2']
+    rec_name, sorter_name, error, metrics = outputs[3]
+    assert rec_name == 'rec_3' and metrics['status'] == 'failed'
+    assert isinstance(error, Exception)
+    assert len(jobs.results()) == 3
+
+    # cancel the tasks not started
+    shutil.rmtree(working_folder)
+    sorter_params = {'mocksorter': {'sleep_s': 0.5}}
+    jobs = submit_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params,
+                          engine='thread', engine_kwargs={'threads': 1})
+    assert jobs.cancel() == 3
+    statuses = [metrics['status'] for _, _, _, metrics in jobs.as_completed()]
+    assert statuses.count('cancelled') == 3 and statuses.count('done') == 1
+    shutil.rmtree(working_folder)
+
+
 def test_collect_sorting_outputs():
     working_folder = 'test_run_sorters_dict'
     results = collect_sorting_outputs(working_folder)
     print(results)
 
 
+def test_collect_sorting_outputs_parallel_and_lazy():
+    recording_dict = {}
+    for i in range(6):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+        recording_dict['rec_' + str(i)] = rec
+    working_folder = 'test_collect_outputs'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+    sorter_params = {'mocksorter': dict(num_units=5, num_spikes=200, seed=0)}
+    results = run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params)
+    assert len(results) == 6
+
+    # remove the compact copies: native outputs are parsed again
+    for rec_name in recording_dict:
+        shutil.rmtree(os.path.join(working_folder, rec_name, 'mocksorter', compact_folder_name))
+
+    for engine in ('thread', 'process'):
+        results2 = collect_sorting_outputs(working_folder, n_jobs=3, engine=engine)
+        assert set(results2.keys()) == set(results.keys())
+        for key, sorting in results.items():
+            assert sorting.get_unit_ids() == results2[key].get_unit_ids()
+    # the process engine has written the compact copies
+    for rec_name in recording_dict:
+        assert os.path.isdir(os.path.join(working_folder, rec_name, 'mocksorter', compact_folder_name))
+
+    lazy_results = collect_sorting_outputs(working_folder, lazy=True, max_cached=2)
+    assert isinstance(lazy_results, LazySortingOutputs)
+    assert len(lazy_results) == 6
+    assert ('rec_0', 'mocksorter') in lazy_results
+    for key in lazy_results:
+        assert lazy_results[key].get_unit_ids() == results[key].get_unit_ids()
+    assert sum(lazy_results.is_loaded(key) for key in lazy_results) == 2
+    keys = list(lazy_results.keys())
+    assert lazy_results.is_loaded(keys[-1])
+    assert not lazy_results.is_loaded(keys[0])
+
+
 if __name__ == '__main__':
     test_run_sorters_with_list()
 
     test_run_sorters_with_dict()
 
     # test_run_sorters_multiprocessing()
+
+    test_run_sorters_process()
+
+    test_run_sorters_asyncio()
+    test_run_sorters_asyncio_in_process()
+
+    test_submit_sorters()
     
     # test_run_sorters_dask()
 
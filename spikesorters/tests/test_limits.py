@@ -0,0 +1,92 @@
+import time
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+import spikeextractors as se
+
+from spikesorters import run_sorter, run_sorters, SorterTimeoutError, SorterMemoryError
+from spikesorters.manifest import Manifest
+from spikesorters.utils.shellscript import ShellScript, HAVE_PSUTIL
+
+
+def _read_log(folder):
+    with open(str(Path(folder) / 'spikeinterface_log.json'), 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def test_shellscript_timeout():
+    shell_script = ShellScript('''
+        #!/bin/bash
+        sleep 30
+    ''')
+    t0 = time.perf_counter()
+    shell_script.start(timeout_s=0.5)
+    retcode = shell_script.wait()
+    assert time.perf_counter() - t0 < 10.
+    assert retcode != 0
+    assert shell_script.stopReason() == 'timeout'
+
+
+@pytest.mark.skipif(not HAVE_PSUTIL, reason='the resident memory is monitored with psutil')
+def test_run_sorter_memory():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    output_folder = Path('test_run_sorter_memory')
+    with pytest.raises(SorterMemoryError):
+        run_sorter('mocksorter', recording, output_folder=output_folder, external=True, memory_mb=300, sleep_s=30,
+                   max_memory_mb=100)
+    log = _read_log(output_folder)
+    assert log['outcome'] == 'memory'
+    assert log['limits']['max_memory_mb'] == 100
+    shutil.rmtree(str(output_folder))
+
+
+def test_run_sorter_timeout_retries():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    output_folder = Path('test_run_sorter_timeout_retries')
+    with pytest.raises(SorterTimeoutError):
+        run_sorter('mocksorter', recording, output_folder=output_folder, external=True, sleep_s=30, timeout_s=0.5,
+                   max_retries=1, retry_backoff_s=0.1)
+    # the log is written before raising
+    log = _read_log(output_folder)
+    assert log['status'] == 'failed'
+    assert log['outcome'] == 'timeout'
+    assert log['num_attempts'] == 2
+    assert [attempt['outcome'] for attempt in log['failed_attempts']] == ['timeout']
+    shutil.rmtree(str(output_folder))
+
+
+@pytest.mark.parametrize('engine', ['loop', 'asyncio'])
+def test_run_sorters_task_policy(engine):
+    recording_dict = {}
+    for i in range(2):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i)
+        recording_dict['rec_{}'.format(i)] = rec
+    working_folder = Path('test_run_sorters_task_policy')
+    if working_folder.is_dir():
+        shutil.rmtree(str(working_folder))
+
+    task_policy = {'mocksorter': {'timeout_s': 1.}}
+    run_sorters(['mocksorter'], {'rec_0': recording_dict['rec_0']}, working_folder, engine=engine,
+                sorter_params={'mocksorter': {'external': True}}, task_policy=task_policy)
+    # rec_1 hangs
+    run_sorters(['mocksorter'], recording_dict, working_folder, engine=engine,
+                sorter_params={'mocksorter': {'external': True, 'sleep_s': 30.}}, task_policy=task_policy,
+                mode='keep', run_sorter_kwargs={'raise_error': False})
+
+    manifest = Manifest(working_folder)
+    entry = manifest.get('rec_0', 'mocksorter')
+    assert entry['outcome'] == 'done'
+    assert entry['num_attempts'] == 1
+    entry = manifest.get('rec_1', 'mocksorter')
+    assert entry['status'] == 'failed'
+    assert entry['outcome'] == 'timeout'
+    shutil.rmtree(str(working_folder))
+
+
+if __name__ == '__main__':
+    test_shellscript_timeout()
+    test_run_sorter_memory()
+    test_run_sorter_timeout_retries()
+    test_run_sorters_task_policy('loop')
@@ -0,0 +1,132 @@
+import os
+import shutil
+import warnings
+
+import spikeextractors as se
+
+from spikesorters import run_sorters, iter_output_folders, rebuild_manifest
+from spikesorters.launcher import is_log_ok, _prepare_tasks
+from spikesorters.manifest import Manifest, manifest_filename, append_to_manifest, append_pending_to_manifest
+
+
+def _make_recording_dict(n):
+    recording_dict = {}
+    for i in range(n):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+        recording_dict['rec_' + str(i)] = rec
+    return recording_dict
+
+
+def test_manifest():
+    recording_dict = _make_recording_dict(3)
+    working_folder = 'test_manifest'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    sorter_params = {'mocksorter': dict(num_spikes=100, seed=0)}
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params, with_output=False)
+    manifest = Manifest(working_folder)
+    assert manifest.exists()
+    for rec_name in recording_dict:
+        entry = manifest.get(rec_name, 'mocksorter')
+        assert entry['status'] == 'done'
+        assert entry['run_time'] is not None
+        assert manifest.is_ok(rec_name, 'mocksorter')
+        assert is_log_ok(manifest.working_folder / rec_name / 'mocksorter', manifest=manifest)
+    assert len(list(iter_output_folders(working_folder))) == 3
+
+    # a failed task is recorded and recomputed with mode='keep'
+    recording_dict['rec_fail'] = recording_dict['rec_0']
+    sorter_params = {'mocksorter': dict(num_spikes=100, seed=0, failure_rate=1.)}
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params, mode='keep',
+                with_output=False, run_sorter_kwargs={'raise_error': False})
+    manifest.update()
+    assert manifest.get('rec_fail', 'mocksorter')['status'] == 'failed'
+    # already done tasks were kept
+    assert manifest.get('rec_0', 'mocksorter')['params_hash'] != manifest.get('rec_fail', 'mocksorter')['params_hash']
+    assert len(list(iter_output_folders(working_folder))) == 3
+
+    # rebuild from the logs gives the same answers
+    os.remove(os.path.join(working_folder, manifest_filename))
+    assert len(list(iter_output_folders(working_folder))) == 3
+    rebuilt = rebuild_manifest(working_folder)
+    for rec_name in recording_dict:
+        assert rebuilt.get(rec_name, 'mocksorter')['status'] == manifest.get(rec_name, 'mocksorter')['status']
+        assert rebuilt.get(rec_name, 'mocksorter')['params_hash'] == manifest.get(rec_name, 'mocksorter')['params_hash']
+
+    # a folder removed by hand is not listed
+    shutil.rmtree(os.path.join(working_folder, 'rec_2'))
+    assert sorted(rec_name for rec_name, _, _ in iter_output_folders(working_folder)) == ['rec_0', 'rec_1']
+
+
+def test_manifest_overwrite_killed():
+    recording_dict = _make_recording_dict(2)
+    working_folder = 'test_manifest_overwrite'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+    sorter_params = {'mocksorter': dict(num_spikes=100, seed=0)}
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params, with_output=False)
+
+    # mode='overwrite' removes the folders, then the run is killed before the tasks finish
+    task_list, _, task_names, _, _ = _prepare_tasks(['mocksorter'], recording_dict, working_folder,
+                                                    sorter_params=sorter_params, mode='overwrite')
+    assert len(task_list) == 2
+    manifest = Manifest(working_folder)
+    for rec_name in recording_dict:
+        assert manifest.get(rec_name, 'mocksorter')['status'] == 'pending'
+        assert not is_log_ok(manifest.working_folder / rec_name / 'mocksorter', manifest=manifest)
+    assert len(list(iter_output_folders(working_folder))) == 0
+
+    # mode='keep' runs them again
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params, mode='keep',
+                with_output=False)
+    manifest.update()
+    for rec_name in recording_dict:
+        assert manifest.is_ok(rec_name, 'mocksorter')
+    assert len(list(iter_output_folders(working_folder))) == 2
+
+
+def test_manifest_torn_line():
+    working_folder = 'test_manifest_torn_line'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+    manifest = Manifest(working_folder)
+    manifest.append({'rec_name': 'rec_0', 'sorter_name': 'mocksorter', 'status': 'done'})
+    # two writers of different nodes overwrote each other
+    with open(os.path.join(working_folder, manifest_filename), 'ab') as f:
+        f.write(b'{"rec_name": "rec_1", "sorte\x00\x00\n')
+    manifest.append({'rec_name': 'rec_2', 'sorter_name': 'mocksorter', 'status': 'done'})
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        manifest.update()
+    assert len(caught) == 1
+    assert manifest.is_ok('rec_0', 'mocksorter')
+    assert manifest.is_ok('rec_2', 'mocksorter')
+    assert manifest.get('rec_1', 'mocksorter') is None
+    shutil.rmtree(working_folder)
+
+
+def test_manifest_append_does_not_read():
+    working_folder = 'test_manifest_append'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+    append_pending_to_manifest(os.path.join(working_folder, 'rec_0', 'mocksorter'))
+
+    def update(self):
+        raise AssertionError('the manifest is parsed by an append')
+    original_update = Manifest.update
+    Manifest.update = update
+    try:
+        append_to_manifest(os.path.join(working_folder, 'rec_0', 'mocksorter'), 1., '0.1', {})
+    finally:
+        Manifest.update = original_update
+    assert Manifest(working_folder).is_ok('rec_0', 'mocksorter')
+    shutil.rmtree(working_folder)
+
+
+if __name__ == '__main__':
+    test_manifest()
+    test_manifest_overwrite_killed()
+    test_manifest_torn_line()
+    test_manifest_append_does_not_read()
@@ -0,0 +1,200 @@
+import unittest
+import os
+import shutil
+import json
+import pytest
+import spikeextractors as se
+from spikesorters import MockSorter, run_mocksorter, flush_folder_removals
+from spikesorters.tests.common_tests import SorterCommonTestSuite
+from spikesorters.sorter_tools import SpikeSortingError, iter_runtime_trace
+
+
+# This run several tests
+class MockSorterCommonTestSuite(SorterCommonTestSuite, unittest.TestCase):
+    SorterClass = MockSorter
+
+
+def test_mocksorter_output():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+
+    sorting = run_mocksorter(recording, output_folder='mocksorter_output', num_units=5, num_spikes=200, seed=0)
+    assert len(sorting.get_unit_ids()) == 5
+    assert sum(len(sorting.get_unit_spike_train(u)) for u in sorting.get_unit_ids()) == 200
+
+    with pytest.raises(SpikeSortingError):
+        run_mocksorter(recording, output_folder='mocksorter_output', failure_rate=1.)
+
+
+def test_mocksorter_log():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    output_folder = 'mocksorter_log'
+    sorter = MockSorter(recording=recording, output_folder=output_folder)
+    sorter.set_params(log_lines=10000, sleep_s=0.1)
+    sorter.run()
+
+    with open(output_folder + '/spikeinterface_log.json', 'r', encoding='utf8') as f:
+        log = json.load(f)
+    # the trace is not copied in the log
+    assert 'runtime_trace' not in log
+    assert log['status'] == 'done'
+    assert log['runtime_trace_path'] == 'mocksorter.log'
+    assert len(log['runtime_trace_tail']) == MockSorter.runtime_trace_tail_lines
+    assert log['runtime_trace_tail'][-1] == 'slept 0.1 s'
+    trace = list(iter_runtime_trace(output_folder))
+    assert len(trace) == 10001
+    assert trace[0] == 'mocksorter log line 0'
+
+    sorter = MockSorter(recording=recording, output_folder=output_folder)
+    sorter.set_params(failure_rate=1.)
+    sorter.run(raise_error=False)
+    with open(output_folder + '/spikeinterface_log.json', 'r', encoding='utf8') as f:
+        log = json.load(f)
+    assert log['status'] == 'failed'
+    assert log['run_time'] is None
+    assert 'simulated failure' in log['error_message']
+
+
+def test_mocksorter_log_rerun():
+    from spikesorters.basesorter import run_done_filename
+
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    output_folder = 'mocksorter_log_rerun'
+    sorter = MockSorter(recording=recording, output_folder=output_folder)
+    sorter.set_params(log_lines=100)
+    sorter.run()
+
+    # the run is done again in the kept folder: the sorter log is rewritten, not appended
+    os.remove(os.path.join(output_folder, run_done_filename))
+    sorter = MockSorter(recording=recording, output_folder=output_folder, resume=True)
+    sorter.set_params(log_lines=100)
+    sorter.run()
+    with open(output_folder + '/spikeinterface_log.json', 'r', encoding='utf8') as f:
+        log = json.load(f)
+    assert log['resumed_setups'] == [0]
+    assert log['runtime_trace_offsets'] == [0, os.path.getsize(os.path.join(output_folder, 'mocksorter.log'))]
+    trace = list(iter_runtime_trace(output_folder))
+    assert len(trace) == 101
+    assert trace[0] == 'mocksorter log line 0'
+
+
+def test_dump_params():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    sorter = MockSorter(recording=recording, output_folder='mocksorter_params', grouping_property='group')
+    recording_list = sorter.recording_list
+
+    num_calls = [0]
+    for rec in recording_list:
+        make_serialized_dict = rec.make_serialized_dict
+
+        def counted(make_serialized_dict=make_serialized_dict):
+            num_calls[0] += 1
+            return make_serialized_dict()
+        rec.make_serialized_dict = counted
+
+    sorter.set_params(seed=0)
+    mtimes = [os.stat(str(f / 'spikeinterface_params.json')).st_mtime_ns for f in sorter.output_folders]
+    # same params: nothing is written
+    sorter.set_params(seed=0)
+    assert mtimes == [os.stat(str(f / 'spikeinterface_params.json')).st_mtime_ns for f in sorter.output_folders]
+    sorter.set_params(seed=1)
+    sorter.run()
+    # the recordings are serialized once
+    assert num_calls[0] == len(recording_list)
+    for output_folder in sorter.output_folders:
+        with open(str(output_folder / 'spikeinterface_params.json'), 'r', encoding='utf8') as f:
+            params = json.load(f)
+        assert params['sorter_params']['seed'] == 1
+        assert 'recording' in params
+
+
+def test_export_folder():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    output_folder = 'mocksorter_export_folder'
+    sorter = MockSorter(recording=recording, output_folder=output_folder, export_folder=output_folder + '_exports')
+    sorter.set_params(export=True, num_spikes=50)
+    # the traces are read for the name of the export: the serialized recording is not changed by it
+    assert sorter.run() is not None
+    exports = [name for name in os.listdir(output_folder + '_exports') if not name.startswith('.')]
+    assert len(exports) == 1
+    with open(output_folder + '/spikeinterface_log.json', 'r', encoding='utf8') as f:
+        assert json.load(f)['status'] == 'done'
+    flush_folder_removals()
+    shutil.rmtree(output_folder + '_exports')
+
+
+def test_keep_intermediates():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    size = 2 * 1024 ** 2
+
+    for policy in ('keep', 'delete', 'compress', 'move'):
+        output_folder = 'mocksorter_intermediates_' + policy
+        sorter = MockSorter(recording=recording, output_folder=output_folder, keep_intermediates=policy,
+                            intermediates_folder='mocksorter_cold')
+        sorter.set_params(intermediate_mb=2, seed=0)
+        sorter.run()
+        with open(output_folder + '/spikeinterface_log.json', 'r', encoding='utf8') as f:
+            log = json.load(f)
+        intermediate_file = sorter.output_folders[0] / 'intermediate.dat'
+        if policy == 'keep':
+            assert 'intermediates' not in log
+            assert intermediate_file.stat().st_size == size
+        else:
+            assert log['intermediates']['files'] == ['intermediate.dat']
+            assert not intermediate_file.exists()
+            if policy == 'compress':
+                assert (sorter.output_folders[0] / 'intermediate.dat.gz').is_file()
+                assert 0 < log['intermediates']['freed_bytes'] < size
+            else:
+                assert log['intermediates']['freed_bytes'] == size
+            if policy == 'move':
+                # the layout of the output folder, not its absolute path, is mirrored
+                destination = os.path.abspath('mocksorter_cold')
+                assert log['intermediates']['destination'] == destination
+                assert os.path.getsize(os.path.join(destination, 'intermediate.dat')) == size
+        # the result is still readable
+        assert len(sorter.get_result().get_unit_ids()) == 10
+
+    # a failed run keeps everything
+    sorter = MockSorter(recording=recording, output_folder='mocksorter_intermediates_fail',
+                        keep_intermediates='delete')
+    sorter.set_params(intermediate_mb=1, failure_rate=1.)
+    sorter.run(raise_error=False)
+    assert (sorter.output_folders[0] / 'intermediate.dat').is_file()
+
+
+def test_scratch_folder():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    scratch_folder = os.path.abspath('mocksorter_scratch')
+    os.makedirs(scratch_folder, exist_ok=True)
+
+    sorting = run_mocksorter(recording, output_folder='mocksorter_scratch_output', scratch_folder=scratch_folder,
+                             grouping_property='group', intermediate_mb=1, seed=0)
+    assert len(sorting.get_unit_ids()) > 0
+    for group_folder in os.listdir('mocksorter_scratch_output'):
+        files = os.listdir(os.path.join('mocksorter_scratch_output', group_folder))
+        assert 'firings.mda' in files and 'spikeinterface_log.json' in files
+        # intermediate files stay on scratch and are deleted by default
+        assert 'intermediate.dat' not in files
+
+    # scratch is cleaned also on failure and the sorter log is copied back
+    with pytest.raises(SpikeSortingError):
+        run_mocksorter(recording, output_folder='mocksorter_scratch_output', scratch_folder=scratch_folder,
+                       intermediate_mb=1, failure_rate=1.)
+    files = os.listdir('mocksorter_scratch_output')
+    assert 'mocksorter.log' in files
+    assert 'intermediate.dat' not in files
+    assert flush_folder_removals(timeout=60)
+    assert os.listdir(scratch_folder) == []
+
+
+if __name__ == '__main__':
+    MockSorterCommonTestSuite().test_on_toy()
+    MockSorterCommonTestSuite().test_several_groups()
+    MockSorterCommonTestSuite().test_with_BinDatRecordingExtractor()
+    test_mocksorter_output()
+    test_mocksorter_log()
+    test_mocksorter_log_rerun()
+    test_dump_params()
+    test_export_folder()
+    test_keep_intermediates()
+    test_scratch_folder()
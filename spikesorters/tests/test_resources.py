@@ -0,0 +1,95 @@
+import os
+import shutil
+
+import pytest
+import spikeextractors as se
+
+from spikesorters import run_sorter, run_sorters, InsufficientResourcesError, MockSorter
+from spikesorters.sorterlist import sorter_full_list
+from spikesorters.resources import (estimate_task_resources, get_recording_bytes, get_task_resources,
+                                    fit_task_resources, make_estimate)
+
+
+def test_estimate_resources():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    for SorterClass in sorter_full_list:
+        estimate = SorterClass.estimate_resources(recording, SorterClass.default_params())
+        assert set(estimate.keys()) == {'disk_bytes', 'scratch_bytes', 'peak_ram_bytes'}
+        assert 0 <= estimate['scratch_bytes'] <= estimate['disk_bytes']
+        assert estimate['peak_ram_bytes'] >= 0
+
+    # groups are summed
+    recording.set_channel_groups([0, 0, 1, 1])
+    for SorterClass in sorter_full_list:
+        if SorterClass.sorter_name == 'combinato':
+            # one channel is exported per group
+            continue
+        one = estimate_task_resources(SorterClass, recording)
+        groups = estimate_task_resources(SorterClass, recording, grouping_property='group')
+        assert abs(one['disk_bytes'] - groups['disk_bytes']) <= 2 * 1024 ** 2
+
+    assert get_recording_bytes(recording, dtype='int16') == 4 * recording.get_num_frames() * 2
+
+
+def test_preflight():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    huge_mb = 10 ** 12
+
+    with pytest.raises(InsufficientResourcesError):
+        run_sorter('mocksorter', recording, output_folder='mocksorter_preflight', intermediate_mb=huge_mb,
+                   preflight='raise')
+    with pytest.raises(InsufficientResourcesError):
+        run_sorter('mocksorter', recording, output_folder='mocksorter_preflight', memory_mb=huge_mb,
+                   preflight='raise')
+    sorting = run_sorter('mocksorter', recording, output_folder='mocksorter_preflight', preflight='raise')
+    assert len(sorting.get_unit_ids()) > 0
+
+    # run_sorters fails before running anything
+    working_folder = 'test_preflight'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+    recording_dict = {'small': recording, 'huge': recording}
+    with pytest.raises(InsufficientResourcesError):
+        run_sorters(['mocksorter', 'tridesclous'], recording_dict, working_folder,
+                    sorter_params={'mocksorter': {'intermediate_mb': huge_mb}}, preflight='raise')
+    assert not os.path.exists(os.path.join(working_folder, 'small', 'tridesclous'))
+
+
+def test_no_preflight_by_default(monkeypatch):
+    # the estimates are rough: a task is not refused unless asked
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    huge_estimate = make_estimate(disk_bytes=1e18, scratch_bytes=0, peak_ram_bytes=1e18)
+    monkeypatch.setattr(MockSorter, 'estimate_resources', classmethod(lambda cls, recording, params: huge_estimate))
+    sorting = run_sorter('mocksorter', recording, output_folder='mocksorter_no_preflight')
+    assert len(sorting.get_unit_ids()) > 0
+    working_folder = 'test_no_preflight'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+    results = run_sorters(['mocksorter'], {'rec': recording}, working_folder)
+    assert len(results) == 1
+    with pytest.raises(InsufficientResourcesError):
+        run_sorter('mocksorter', recording, output_folder='mocksorter_no_preflight', preflight='raise')
+    shutil.rmtree(working_folder)
+    shutil.rmtree('mocksorter_no_preflight')
+
+
+def test_task_resources():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    for SorterClass in sorter_full_list:
+        resources = get_task_resources(SorterClass, recording)
+        assert resources['cores'] >= 1
+        assert ('matlab' in resources) == SorterClass.uses_matlab
+
+    task_resources = {'cores': 8, 'memory': 4e9, 'matlab': 1}
+    workers = [{'cores': 4, 'memory': 16e9}, {'cores': 2, 'memory': 8e9}]
+    # nobody declares matlab: not asked, cores limited to the largest worker
+    assert fit_task_resources(task_resources, workers) == {'cores': 4, 'memory': 4e9}
+    assert fit_task_resources(task_resources, [{}, {}]) == {}
+    with pytest.raises(InsufficientResourcesError):
+        fit_task_resources({'memory': 32e9}, workers)
+
+
+if __name__ == '__main__':
+    test_estimate_resources()
+    test_preflight()
+    test_task_resources()
@@ -0,0 +1,117 @@
+import os
+import shutil
+
+import numpy as np
+import spikeextractors as se
+
+from spikesorters import run_sorter, run_sorters, ResultCache, CompactSortingExtractor
+from spikesorters.resultcache import get_recording_fingerprint
+
+
+def test_run_sorter_result_cache():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    cache_folder = 'test_result_cache'
+    if os.path.exists(cache_folder):
+        shutil.rmtree(cache_folder)
+    cache = ResultCache(cache_folder)
+
+    sorting0 = run_sorter('mocksorter', recording, output_folder='mocksorter_cache0', result_cache=cache, seed=0)
+    assert len(os.listdir(cache_folder)) == 1
+
+    # same data and params in another folder: no computation
+    shutil.rmtree('mocksorter_cache0')
+    sorting1 = run_sorter('mocksorter', recording, output_folder='mocksorter_cache1', result_cache=cache_folder,
+                          seed=0)
+    assert not os.path.exists('mocksorter_cache1')
+    assert isinstance(sorting1, CompactSortingExtractor)
+    for unit_id in sorting0.get_unit_ids():
+        assert np.array_equal(sorting0.get_unit_spike_train(unit_id), sorting1.get_unit_spike_train(unit_id))
+
+    # other params: computed
+    run_sorter('mocksorter', recording, output_folder='mocksorter_cache1', result_cache=cache, seed=1)
+    assert os.path.exists('mocksorter_cache1')
+    assert len(os.listdir(cache_folder)) == 2
+
+
+def test_result_cache_eviction():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    cache_folder = 'test_result_cache_eviction'
+    if os.path.exists(cache_folder):
+        shutil.rmtree(cache_folder)
+    # one entry of 10000 spikes is more than 0.1 MB
+    cache = ResultCache(cache_folder, max_size_mb=0.2)
+    for seed in range(3):
+        run_sorter('mocksorter', recording, output_folder='mocksorter_eviction', result_cache=cache, seed=seed,
+                   num_spikes=10000)
+    assert len(os.listdir(cache_folder)) == 1
+    assert cache.get_size_mb() <= 0.2
+
+
+def test_run_sorters_result_cache():
+    rec0, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    rec1, _ = se.example_datasets.toy_example(num_channels=8, duration=10, seed=0)
+    cache_folder = 'test_run_sorters_cache'
+    for folder in [cache_folder, 'test_run_sorters_cache_a', 'test_run_sorters_cache_b']:
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+
+    sorter_params = {'mocksorter': {'seed': 0}}
+    results_a = run_sorters(['mocksorter'], {'rec0': rec0, 'rec1': rec1}, 'test_run_sorters_cache_a',
+                            sorter_params=sorter_params, result_cache=cache_folder)
+
+    # same data under other names: everything comes from the cache
+    results_b = run_sorters(['mocksorter'], {'other0': rec0, 'other1': rec1}, 'test_run_sorters_cache_b',
+                            sorter_params=sorter_params, result_cache=cache_folder)
+    assert not os.path.exists('test_run_sorters_cache_b/other0/mocksorter/firings.mda')
+    for name_a, name_b in [('rec0', 'other0'), ('rec1', 'other1')]:
+        sorting_a = results_a[(name_a, 'mocksorter')]
+        sorting_b = results_b[(name_b, 'mocksorter')]
+        assert isinstance(sorting_b, CompactSortingExtractor)
+        for unit_id in sorting_a.get_unit_ids():
+            assert np.array_equal(sorting_a.get_unit_spike_train(unit_id), sorting_b.get_unit_spike_train(unit_id))
+
+
+def test_recording_fingerprint():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    traces = recording.get_traces()
+    # a change between the sampled chunks
+    middle = traces.shape[1] // 3 + 5000
+    other_traces = traces.copy()
+    other_traces[:, middle] += 100.
+
+    # in memory: all the traces are hashed
+    rec0 = se.NumpyRecordingExtractor(traces, sampling_frequency=recording.get_sampling_frequency())
+    rec1 = se.NumpyRecordingExtractor(traces.copy(), sampling_frequency=recording.get_sampling_frequency())
+    rec2 = se.NumpyRecordingExtractor(other_traces, sampling_frequency=recording.get_sampling_frequency())
+    assert get_recording_fingerprint(rec0) == get_recording_fingerprint(rec1)
+    assert get_recording_fingerprint(rec0) != get_recording_fingerprint(rec2)
+    # wrapped in memory recordings can not be dumped either
+    sub0, sub1, sub2 = [se.SubRecordingExtractor(rec, channel_ids=[0, 1, 2]) for rec in [rec0, rec1, rec2]]
+    assert get_recording_fingerprint(sub0) == get_recording_fingerprint(sub1)
+    assert get_recording_fingerprint(sub0) != get_recording_fingerprint(sub2)
+
+    # files: the path, size and modification time are hashed
+    folder = 'test_recording_fingerprint'
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+    kwargs = dict(sampling_frequency=recording.get_sampling_frequency(), numchan=4, dtype='float32')
+    file0 = os.path.join(folder, 'rec0.dat')
+    file1 = os.path.join(folder, 'rec1.dat')
+    traces.T.astype('float32').tofile(file0)
+    other_traces.T.astype('float32').tofile(file1)
+    fingerprint0 = get_recording_fingerprint(se.BinDatRecordingExtractor(file0, **kwargs))
+    assert fingerprint0 == get_recording_fingerprint(se.BinDatRecordingExtractor(file0, **kwargs))
+    assert fingerprint0 != get_recording_fingerprint(se.BinDatRecordingExtractor(file1, **kwargs))
+    # rewritten in place
+    stat = os.stat(file0)
+    other_traces.T.astype('float32').tofile(file0)
+    os.utime(file0, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert fingerprint0 != get_recording_fingerprint(se.BinDatRecordingExtractor(file0, **kwargs))
+
+
+if __name__ == '__main__':
+    test_run_sorter_result_cache()
+    test_result_cache_eviction()
+    test_run_sorters_result_cache()
+    test_recording_fingerprint()
@@ -0,0 +1,128 @@
+import os
+import json
+import shutil
+from pathlib import Path
+
+import spikeextractors as se
+
+from spikesorters import run_sorter, run_sorters
+from spikesorters.basesorter import setup_done_filename, run_done_filename
+
+
+def _read_log(folder):
+    with open(str(Path(folder) / 'spikeinterface_log.json'), 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def test_resume_run_sorter():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    recording.set_channel_groups([0, 0, 1, 1])
+    output_folder = Path('test_resume_run_sorter')
+    if output_folder.is_dir():
+        shutil.rmtree(str(output_folder))
+
+    run_sorter('mocksorter', recording, output_folder=output_folder, grouping_property='group', num_spikes=50)
+    folders = [output_folder / str(i) for i in range(2)]
+    for folder in folders:
+        assert (folder / setup_done_filename).is_file()
+        assert (folder / run_done_filename).is_file()
+
+    # the run of group 1 was killed: only this one is done again
+    os.remove(str(folders[1] / run_done_filename))
+    sorting = run_sorter('mocksorter', recording, output_folder=output_folder, grouping_property='group',
+                         num_spikes=50, resume=True)
+    assert len(sorting.get_unit_ids()) > 0
+    log = _read_log(folders[0])
+    assert log['resumed_setups'] == [0, 1]
+    assert log['resumed_runs'] == [0]
+    assert (folders[1] / run_done_filename).is_file()
+
+    # other params invalidate all the stages
+    run_sorter('mocksorter', recording, output_folder=output_folder, grouping_property='group', num_spikes=60,
+               resume=True)
+    log = _read_log(folders[0])
+    assert log['resumed_setups'] == []
+    assert log['resumed_runs'] == []
+    shutil.rmtree(str(output_folder))
+
+
+def test_resume_run_sorters():
+    recording_dict = {}
+    for i in range(2):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i)
+        recording_dict['rec_{}'.format(i)] = rec
+    working_folder = Path('test_resume_run_sorters')
+    if working_folder.is_dir():
+        shutil.rmtree(str(working_folder))
+
+    run_sorters(['mocksorter'], recording_dict, working_folder)
+    # rec_1 failed after its setup
+    output_folder = working_folder / 'rec_1' / 'mocksorter'
+    os.remove(str(output_folder / run_done_filename))
+    os.remove(str(output_folder / 'spikeinterface_log.json'))
+    os.remove(str(working_folder / 'spikeinterface_manifest.jsonl'))
+
+    results = run_sorters(['mocksorter'], recording_dict, working_folder, mode='keep', resume=True)
+    assert len(results) == 2
+    log = _read_log(output_folder)
+    assert log['resumed_setups'] == [0]
+    assert log['resumed_runs'] == []
+    shutil.rmtree(str(working_folder))
+
+
+def test_resume_run_sorters_default_mode():
+    recording_dict = {}
+    for i in range(2):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i)
+        recording_dict['rec_{}'.format(i)] = rec
+    working_folder = Path('test_resume_run_sorters_default_mode')
+    if working_folder.is_dir():
+        shutil.rmtree(str(working_folder))
+
+    run_sorters(['mocksorter'], recording_dict, working_folder)
+    # rec_1 failed after its setup, rec_0 is finished
+    output_folder = working_folder / 'rec_1' / 'mocksorter'
+    os.remove(str(output_folder / run_done_filename))
+    os.remove(str(output_folder / 'spikeinterface_log.json'))
+    os.remove(str(working_folder / 'spikeinterface_manifest.jsonl'))
+    done_log = _read_log(working_folder / 'rec_0' / 'mocksorter')
+
+    results = run_sorters(['mocksorter'], recording_dict, working_folder, resume=True)
+    assert len(results) == 2
+    assert _read_log(working_folder / 'rec_0' / 'mocksorter') == done_log
+    log = _read_log(output_folder)
+    assert log['resumed_setups'] == [0]
+    shutil.rmtree(str(working_folder))
+
+
+def test_resume_submit_sorters():
+    from spikesorters import submit_sorters
+
+    recording_dict = {}
+    for i in range(2):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i)
+        recording_dict['rec_{}'.format(i)] = rec
+    working_folder = Path('test_resume_submit_sorters')
+    if working_folder.is_dir():
+        shutil.rmtree(str(working_folder))
+
+    run_sorters(['mocksorter'], recording_dict, working_folder)
+    output_folder = working_folder / 'rec_1' / 'mocksorter'
+    os.remove(str(output_folder / run_done_filename))
+    os.remove(str(output_folder / 'spikeinterface_log.json'))
+    os.remove(str(working_folder / 'spikeinterface_manifest.jsonl'))
+
+    jobs = submit_sorters(['mocksorter'], recording_dict, working_folder, engine='thread', resume=True)
+    assert jobs.skipped == [('rec_0', 'mocksorter')]
+    results = jobs.results()
+    assert len(results) == 2
+    log = _read_log(output_folder)
+    assert log['resumed_setups'] == [0]
+    shutil.rmtree(str(working_folder))
+
+
+if __name__ == '__main__':
+    test_resume_run_sorter()
+    test_resume_run_sorters()
+    test_resume_run_sorters_default_mode()
+    test_resume_submit_sorters()
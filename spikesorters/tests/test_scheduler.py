@@ -0,0 +1,66 @@
+import os
+import json
+import shutil
+
+import pytest
+import spikeextractors as se
+
+from spikesorters import run_sorters
+from spikesorters.sorterlist import sorter_dict
+from spikesorters.manifest import Manifest
+from spikesorters.scheduler import CostModel, get_lpt_order, predict_makespan, schedule_filename
+
+
+def test_lpt_order():
+    costs = [1., 5., 2., 5., 3.]
+    order = get_lpt_order(costs)
+    assert order == [1, 3, 4, 2, 0]
+    # one long task submitted last determines the makespan
+    assert predict_makespan([1., 1., 1., 1., 4.], 2) == 6.
+    assert predict_makespan([4., 1., 1., 1., 1.], 2) == 4.
+    assert predict_makespan(costs, 1) == sum(costs)
+    assert predict_makespan([], 4) == 0.
+
+
+def test_cost_model():
+    recording_dict = {}
+    for i, duration in enumerate([2, 4]):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=duration, seed=0)
+        recording_dict['rec_{}'.format(i)] = rec
+
+    working_folder = 'test_cost_model'
+    if os.path.exists(working_folder):
+        shutil.rmtree(working_folder)
+
+    cost_model = CostModel(sorter_dict)
+    assert cost_model.get_coefficient('mocksorter') == sorter_dict['mocksorter'].cost_coefficient
+
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params={'mocksorter': {'sleep_s': 0.2}})
+    manifest = Manifest(working_folder)
+    entry = manifest.get('rec_1', 'mocksorter')
+    assert entry['channel_frames'] == 4 * recording_dict['rec_1'].get_num_frames()
+
+    with open(os.path.join(working_folder, schedule_filename), 'r', encoding='utf8') as f:
+        report = json.load(f)
+    assert len(report['tasks']) == 2
+    assert report['actual_makespan'] > 0.4
+
+    # the coefficient is learned from the runs
+    cost_model.add_working_folder(working_folder)
+    assert cost_model.get_num_runs('mocksorter') == 2
+    coefficient = cost_model.get_coefficient('mocksorter')
+    assert coefficient != sorter_dict['mocksorter'].cost_coefficient
+    assert cost_model.predict('mocksorter', 1e6) == pytest.approx(coefficient)
+
+    # also without manifest
+    os.remove(os.path.join(working_folder, 'spikeinterface_manifest.jsonl'))
+    cost_model = CostModel(sorter_dict)
+    cost_model.add_working_folder(working_folder)
+    assert cost_model.get_coefficient('mocksorter') == pytest.approx(coefficient)
+
+    shutil.rmtree(working_folder)
+
+
+if __name__ == '__main__':
+    test_lpt_order()
+    test_cost_model()
@@ -0,0 +1,72 @@
+import shutil
+
+import numpy as np
+import pytest
+import spikeextractors as se
+
+from spikesorters import run_sorter
+from spikesorters.tridesclous import TridesclousSorter
+from spikesorters.spacesplit import get_spatial_partition, remove_halo_units, get_peak_channels
+
+
+def _grid_locations(num_rows, num_cols, pitch=20.):
+    return np.array([[col * pitch, row * pitch] for row in range(num_rows) for col in range(num_cols)])
+
+
+def test_get_spatial_partition():
+    locations = _grid_locations(32, 2)
+    partition = get_spatial_partition(locations, 16, 25.)
+    assert len(partition) == 4
+    cores = np.concatenate([core for core, _ in partition])
+    assert np.array_equal(np.sort(cores), np.arange(64))
+    for core, channels in partition:
+        assert len(core) <= 16
+        assert np.all(np.isin(core, channels))
+        # compact: the core spans 8 rows
+        assert np.ptp(locations[core, 1]) == 7 * 20.
+        # halo: one row on each side (except at the tips)
+        assert len(channels) - len(core) in (2, 4)
+
+
+@pytest.mark.parametrize('with_offsets', [False, True])
+def test_remove_halo_units(with_offsets):
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=8, duration=10, seed=0)
+    recording.set_channel_locations(_grid_locations(4, 2))
+    if with_offsets:
+        # raw traces with a large DC offset per channel: the peak channels do not change
+        peak_channels = get_peak_channels(recording, sorting_gt)
+        traces = recording.get_traces() + np.linspace(-3000., 3000., 8)[:, None]
+        recording = se.NumpyRecordingExtractor(timeseries=traces,
+                                               sampling_frequency=recording.get_sampling_frequency(),
+                                               geom=recording.get_channel_locations())
+        assert get_peak_channels(recording, sorting_gt) == peak_channels
+    partition = get_spatial_partition(recording.get_channel_locations(), 4, 25.)
+    channel_ids = np.array(recording.get_channel_ids())
+
+    # all the groups find all the units: each unit must be kept by exactly one group
+    kept = []
+    for core, channels in partition:
+        sorting = remove_halo_units(recording, sorting_gt, channel_ids[core].tolist())
+        kept.extend(sorting.get_unit_ids())
+    assert sorted(kept) == sorted(sorting_gt.get_unit_ids())
+
+
+@pytest.mark.skipif(not TridesclousSorter.is_installed(), reason='tridesclous not installed')
+def test_split_by_space():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=8, duration=30, seed=0, dumpable=True,
+                                                            dump_folder='test_split_by_space')
+    recording.set_channel_locations(_grid_locations(4, 2))
+    output_folder = 'tdc_split_by_space'
+    sorting = run_sorter('tridesclous', recording, output_folder=output_folder, split_by_space=(4, 25.),
+                         parallel=True, n_jobs=2)
+    groups = [sorting.get_unit_property(u, 'spatial_group') for u in sorting.get_unit_ids()]
+    assert set(groups) <= {0, 1}
+    shutil.rmtree(output_folder, ignore_errors=True)
+    shutil.rmtree('test_split_by_space', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_get_spatial_partition()
+    test_remove_halo_units(False)
+    test_remove_halo_units(True)
+    test_split_by_space()
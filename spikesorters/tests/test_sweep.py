@@ -0,0 +1,101 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import spikeextractors as se
+
+from spikesorters import run_sorter_sweep
+from spikesorters.sorterlist import sorter_dict
+from spikesorters.sweep import get_param_sets, get_export_groups, export_folder_name
+
+
+def test_export_groups():
+    param_sets = get_param_sets({'detect_threshold': [5, 6], 'adjacency_radius': [50, 100]})
+    assert len(param_sets) == 4
+    assert param_sets[1] == {'detect_threshold': 5, 'adjacency_radius': 100}
+    # the traces exported by tridesclous do not depend on its params
+    assert get_export_groups(sorter_dict['tridesclous'], param_sets) == [0, 0, 0, 0]
+    # unknown: each param set has its own export
+    assert get_export_groups(sorter_dict['spykingcircus'], param_sets) == [0, 1, 2, 3]
+
+
+def test_run_sorter_sweep():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    sweep_folder = Path('test_run_sorter_sweep')
+    if sweep_folder.is_dir():
+        shutil.rmtree(str(sweep_folder))
+
+    param_grid = {'num_units': [3, 5], 'export': [True], 'num_spikes': [50], 'seed': [0]}
+    rows = run_sorter_sweep('mocksorter', recording, param_grid, sweep_folder=sweep_folder, n_jobs=2,
+                            metric_func=lambda sorting: {'max_unit_id': max(sorting.get_unit_ids())})
+    assert [row['num_units'] for row in rows] == [3, 5]
+    assert all(row['status'] == 'done' for row in rows)
+    assert [row['max_unit_id'] for row in rows] == [3, 5]
+    assert len(rows[0]['sorting'].get_unit_spike_train(rows[0]['sorting'].get_unit_ids()[0])) > 0
+
+    # one export linked in the folders of the param sets
+    exports = [name for name in os.listdir(str(sweep_folder / export_folder_name)) if not name.startswith('.')]
+    assert len(exports) == 1
+    export_file = sweep_folder / export_folder_name / exports[0]
+    for row in rows:
+        assert os.path.samefile(str(row['output_folder'] / 'recording.dat'), str(export_file))
+
+    # a new sweep reuses the export
+    mtime = export_file.stat().st_mtime
+    rows = run_sorter_sweep('mocksorter', recording, [{'export': True, 'num_units': 4}], sweep_folder=sweep_folder)
+    assert rows[0]['num_units'] == 4
+    assert export_file.stat().st_mtime == mtime
+    assert not (sweep_folder / 'params1').is_dir()
+    shutil.rmtree(str(sweep_folder))
+
+
+def test_run_sorter_sweep_export_signal():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    sweep_folder = Path('test_run_sorter_sweep_export_signal')
+    if sweep_folder.is_dir():
+        shutil.rmtree(str(sweep_folder))
+    # the trash of the removals of a previous sweep is not removed again
+    os.makedirs(str(sweep_folder / '.spikesorters_trash'))
+
+    # the second param set starts once the first one has exported, not when it has finished
+    param_grid = [{'export': True, 'sleep_s': 3., 'num_spikes': 50}, {'export': True, 'num_spikes': 50}]
+    rows = run_sorter_sweep('mocksorter', recording, param_grid, sweep_folder=sweep_folder, n_jobs=2,
+                            engine='thread', budget={'cores': 2})
+    assert all(row['status'] == 'done' for row in rows)
+    assert rows[0]['export_group'] == rows[1]['export_group']
+    assert (sweep_folder / 'params0.setup_done').is_file()
+    assert os.path.getmtime(str(rows[1]['output_folder'] / 'spikeinterface_log.json')) < \
+        os.path.getmtime(str(rows[0]['output_folder'] / 'spikeinterface_log.json'))
+    shutil.rmtree(str(sweep_folder))
+
+
+def test_run_sorter_sweep_wrapped_recordings():
+    # two in memory recordings behind a SubRecordingExtractor, different after the first frames
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=0)
+    traces = recording.get_traces()
+    other_traces = traces.copy()
+    other_traces[:, traces.shape[1] // 3 + 5000] += 100.
+    sweep_folder = Path('test_run_sorter_sweep_wrapped')
+    if sweep_folder.is_dir():
+        shutil.rmtree(str(sweep_folder))
+
+    for t in [traces, other_traces]:
+        rec = se.SubRecordingExtractor(se.NumpyRecordingExtractor(t, recording.get_sampling_frequency()),
+                                       channel_ids=[0, 1, 2, 3])
+        rows = run_sorter_sweep('mocksorter', rec, [{'export': True, 'num_spikes': 50}], sweep_folder=sweep_folder)
+        assert rows[0]['status'] == 'done'
+        # the linked file has the traces of this recording
+        linked = np.fromfile(str(rows[0]['output_folder'] / 'recording.dat'), dtype='float32')
+        assert np.array_equal(linked.reshape(-1, 4).T, t.astype('float32'))
+    # one export per recording
+    exports = [name for name in os.listdir(str(sweep_folder / export_folder_name)) if not name.startswith('.')]
+    assert len(exports) == 2
+    shutil.rmtree(str(sweep_folder))
+
+
+if __name__ == '__main__':
+    test_export_groups()
+    test_run_sorter_sweep()
+    test_run_sorter_sweep_export_signal()
+    test_run_sorter_sweep_wrapped_recordings()
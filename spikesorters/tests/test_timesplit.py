@@ -0,0 +1,104 @@
+import shutil
+
+import numpy as np
+import pytest
+import spikeextractors as se
+
+from spikesorters import run_sorter
+from spikesorters.tridesclous import TridesclousSorter
+from spikesorters.timesplit import get_time_segments, stitch_time_segments
+
+
+def test_get_time_segments():
+    segments = get_time_segments(100000, 10000., 3., 0.5)
+    assert segments == [(0, 35000), (30000, 65000), (60000, 95000), (90000, 100000)]
+    # no tiny last segment
+    segments = get_time_segments(62000, 10000., 3., 0.5)
+    assert segments == [(0, 35000), (30000, 62000)]
+    assert get_time_segments(1000, 10000., 3., 0.5) == [(0, 1000)]
+
+
+def test_stitch_time_segments():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=30, seed=0)
+    segments = get_time_segments(recording.get_num_frames(), recording.get_sampling_frequency(), 10., 2.)
+
+    # each segment is a perfect sorting with its own unit ids
+    sortings = []
+    for k, (start, end) in enumerate(segments):
+        sub = se.NumpySortingExtractor()
+        times, labels = [], []
+        for unit_id in sorting_gt.get_unit_ids():
+            st = sorting_gt.get_unit_spike_train(unit_id, start_frame=start, end_frame=end) - start
+            times.append(st)
+            labels.append(np.full(st.size, unit_id * 100 + k))
+        sub.set_times_labels(np.concatenate(times), np.concatenate(labels))
+        sub.set_sampling_frequency(recording.get_sampling_frequency())
+        sortings.append(sub)
+
+    sorting = stitch_time_segments(recording, sortings, segments)
+    assert len(sorting.get_unit_ids()) == len(sorting_gt.get_unit_ids())
+    for unit_id in sorting.get_unit_ids():
+        members = sorting.get_unit_property(unit_id, 'time_segment_units')
+        assert len(members) == len(segments)
+        gt_unit = int(members[0][1]) // 100
+        assert all(int(u) // 100 == gt_unit for _, u in members)
+        assert np.array_equal(sorting.get_unit_spike_train(unit_id), sorting_gt.get_unit_spike_train(gt_unit))
+
+
+def test_stitch_time_segments_channel_offsets():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=30, seed=0)
+    # raw traces with a large DC offset per channel
+    traces = recording.get_traces() + np.array([[500.], [-2000.], [3000.], [100.]])
+    recording_offsets = se.NumpyRecordingExtractor(timeseries=traces,
+                                                   sampling_frequency=recording.get_sampling_frequency(),
+                                                   geom=recording.get_channel_locations())
+    segments = get_time_segments(recording.get_num_frames(), recording.get_sampling_frequency(), 10., 2.)
+
+    # consecutive segments find disjoint sets of units
+    unit_ids = sorting_gt.get_unit_ids()
+    sortings = []
+    for k, (start, end) in enumerate(segments):
+        sub = se.NumpySortingExtractor()
+        times, labels = [], []
+        for unit_id in unit_ids[k % 2::2]:
+            st = sorting_gt.get_unit_spike_train(unit_id, start_frame=start, end_frame=end) - start
+            times.append(st)
+            labels.append(np.full(st.size, unit_id * 100 + k))
+        sub.set_times_labels(np.concatenate(times), np.concatenate(labels))
+        sub.set_sampling_frequency(recording.get_sampling_frequency())
+        sortings.append(sub)
+
+    sorting = stitch_time_segments(recording, sortings, segments)
+    sorting_offsets = stitch_time_segments(recording_offsets, sortings, segments)
+    # the offsets do not make all the templates similar
+    assert len(sorting_offsets.get_unit_ids()) > len(unit_ids) // 2
+    members = sorted(sorting.get_unit_property(u, 'time_segment_units') for u in sorting.get_unit_ids())
+    members_offsets = sorted(sorting_offsets.get_unit_property(u, 'time_segment_units')
+                             for u in sorting_offsets.get_unit_ids())
+    assert members == members_offsets
+
+
+@pytest.mark.skipif(not TridesclousSorter.is_installed(), reason='tridesclous not installed')
+def test_split_by_time():
+    recording, sorting_gt = se.example_datasets.toy_example(num_channels=4, duration=30, seed=0, dumpable=True,
+                                                            dump_folder='test_split_by_time')
+    output_folder = 'tdc_split_by_time'
+    sorting = run_sorter('tridesclous', recording, output_folder=output_folder, split_by_time=(10., 2.),
+                         parallel=True, n_jobs=2)
+    num_frames = recording.get_num_frames()
+    for unit_id in sorting.get_unit_ids():
+        st = sorting.get_unit_spike_train(unit_id)
+        assert np.all(np.diff(st) > 0)
+        assert st[-1] < num_frames
+    # units found in several segments are merged
+    num_segment_units = sum(len(sorting.get_unit_property(u, 'time_segment_units')) for u in sorting.get_unit_ids())
+    assert len(sorting.get_unit_ids()) < num_segment_units
+    shutil.rmtree(output_folder, ignore_errors=True)
+    shutil.rmtree('test_split_by_time', ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test_get_time_segments()
+    test_stitch_time_segments()
+    test_stitch_time_segments_channel_offsets()
+    test_split_by_time()
@@ -0,0 +1,83 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import spikeextractors as se
+
+from spikesorters import MockSorter, flush_folder_removals, run_sorters
+from spikesorters.trash import remove_folder, trash_folder_name, get_num_pending_removals
+
+
+def test_remove_folder():
+    parent = Path('test_trash').absolute()
+    if parent.is_dir():
+        shutil.rmtree(str(parent))
+    folder = parent / 'big_folder'
+    os.makedirs(str(folder / 'sub'))
+    for i in range(20):
+        np.zeros(100000, dtype='int16').tofile(str(folder / 'sub' / 'file{}.dat'.format(i)))
+
+    remove_folder(folder)
+    # the path is free immediately
+    assert not folder.exists()
+    os.makedirs(str(folder))
+
+    assert flush_folder_removals(timeout=60)
+    assert get_num_pending_removals() == 0
+    assert not (parent / trash_folder_name).exists()
+    assert folder.is_dir()
+
+    remove_folder(folder, asynchronous=False)
+    assert not folder.exists()
+
+
+def test_sorter_folder_removal():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    output_folder = Path('test_trash_sorter').absolute()
+    sorter = MockSorter(recording=recording, output_folder=output_folder)
+    sorter.run()
+    # a new sorter on the same folder starts from a fresh folder
+    sorter = MockSorter(recording=recording, output_folder=output_folder, delete_output_folder=True)
+    assert not (output_folder / 'firings.mda').exists()
+    sorter.run()
+    sorting = sorter.get_result()
+    assert not output_folder.exists()
+    assert len(sorting.get_unit_ids()) == MockSorter.default_params()['num_units']
+    assert flush_folder_removals(timeout=60)
+
+
+def test_run_sorters_multiprocessing_removal():
+    recording_dict = {}
+    for i in range(2):
+        rec, _ = se.example_datasets.toy_example(num_channels=4, duration=2, seed=i, dumpable=True,
+                                                 dump_folder='test_trash_multiprocessing_recordings')
+        recording_dict['rec_{}'.format(i)] = rec
+    working_folder = Path('test_trash_multiprocessing').absolute()
+    if working_folder.is_dir():
+        shutil.rmtree(str(working_folder))
+
+    sorter_params = {'mocksorter': dict(num_spikes=100, failure_rate=1.)}
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params, with_output=False,
+                run_sorter_kwargs={'raise_error': False})
+    # failed output folders with many files: removed by the sorters in the workers
+    for rec_name in recording_dict:
+        folder = working_folder / rec_name / 'mocksorter' / 'many_files'
+        os.makedirs(str(folder))
+        for i in range(2000):
+            np.zeros(10, dtype='int16').tofile(str(folder / 'file{}.dat'.format(i)))
+
+    sorter_params = {'mocksorter': dict(num_spikes=100)}
+    run_sorters(['mocksorter'], recording_dict, working_folder, sorter_params=sorter_params, mode='overwrite',
+                engine='multiprocessing', engine_kwargs={'processes': 2}, with_output=False)
+    assert flush_folder_removals(timeout=60)
+    for rec_name in recording_dict:
+        assert not (working_folder / rec_name / trash_folder_name).exists()
+        assert (working_folder / rec_name / 'mocksorter' / 'firings.mda').is_file()
+    shutil.rmtree(str(working_folder))
+
+
+if __name__ == '__main__':
+    test_remove_folder()
+    test_sorter_folder_removal()
+    test_run_sorters_multiprocessing_removal()
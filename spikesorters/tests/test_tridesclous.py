@@ -1,8 +1,12 @@
 import unittest
+import json
+import shutil
+from pathlib import Path
 
 import pytest
 import spikeextractors as se
 from spikesorters import TridesclousSorter, run_tridesclous
+from spikesorters.tridesclous.tridesclous import catalogues_filename
 from spikesorters.tests.common_tests import SorterCommonTestSuite
 
 
@@ -25,8 +29,49 @@ def test_run_tridesclous():
         print('unit #', unit_id, 'nb', len(sorting.get_unit_spike_train(unit_id)))
 
 
+@pytest.mark.skipif(not TridesclousSorter.is_installed(), reason='tridesclous not installed')
+def test_catalogue_from():
+    recording0, _ = se.example_datasets.toy_example(num_channels=4, duration=30, seed=0)
+    recording1, _ = se.example_datasets.toy_example(num_channels=4, duration=20, seed=0)
+    folder = Path('test_catalogue_from')
+    if folder.is_dir():
+        shutil.rmtree(str(folder))
+
+    sorting0 = run_tridesclous(recording0, output_folder=folder / 'session0')
+    # only the Peeler runs: same units
+    sorting1 = run_tridesclous(recording1, output_folder=folder / 'session1', catalogue_from=str(folder / 'session0'))
+    assert set(sorting1.get_unit_ids()) <= set(sorting0.get_unit_ids())
+    with open(str(folder / 'session1' / catalogues_filename), 'r', encoding='utf8') as f:
+        catalogue_keys = json.load(f)
+    assert catalogue_keys['0']['from'] == str((folder / 'session0').absolute())
+
+    # other preprocessing params: the catalogue is built
+    with pytest.warns(UserWarning):
+        run_tridesclous(recording1, output_folder=folder / 'session2', catalogue_from=str(folder), freq_min=300.)
+    shutil.rmtree(str(folder))
+
+
+@pytest.mark.skipif(not TridesclousSorter.is_installed(), reason='tridesclous not installed')
+def test_scratch_folder_paths():
+    recording, _ = se.example_datasets.toy_example(num_channels=4, duration=10, seed=0)
+    output_folder = Path('tdc_scratch_output')
+    scratch_folder = Path('tdc_scratch').absolute()
+    scratch_folder.mkdir(exist_ok=True)
+    run_tridesclous(recording, output_folder=output_folder, scratch_folder=scratch_folder,
+                    keep_intermediates='keep')
+    # the datasource of tridesclous is the copied back file, not the removed scratch file
+    with open(str(output_folder / 'info.json'), 'r', encoding='utf8') as f:
+        info = json.load(f)
+    for filename in info['datasource_kargs']['filenames']:
+        assert Path(filename) == (output_folder / 'raw_signals.raw').absolute()
+    shutil.rmtree(str(output_folder))
+    shutil.rmtree(str(scratch_folder), ignore_errors=True)
+
+
 if __name__ == '__main__':
     test_run_tridesclous()
+    test_catalogue_from()
+    test_scratch_folder_paths()
     #~ TridesclousCommonTestSuite().test_on_toy()
     #~ TridesclousCommonTestSuite().test_several_groups()
     TridesclousCommonTestSuite().test_with_BinDatRecordingExtractor()
@@ -0,0 +1,249 @@
+"""
+Sort a long recording as overlapping time segments and stitch the results.
+
+The recording is cut into segments of segment_s seconds, each one extended by
+overlap_s seconds on the next segment. Each segment is sorted independently
+(in parallel, see BaseSorter(split_by_time=...)), then:
+  * units of consecutive segments are matched by the similarity of their
+    templates computed on the spikes of the overlap window
+  * each segment keeps its spikes up to the middle of the overlap window so
+    that a spike is given by only one segment, and the spikes detected by both
+    segments around the cut are removed
+  * frames are shifted back to the global time of the recording
+"""
+import numpy as np
+
+import spikeextractors as se
+
+
+def get_time_segments(num_frames, sampling_frequency, segment_s, overlap_s):
+    """
+    Cut [0, num_frames) into segments of segment_s seconds overlapping by overlap_s seconds.
+
+    Returns
+    -------
+    segments: list of (start_frame, end_frame)
+    """
+    segment_size = int(segment_s * sampling_frequency)
+    overlap_size = int(overlap_s * sampling_frequency)
+    assert segment_size > 0, 'segment_s is too small'
+    assert 0 <= overlap_size < segment_size, 'overlap_s must be smaller than segment_s'
+    segments = []
+    start = 0
+    while start < num_frames:
+        end = min(start + segment_size + overlap_size, num_frames)
+        if num_frames - end < overlap_size:
+            # avoid a last segment that would be only overlap
+            end = num_frames
+        segments.append((start, end))
+        if end == num_frames:
+            break
+        start += segment_size
+    return segments
+
+
+def _select_spikes(times, overlap_start, overlap_end, min_spikes, max_spikes):
+    # spikes of the overlap window, or the spikes closest to it when the unit is silent in the window
+    in_window = times[(times >= overlap_start) & (times < overlap_end)]
+    if in_window.size >= min_spikes:
+        selected = in_window
+    else:
+        dist = np.maximum(overlap_start - times, times - overlap_end + 1)
+        selected = np.sort(times[np.argsort(dist, kind='stable')[:max_spikes]])
+    if selected.size > max_spikes:
+        selected = selected[np.linspace(0, selected.size - 1, max_spikes).astype('int64')]
+    return selected
+
+
+def get_templates(recording, spike_trains, nbefore, nafter):
+    """
+    Average waveforms (num_channels x (nbefore + nafter)) of dict unit_id -> spike frames.
+    Spikes too close to the recording borders are ignored, units without spikes are not in the output.
+
+    The median of each channel is subtracted from every snippet: on raw (unfiltered) traces the
+    channel offsets would otherwise dominate the templates.
+    """
+    num_frames = recording.get_num_frames()
+    templates = {}
+    for unit_id, times in spike_trains.items():
+        times = times[(times >= nbefore) & (times < num_frames - nafter)]
+        if times.size == 0:
+            continue
+        # one read covering all the snippets when they are close (the overlap window), else one read per snippet
+        start, end = int(times[0]) - nbefore, int(times[-1]) + nafter
+        if end - start <= 10 * times.size * (nbefore + nafter):
+            traces = recording.get_traces(start_frame=start, end_frame=end)
+            snippets = [traces[:, t - start - nbefore:t - start + nafter] for t in times]
+        else:
+            snippets = [recording.get_traces(start_frame=int(t) - nbefore, end_frame=int(t) + nafter) for t in times]
+        snippets = np.stack(snippets, axis=0).astype('float64')
+        snippets -= np.median(snippets, axis=2, keepdims=True)
+        templates[unit_id] = np.mean(snippets, axis=0)
+    return templates
+
+
+def match_units_in_overlap(recording, trains0, trains1, overlap_start, overlap_end, similarity_threshold=0.8,
+                           ms_before=1., ms_after=2., max_spikes_per_unit=100, min_spikes=5):
+    """
+    Match the units of two consecutive segments by the cosine similarity of their templates
+    in the overlap window [overlap_start, overlap_end).
+
+    trains0 and trains1 are dict unit_id -> spike frames (global time). Templates are computed
+    on the spikes of the overlap window, or on the spikes closest to it for units with less
+    than min_spikes spikes in the window.
+
+    Returns
+    -------
+    matches: dict
+        unit_id of the first segment -> unit_id of the second segment
+    """
+    fs = recording.get_sampling_frequency()
+    nbefore = int(ms_before * fs / 1000.)
+    nafter = int(ms_after * fs / 1000.)
+
+    def select(trains):
+        out = {}
+        for unit_id, times in trains.items():
+            if times.size > 0:
+                out[unit_id] = _select_spikes(times, overlap_start, overlap_end, min_spikes, max_spikes_per_unit)
+        return out
+
+    templates0 = get_templates(recording, select(trains0), nbefore, nafter)
+    templates1 = get_templates(recording, select(trains1), nbefore, nafter)
+    if len(templates0) == 0 or len(templates1) == 0:
+        return {}
+
+    units0 = list(templates0.keys())
+    units1 = list(templates1.keys())
+    flat0 = np.stack([templates0[u].ravel() for u in units0])
+    flat1 = np.stack([templates1[u].ravel() for u in units1])
+    norm0 = np.linalg.norm(flat0, axis=1)[:, None]
+    norm1 = np.linalg.norm(flat1, axis=1)[None, :]
+    similarity = flat0 @ flat1.T / np.maximum(norm0 * norm1, 1e-12)
+
+    # greedy one to one matching, best pairs first
+    matches = {}
+    used1 = set()
+    order = np.argsort(similarity, axis=None)[::-1]
+    for ind in order:
+        i, j = np.unravel_index(ind, similarity.shape)
+        if similarity[i, j] < similarity_threshold:
+            break
+        if units0[i] in matches or units1[j] in used1:
+            continue
+        matches[units0[i]] = units1[j]
+        used1.add(units1[j])
+    return matches
+
+
+def stitch_time_segments(recording, sortings, segments, similarity_threshold=0.8, ms_before=1., ms_after=2.,
+                         max_spikes_per_unit=100, dedup_ms=0.4):
+    """
+    Stitch the sortings of overlapping time segments into one sorting in global time.
+
+    Parameters
+    ----------
+    recording: RecordingExtractor
+        The full recording (used to compute templates in the overlap windows)
+    sortings: list of SortingExtractor
+        One sorting per segment, with frames relative to the segment start
+    segments: list of (start_frame, end_frame)
+        The segments (see get_time_segments())
+    similarity_threshold: float
+        Minimum template cosine similarity to merge two units of consecutive segments
+    ms_before, ms_after: float
+        Template window around each spike
+    max_spikes_per_unit: int
+        Maximum number of spikes used for a template
+    dedup_ms: float
+        Spikes of a merged unit closer than this around a cut are counted once
+
+    Returns
+    -------
+    sorting: NumpySortingExtractor
+        Unit ids are 1..N, the unit property 'time_segment_units' gives the list of
+        (segment index, unit id in the segment) merged in each unit
+    """
+    assert len(sortings) == len(segments)
+    num_segments = len(segments)
+
+    # global spike trains per segment
+    trains = []
+    for sorting, (start, end) in zip(sortings, segments):
+        seg_trains = {}
+        if sorting is not None:
+            for unit_id in sorting.get_unit_ids():
+                seg_trains[unit_id] = np.asarray(sorting.get_unit_spike_train(unit_id)).astype('int64') + start
+        trains.append(seg_trains)
+
+    # the cut between segment k and k+1 is the middle of their overlap
+    cuts = []
+    for k in range(num_segments - 1):
+        overlap_start = segments[k + 1][0]
+        overlap_end = segments[k][1]
+        cuts.append((overlap_start + overlap_end) // 2)
+
+    # chain units across segments with a union-find over (segment, unit_id)
+    parent = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for k in range(num_segments):
+        for unit_id in trains[k]:
+            parent[(k, unit_id)] = (k, unit_id)
+    for k in range(num_segments - 1):
+        overlap_start = segments[k + 1][0]
+        overlap_end = segments[k][1]
+        if overlap_end <= overlap_start:
+            continue
+        matches = match_units_in_overlap(recording, trains[k], trains[k + 1], overlap_start, overlap_end,
+                                         similarity_threshold=similarity_threshold, ms_before=ms_before,
+                                         ms_after=ms_after, max_spikes_per_unit=max_spikes_per_unit)
+        for u0, u1 in matches.items():
+            parent[find((k + 1, u1))] = find((k, u0))
+
+    # keep the spikes of each segment between its cuts
+    merged = {}
+    for k in range(num_segments):
+        own_start = cuts[k - 1] if k > 0 else -np.inf
+        own_end = cuts[k] if k < num_segments - 1 else np.inf
+        for unit_id, times in trains[k].items():
+            root = find((k, unit_id))
+            kept = times[(times >= own_start) & (times < own_end)]
+            merged.setdefault(root, {'members': [], 'times': []})
+            merged[root]['members'].append((k, unit_id))
+            merged[root]['times'].append(kept)
+
+    # spikes detected by both segments close to a cut
+    dedup_frames = int(dedup_ms * recording.get_sampling_frequency() / 1000.)
+    cuts = np.array(cuts, dtype='int64')
+
+    times_list = []
+    labels_list = []
+    unit_members = {}
+    roots = sorted(merged.keys(), key=lambda r: (r[0], str(r[1])))
+    for new_id, root in enumerate(roots, start=1):
+        times = np.sort(np.concatenate(merged[root]['times']))
+        if times.size > 1 and cuts.size > 0 and dedup_frames > 0:
+            close = np.diff(times) <= dedup_frames
+            ind = np.searchsorted(cuts, times[1:])
+            dist_to_cut = np.minimum(np.abs(times[1:] - cuts[np.clip(ind - 1, 0, cuts.size - 1)]),
+                                     np.abs(times[1:] - cuts[np.clip(ind, 0, cuts.size - 1)]))
+            duplicate = close & (dist_to_cut <= dedup_frames)
+            times = np.concatenate([times[:1], times[1:][~duplicate]])
+        times_list.append(times)
+        labels_list.append(np.full(times.size, new_id, dtype='int64'))
+        unit_members[new_id] = merged[root]['members']
+
+    sorting = se.NumpySortingExtractor()
+    if len(times_list) > 0:
+        sorting.set_times_labels(np.concatenate(times_list), np.concatenate(labels_list))
+    sorting.set_sampling_frequency(recording.get_sampling_frequency())
+    for new_id, members in unit_members.items():
+        if new_id in sorting.get_unit_ids():
+            sorting.set_unit_property(new_id, 'time_segment_units', [[int(k), str(u)] for k, u in members])
+    return sorting
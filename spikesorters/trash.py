@@ -0,0 +1,142 @@
+"""
+Asynchronous removal of folders.
+
+Removing an output folder with GB of temporary files can take minutes on
+network storage. Instead the folder is renamed (atomic and instantaneous on
+the same filesystem) into a trash folder next to it, and the trash is purged
+by a pool of background threads.
+
+The trash is a hidden '.spikesorters_trash' folder in the parent folder, so
+the rename never crosses a filesystem. If the rename is not possible the folder
+is removed synchronously.
+
+Pending removals are finished before the interpreter (or a worker process) exits: the
+worker processes of multiprocessing, concurrent.futures and loky exit without the atexit
+handlers that join the threads (and before python 3.9 the threads are daemonic), so
+they wait for their removals in a multiprocessing finalizer. Use flush_folder_removals()
+to wait for them explicitly (in tests for instance).
+"""
+from pathlib import Path
+import os
+import shutil
+import threading
+import uuid
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ThreadPoolExecutor, wait
+
+trash_folder_name = '.spikesorters_trash'
+
+# maximum number of folders purged at the same time
+max_concurrent_removals = 2
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+_seen_trash_folders = set()
+
+
+def _after_fork():
+    # a forked process (multiprocessing workers) has none of the threads of the parent executor
+    global _executor, _pending, _lock
+    _executor = None
+    _pending = set()
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_concurrent_removals, thread_name_prefix='spikesorters_trash')
+        if multiprocessing.current_process().name != 'MainProcess':
+            # run by the worker process when it exits (the forked ones too: _after_fork() resets the executor)
+            multiprocessing.util.Finalize(None, flush_folder_removals, exitpriority=10)
+    return _executor
+
+
+def _purge(folder):
+    shutil.rmtree(str(folder), ignore_errors=True)
+    # remove the trash folder itself when empty (fails silently otherwise)
+    try:
+        os.rmdir(str(folder.parent))
+    except OSError:
+        pass
+
+
+def _submit(folder):
+    with _lock:
+        future = _get_executor().submit(_purge, folder)
+        _pending.add(future)
+    future.add_done_callback(_discard)
+
+
+def _discard(future):
+    with _lock:
+        _pending.discard(future)
+
+
+def remove_folder(folder, asynchronous=True):
+    """
+    Remove a folder, in the background by default.
+
+    When the function returns the folder path is free: a new folder can be
+    created at the same place immediately.
+
+    Parameters
+    ----------
+    folder: str or Path
+        The folder to be removed
+    asynchronous: bool
+        If False, the folder is removed before returning
+    """
+    folder = Path(folder).absolute()
+    if not folder.is_dir():
+        return
+    if not asynchronous:
+        shutil.rmtree(str(folder), ignore_errors=True)
+        return
+
+    trash_folder = folder.parent / trash_folder_name
+    trashed = trash_folder / '{}.{}'.format(folder.name, uuid.uuid4().hex)
+    # the empty trash folder can be removed by a purge between makedirs and rename: try twice
+    for attempt in range(2):
+        try:
+            os.makedirs(str(trash_folder), exist_ok=True)
+            os.rename(str(folder), str(trashed))
+            break
+        except OSError:
+            if attempt == 1:
+                shutil.rmtree(str(folder), ignore_errors=True)
+                return
+
+    # leftovers of an interrupted session are purged too
+    if trash_folder not in _seen_trash_folders:
+        _seen_trash_folders.add(trash_folder)
+        for name in os.listdir(str(trash_folder)):
+            if trash_folder / name != trashed:
+                _submit(trash_folder / name)
+    _submit(trashed)
+
+
+def get_num_pending_removals():
+    with _lock:
+        return len(_pending)
+
+
+def flush_folder_removals(timeout=None):
+    """
+    Wait until all pending removals are finished.
+
+    Returns
+    -------
+    done: bool
+        False if the timeout expired before
+    """
+    with _lock:
+        pending = list(_pending)
+    _, not_done = wait(pending, timeout=timeout)
+    return len(not_done) == 0
@@ -1,6 +1,9 @@
 from pathlib import Path
 import os
 import shutil
+import json
+import hashlib
+import warnings
 import numpy as np
 import copy
 import time
@@ -9,6 +12,7 @@ from pprint import pprint
 import distutils.version
 
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, python_ram_bytes
 import spikeextractors as se
 from ..sorter_tools import recover_recording
 
@@ -29,6 +33,8 @@ class TridesclousSorter(BaseSorter):
 
     sorter_name = 'tridesclous'
     requires_locations = False
+    cost_coefficient = 0.2
+    setup_params = []  # the exported traces do not depend on the params
     compatible_with_parallel = {'loky': True, 'multiprocessing': False, 'threading': False}
 
     _default_params = {
@@ -42,8 +48,14 @@ class TridesclousSorter(BaseSorter):
         'feature_method': 'auto',  # peak_max/global_pca/by_channel_pca
         'cluster_method': 'auto',  # pruningshears/dbscan/kmeans
         'clean_catalogue_gui': False,
+        'catalogue_from': None,
+        'catalogue_refine_s': 10.,
     }
 
+    # the params a catalogue depends on for the Peeler, with the probe geometry (see get_catalogue_key())
+    catalogue_key_params = ['freq_min', 'freq_max', 'detect_sign', 'detect_threshold', 'peak_span_ms',
+                            'wf_left_ms', 'wf_right_ms']
+
     _params_description = {
         'freq_min': "High-pass filter cutoff frequency",
         'freq_max': "Low-pass filter cutoff frequency",
@@ -56,6 +68,11 @@ class TridesclousSorter(BaseSorter):
         'feature_method': "Feature method to use",  # peak_max/global_pca/by_channel_pca
         'cluster_method': "Feature method to use",  # pruningshears/dbscan/kmeans
         'clean_catalogue_gui': "Enable or disable interactive GUI for cleaning templates before peeler",
+        'catalogue_from': "Folder of previous tridesclous runs (searched recursively): the catalogue with the same "
+                          "probe geometry and preprocessing params is reused and only the Peeler runs (same unit "
+                          "ids). The catalogue is built if none matches",
+        'catalogue_refine_s': "Duration in s at the start of the recording on which the noise is estimated to "
+                              "adapt a reused catalogue (templates kept in signal units), 0 to reuse it as is",
     }
 
     sorter_description = """Tridesclous is a template-matching spike sorter with a real-time engine. 
@@ -80,6 +97,16 @@ class TridesclousSorter(BaseSorter):
     def get_sorter_version():
         return tdc.__version__
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # float32 raw_signals.raw unless the recording is already a binary file + float32 processed signals
+        nbytes = get_recording_bytes(recording, dtype='float32')
+        if isinstance(recording, se.BinDatRecordingExtractor) and recording._time_axis == 0:
+            raw_nbytes = 0
+        else:
+            raw_nbytes = nbytes
+        return make_estimate(disk_bytes=raw_nbytes + nbytes, scratch_bytes=0, peak_ram_bytes=python_ram_bytes)
+
     def _setup_recording(self, recording, output_folder):
         # reset the output folder
         if output_folder.is_dir():
@@ -103,7 +130,7 @@ class TridesclousSorter(BaseSorter):
                 print('Local copy of recording')
             # save binary file (chunk by hcunk) into a new file
             raw_filename = output_folder / 'raw_signals.raw'
-            recording.write_to_binary_dat_format(raw_filename, time_axis=0, dtype='float32', chunk_mb=500)
+            self._write_binary(recording, raw_filename, time_axis=0, dtype='float32', chunk_mb=500)
             dtype = 'float32'
             offset = 0
 
@@ -125,6 +152,9 @@ class TridesclousSorter(BaseSorter):
         params = dict(self.params)
 
         clean_catalogue_gui = params.pop('clean_catalogue_gui')
+        catalogue_from = params.pop('catalogue_from')
+        catalogue_refine_s = params.pop('catalogue_refine_s')
+        catalogue_keys = {}
         # make catalogue
         chan_grps = list(tdc_dataio.channel_groups.keys())
         for chan_grp in chan_grps:
@@ -141,26 +171,41 @@ class TridesclousSorter(BaseSorter):
                 print('peeler_params')
                 pprint(peeler_params)
 
-            cc = tdc.CatalogueConstructor(dataio=tdc_dataio, chan_grp=chan_grp)
-            tdc.apply_all_catalogue_steps(cc, catalogue_nested_params, verbose=self.verbose)
-
-            if clean_catalogue_gui:
-                import pyqtgraph as pg
-                app = pg.mkQApp()
-                win = tdc.CatalogueWindow(cc)
-                win.show()
-                app.exec_()
+            key = get_catalogue_key(tdc_dataio, chan_grp, self.params)
+            source = None
+            if catalogue_from is not None:
+                source = find_catalogue(catalogue_from, key)
+                if source is None:
+                    warnings.warn('No catalogue in {} matches the probe and params of channel group {}: '
+                                  'the catalogue is built'.format(catalogue_from, chan_grp))
+            catalogue_keys[str(chan_grp)] = {'key': key,
+                                          'from': str(source[0].absolute()) if source is not None else None}
+
+            if source is not None:
+                if self.verbose:
+                    print('Reuse catalogue', source[0])
+                reuse_catalogue(tdc_dataio, chan_grp, *source, catalogue_nested_params, refine_s=catalogue_refine_s)
+            else:
+                cc = tdc.CatalogueConstructor(dataio=tdc_dataio, chan_grp=chan_grp)
+                tdc.apply_all_catalogue_steps(cc, catalogue_nested_params, verbose=self.verbose)
+
+                if clean_catalogue_gui:
+                    import pyqtgraph as pg
+                    app = pg.mkQApp()
+                    win = tdc.CatalogueWindow(cc)
+                    win.show()
+                    app.exec_()
 
-            if self.verbose:
-                print(cc)
-            
-            if distutils.version.LooseVersion(tdc.__version__) < '1.6.0':
-                print('You should upgrade tridesclous')
-                t0 = time.perf_counter()
-                cc.make_catalogue_for_peeler()
                 if self.verbose:
-                    t1 = time.perf_counter()
-                    print('make_catalogue_for_peeler', t1-t0)
+                    print(cc)
+
+                if distutils.version.LooseVersion(tdc.__version__) < '1.6.0':
+                    print('You should upgrade tridesclous')
+                    t0 = time.perf_counter()
+                    cc.make_catalogue_for_peeler()
+                    if self.verbose:
+                        t1 = time.perf_counter()
+                        print('make_catalogue_for_peeler', t1-t0)
 
             # apply Peeler (template matching)
             initial_catalogue = tdc_dataio.load_catalogue(chan_grp=chan_grp)
@@ -172,13 +217,95 @@ class TridesclousSorter(BaseSorter):
                 t1 = time.perf_counter()
                 print('peeler.tun', t1-t0)
 
+        # the catalogues of this folder can be reused by the next runs (catalogue_from)
+        with open(str(output_folder / catalogues_filename), 'w', encoding='utf8') as f:
+            json.dump(catalogue_keys, f, indent=4)
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
         sorting = se.TridesclousSortingExtractor(folder_path=output_folder)
         return sorting
 
 
+catalogues_filename = 'spikeinterface_catalogues.json'
+# catalogue arrays with a channel axis (last), in units of the noise (signals_mads)
+_catalogue_template_keys = ['centers0', 'centers0_long', 'centers1', 'centers2', 'interp_centers0']
+
+
+def get_catalogue_key(tdc_dataio, chan_grp, params):
+    """
+    The key of the catalogue of a channel group: hash of the probe geometry, the sampling rate and the
+    preprocessing and detection params (TridesclousSorter.catalogue_key_params).
+    """
+    key = {name: params[name] for name in TridesclousSorter.catalogue_key_params}
+    key['geometry'] = np.round(tdc_dataio.get_geometry(chan_grp=chan_grp), 3).tolist()
+    key['sample_rate'] = float(tdc_dataio.sample_rate)
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def find_catalogue(folder, key):
+    """
+    Search the tridesclous output folders in folder (recursively) for the catalogue of a key.
+
+    Returns
+    -------
+    source: tuple (output_folder, chan_grp) or None
+    """
+    for catalogues_file in sorted(Path(folder).glob('**/' + catalogues_filename)):
+        with open(str(catalogues_file), 'r', encoding='utf8') as f:
+            catalogue_keys = json.load(f)
+        for chan_grp, entry in catalogue_keys.items():
+            catalogue_folder = catalogues_file.parent / 'channel_group_{}'.format(chan_grp) / 'catalogues' / 'initial'
+            if entry['key'] == key and catalogue_folder.is_dir():
+                return catalogues_file.parent, int(chan_grp)
+    return None
+
+
+def reuse_catalogue(tdc_dataio, chan_grp, source_folder, source_chan_grp, catalogue_nested_params, refine_s=10.):
+    """
+    Copy the catalogue of another tridesclous output folder for the Peeler of tdc_dataio.
+
+    With refine_s > 0, the noise (median and mad of the preprocessed signals) is estimated on the first
+    refine_s seconds of this recording and the templates are rescaled to it: the templates keep their
+    amplitude in signal units while the detection thresholds follow the noise of this recording.
+    """
+    catalogue_folder = Path(tdc_dataio.dirname) / 'channel_group_{}'.format(chan_grp) / 'catalogues' / 'initial'
+    if catalogue_folder.is_dir():
+        shutil.rmtree(str(catalogue_folder))
+    source_catalogue_folder = Path(source_folder) / 'channel_group_{}'.format(source_chan_grp) / 'catalogues' / 'initial'
+    shutil.copytree(str(source_catalogue_folder), str(catalogue_folder))
+    catalogue = tdc_dataio.load_catalogue(chan_grp=chan_grp)
+    catalogue['chan_grp'] = chan_grp
+    # no signal processed yet: the Peeler preprocesses the signals itself
+    for seg_num in range(tdc_dataio.nb_segment):
+        tdc_dataio.reset_processed_signals(seg_num=seg_num, chan_grp=chan_grp, dtype=catalogue['centers0'].dtype)
+
+    if refine_s is not None and refine_s > 0:
+        cc = tdc.CatalogueConstructor(dataio=tdc_dataio, chan_grp=chan_grp)
+        global_params = {k: catalogue_nested_params[k] for k in ('chunksize', 'mode', 'memory_mode', 'n_jobs')
+                         if k in catalogue_nested_params}
+        cc.set_global_params(**global_params)
+        # the preprocessing of the catalogue (also applied by the Peeler)
+        preprocessor_params = {k: v for k, v in catalogue['signal_preprocessor_params'].items()
+                               if k in ('engine', 'highpass_freq', 'lowpass_freq', 'smooth_size',
+                                        'common_ref_removal', 'pad_width')}
+        cc.set_preprocessor_params(**preprocessor_params)
+        duration = min(refine_s, tdc_dataio.get_segment_length(seg_num=0) / tdc_dataio.sample_rate * .99)
+        cc.estimate_signals_noise(seg_num=0, duration=duration)
+
+        # a waveform w in noise units becomes w * scale: the projections are rescaled so that the scalar
+        # products with the templates (and the boundaries) do not change
+        scale = catalogue['signals_mads'] / np.array(cc.signals_mads)
+        for name in _catalogue_template_keys:
+            if name in catalogue:
+                catalogue[name] = (catalogue[name] * scale).astype(catalogue[name].dtype)
+        catalogue['projections'] = (catalogue['projections'] / scale).astype(catalogue['projections'].dtype)
+        catalogue['signals_medians'] = np.array(cc.signals_medians, copy=True)
+        catalogue['signals_mads'] = np.array(cc.signals_mads, copy=True)
+
+    tdc_dataio.save_catalogue(catalogue, name='initial')
+
+
 def make_nested_tdc_params(tdc_dataio, chan_grp,
                            freq_min=400.,
                            freq_max=5000.,
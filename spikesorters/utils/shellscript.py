@@ -1,4 +1,7 @@
 import subprocess
+import asyncio
+import threading
+import functools
 import tempfile
 import shutil
 import signal
@@ -8,6 +11,18 @@ import time
 import sys
 from typing import Optional, List, Any, Union
 
+try:
+    import psutil
+    HAVE_PSUTIL = True
+except ImportError:
+    HAVE_PSUTIL = False
+
+try:
+    import resource
+    HAVE_RESOURCE = True
+except ImportError:
+    HAVE_RESOURCE = False
+
 PathType = Union[str, Path]
 
 
@@ -33,6 +48,7 @@ class ShellScript():
         self._files_to_remove: List[str] = []
         self._dirs_to_remove: List[str] = []
         self._start_time: Optional[float] = None
+        self._stop_reason: Optional[str] = None
         self._verbose = verbose
 
     def __del__(self):
@@ -50,7 +66,7 @@ class ShellScript():
             f.write(self._script)
         os.chmod(script_path, 0o744)
 
-    def start(self) -> None:
+    def _get_paths(self):
         if self._script_path is not None:
             script_path = Path(self._script_path)
             if script_path.suffix == '':
@@ -72,19 +88,137 @@ class ShellScript():
             script_log_path = Path(self._log_path)
             if script_path.suffix == '':
                 script_log_path = script_log_path.parent / (script_log_path.name + '.txt')
+        return script_path, script_log_path
+
+    def start(self, timeout_s: Optional[float] = None, max_memory_mb: Optional[float] = None,
+              check_interval_s: float = 1.) -> None:
+        """
+        Run the script and stream its output to the log (returns when the output is closed).
 
+        With timeout_s (wall-clock time in s) or max_memory_mb (resident memory of the script and
+        its children, checked every check_interval_s), the script is stopped with stop() when a limit
+        is exceeded and stopReason() returns 'timeout' or 'memory'.
+        Without psutil, max_memory_mb is a limit of the virtual memory of the script (setrlimit):
+        allocations beyond it fail in the script.
+        """
+        script_path, script_log_path = self._get_paths()
         self.write(script_path)
         cmd = str(script_path)
         print('RUNNING SHELL SCRIPT: ' + cmd)
         self._start_time = time.time()
+        self._stop_reason = None
         self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1,
-                                         universal_newlines=True)
+                                         universal_newlines=True, preexec_fn=_get_preexec_fn(max_memory_mb))
+        max_memory_bytes = _get_monitored_bytes(max_memory_mb)
+        if timeout_s is not None or max_memory_bytes is not None:
+            watchdog = threading.Thread(target=self._watch, args=(timeout_s, max_memory_bytes, check_interval_s),
+                                        daemon=True)
+            watchdog.start()
         with open(script_log_path, 'w+') as script_log_file:
             for line in self._process.stdout:
                 script_log_file.write(line)
                 if self._verbose:  # Print onto console depending on the verbose property passed on from the sorter class
                     print(line)
 
+    async def run_async(self, timeout_s: Optional[float] = None, max_memory_mb: Optional[float] = None,
+                        check_interval_s: float = 1.) -> int:
+        """
+        Same as start() + wait() but as a coroutine: the output is streamed to the log
+        without blocking the event loop. The process is stopped if the coroutine is cancelled.
+        The limits are the ones of start().
+        """
+        script_path, script_log_path = self._get_paths()
+        self.write(script_path)
+        cmd = str(script_path)
+        print('RUNNING SHELL SCRIPT: ' + cmd)
+        self._start_time = time.time()
+        self._stop_reason = None
+        process = await asyncio.create_subprocess_exec(cmd, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT,
+                                                       preexec_fn=_get_preexec_fn(max_memory_mb))
+        max_memory_bytes = _get_monitored_bytes(max_memory_mb)
+        watchdog = None
+        if timeout_s is not None or max_memory_bytes is not None:
+            watchdog = asyncio.ensure_future(self._watch_async(process, timeout_s, max_memory_bytes,
+                                                               check_interval_s))
+        try:
+            with open(script_log_path, 'w+') as script_log_file:
+                # read by chunks: a sorter can print long lines without new line (progress bars)
+                while True:
+                    chunk = await process.stdout.read(65536)
+                    if not chunk:
+                        break
+                    text = chunk.decode(errors='replace')
+                    script_log_file.write(text)
+                    if self._verbose:
+                        print(text, end='')
+            retcode = await process.wait()
+            if watchdog is not None and self._stop_reason is not None:
+                # the children of the script may still be stopping
+                await watchdog
+            return retcode
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        finally:
+            if watchdog is not None and not watchdog.done():
+                watchdog.cancel()
+
+    def _check_limits(self, pid, timeout_s, max_memory_bytes):
+        # the name of the exceeded limit or None
+        if timeout_s is not None and self.elapsedTimeSinceStart() > timeout_s:
+            return 'timeout'
+        if max_memory_bytes is not None and _get_tree_rss(pid) > max_memory_bytes:
+            return 'memory'
+        return None
+
+    def _get_check_delay(self, timeout_s, check_interval_s):
+        # the timeout is checked on time even with a long check interval
+        if timeout_s is None:
+            return check_interval_s
+        return max(min(check_interval_s, timeout_s - self.elapsedTimeSinceStart()), 0.01)
+
+    def _watch(self, timeout_s, max_memory_bytes, check_interval_s):
+        # watchdog thread of start()
+        while self.isRunning():
+            reason = self._check_limits(self._process.pid, timeout_s, max_memory_bytes)
+            if reason is not None:
+                self._stop_reason = reason
+                print('STOPPING SHELL SCRIPT ({} exceeded): pid {}'.format(reason, self._process.pid))
+                self.stop()
+                return
+            time.sleep(self._get_check_delay(timeout_s, check_interval_s))
+
+    async def _watch_async(self, process, timeout_s, max_memory_bytes, check_interval_s):
+        # watchdog task of run_async(), with the escalation of stop()
+        while process.returncode is None:
+            reason = self._check_limits(process.pid, timeout_s, max_memory_bytes)
+            if reason is not None:
+                self._stop_reason = reason
+                print('STOPPING SHELL SCRIPT ({} exceeded): pid {}'.format(reason, process.pid))
+                children = _get_children(process.pid)
+                for signal0 in self._get_stop_signals():
+                    _send_signal(children, signal0)
+                    if process.returncode is None:
+                        try:
+                            process.send_signal(signal0)
+                        except ProcessLookupError:
+                            pass
+                    try:
+                        await asyncio.wait_for(process.wait(), timeout=0.02)
+                    except asyncio.TimeoutError:
+                        continue
+                    if not any(_is_alive(child) for child in children):
+                        return
+                return
+            await asyncio.sleep(self._get_check_delay(timeout_s, check_interval_s))
+
+    def stopReason(self) -> Optional[str]:
+        # 'timeout' or 'memory' when the script was stopped because it exceeded a limit of start()
+        return self._stop_reason
+
     def wait(self, timeout=None) -> Optional[int]:
         if not self.isRunning():
             return self.returnCode()
@@ -101,20 +235,27 @@ class ShellScript():
         for dirpath in self._dirs_to_remove:
             _rmdir_with_retries(str(dirpath), num_retries=5)
 
+    @staticmethod
+    def _get_stop_signals():
+        return [signal.SIGINT] * 10 + [signal.SIGTERM] * 10 + [signal.SIGKILL] * 10
+
     def stop(self) -> None:
         if not self.isRunning():
             return
         assert self._process is not None, "Unexpected self._process is None even though it is running."
 
-        signals = [signal.SIGINT] * 10 + [signal.SIGTERM] * 10 + [signal.SIGKILL] * 10
-
-        for signal0 in signals:
-            self._process.send_signal(signal0)
+        # the children (matlab, mpirun...) are signaled too: a shell waiting for a command ignores signals
+        children = _get_children(self._process.pid)
+        for signal0 in self._get_stop_signals():
+            _send_signal(children, signal0)
+            if self.isRunning():
+                self._process.send_signal(signal0)
             try:
                 self._process.wait(timeout=0.02)
-                return
             except:
-                pass
+                continue
+            if not any(_is_alive(child) for child in children):
+                return
 
     def kill(self) -> None:
         if not self.isRunning():
@@ -181,6 +322,66 @@ class ShellScript():
         return ii
 
 
+def _get_children(pid):
+    # all the descendants of a process (empty without psutil)
+    if not HAVE_PSUTIL:
+        return []
+    try:
+        return psutil.Process(pid).children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+def _is_alive(proc):
+    try:
+        return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
+def _send_signal(procs, sig):
+    for proc in procs:
+        if _is_alive(proc):
+            try:
+                proc.send_signal(sig)
+            except psutil.Error:
+                pass
+
+
+def _get_tree_rss(pid):
+    # resident memory in bytes of a process and its descendants
+    try:
+        parent = psutil.Process(pid)
+        procs = [parent] + parent.children(recursive=True)
+    except psutil.Error:
+        return 0
+    rss = 0
+    for proc in procs:
+        try:
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+def _get_monitored_bytes(max_memory_mb):
+    # the memory limit checked by the watchdogs (with psutil)
+    if max_memory_mb is None or not HAVE_PSUTIL:
+        return None
+    return int(max_memory_mb * 1024 ** 2)
+
+
+def _limit_address_space(max_bytes):
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def _get_preexec_fn(max_memory_mb):
+    # without psutil the memory limit is set in the child, before exec
+    if max_memory_mb is None or HAVE_PSUTIL or not HAVE_RESOURCE:
+        return None
+    return functools.partial(_limit_address_space, int(max_memory_mb * 1024 ** 2))
+
+
 def _rmdir_with_retries(dirname, num_retries, delay_between_tries=1):
     for retry_num in range(1, num_retries + 1):
         if not os.path.exists(dirname):
@@ -7,8 +7,8 @@ from scipy.io import savemat
 
 import spikeextractors as se
 from ..basesorter import BaseSorter
+from ..resources import make_estimate, get_recording_bytes, matlab_ram_bytes
 from ..utils.shellscript import ShellScript
-from ..sorter_tools import recover_recording
 
 
 def check_if_installed(waveclus_path: Union[str, None]):
@@ -33,6 +33,9 @@ class WaveClusSorter(BaseSorter):
     sorter_name: str = 'waveclus'
     waveclus_path: Union[str, None] = os.getenv('WAVECLUS_PATH', None)
     requires_locations = False
+    cost_coefficient = 0.3
+    uses_matlab = True
+    intermediate_files = ['raw*.mat']
 
     _default_params = {
         'detect_threshold': 5,
@@ -129,6 +132,14 @@ class WaveClusSorter(BaseSorter):
         except Exception as e:
             print("Could not set WAVECLUS_PATH environment variable:", e)
 
+    @classmethod
+    def estimate_resources(cls, recording, params):
+        # one raw*.mat per channel with the recording dtype, each channel is loaded at once
+        nbytes = get_recording_bytes(recording)
+        channel_nbytes = nbytes // recording.get_num_channels()
+        return make_estimate(disk_bytes=nbytes, scratch_bytes=nbytes,
+                             peak_ram_bytes=matlab_ram_bytes + 2 * channel_nbytes)
+
     def _setup_recording(self, recording, output_folder):
         if not self.is_installed():
             raise Exception(WaveClusSorter.installation_mesg)
@@ -140,9 +151,7 @@ class WaveClusSorter(BaseSorter):
             savemat(vcFile_mat,
                     {'data': recording.get_traces(channel_ids=[id]), 'sr': recording.get_sampling_frequency()})
 
-    def _run(self, recording, output_folder):
-        recording = recover_recording(recording)
-
+    def _prepare_script(self, recording, output_folder):
         source_dir = Path(__file__).parent
         p = self.params.copy()
 
@@ -231,19 +240,18 @@ class WaveClusSorter(BaseSorter):
             '''.format(tmpdir=tmpdir)
         shell_cmd = ShellScript(shell_cmd, script_path=output_folder / f'run_{self.sorter_name}',
                                 log_path=output_folder / f'{self.sorter_name}.log', verbose=self.verbose)
-        shell_cmd.start()
-
-        retcode = shell_cmd.wait()
+        return shell_cmd
 
+    def _finalize_run(self, recording, output_folder, retcode):
         if retcode != 0:
             raise Exception('waveclus returned a non-zero exit code')
 
-        result_fname = str(tmpdir / 'times_results.mat')
+        result_fname = str(output_folder / 'times_results.mat')
         if not os.path.exists(result_fname):
             raise Exception('Result file does not exist: ' + result_fname)
 
     @staticmethod
-    def get_result_from_folder(output_folder):
+    def _get_result_from_folder(output_folder):
 
         output_folder = Path(output_folder)
         result_fname = str(output_folder / 'times_results.mat')
@@ -0,0 +1,28 @@
+"""
+Worker of run_sorters(engine='filequeue'), see filequeue.py:
+
+    python -m spikesorters.worker <queue_folder> [--max-tasks N] [--idle-timeout S]
+"""
+import argparse
+
+from .filequeue import run_worker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spikesorters.worker',
+                                     description='Run the spike sorting tasks of a queue folder')
+    parser.add_argument('queue_folder', help='The queue folder (engine_kwargs["queue_folder"] of run_sorters())')
+    parser.add_argument('--max-tasks', type=int, default=None, help='Exit after this number of tasks')
+    parser.add_argument('--idle-timeout', type=float, default=None,
+                        help='Exit after this time in s without task (default: never)')
+    parser.add_argument('--heartbeat', type=float, default=10., help='Heartbeat interval in s')
+    parser.add_argument('--stale', type=float, default=120.,
+                        help='Claims without heartbeat for this time in s are requeued')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    run_worker(args.queue_folder, max_tasks=args.max_tasks, idle_timeout=args.idle_timeout,
+               heartbeat_s=args.heartbeat, stale_s=args.stale, verbose=not args.quiet)
+
+
+if __name__ == '__main__':
+    main()